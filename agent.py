@@ -1,63 +1,42 @@
 # agent.py
-import json
-from langchain.agents import create_openai_functions_agent
-from langchain.prompts import ChatPromptTemplate
-from langchain_openai import AzureChatOpenAI
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from contextvars import ContextVar
+from types import SimpleNamespace
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from cosmos_profile import ProfileChange
 from tools import update_profile
-from functools import partial
-from langchain.agents import Tool
-from utils.dbutils import get_user_profile
-
-
-
-def get_tools_for_user(user_id: str):
-    return [
-        Tool.from_function(
-            name="AddToListField",
-            func=partial(update_profile.add_to_list_field, user_id),
-            description="Add an item to a list field. Args: field_name, item"
-        ),
-        Tool.from_function(
-            name="RemoveFromListField",
-            func=partial(update_profile.remove_from_list_field, user_id),
-            description="Remove an item from a list field. Args: field_name, item"
-        ),
-        Tool.from_function(
-            name="SetStringField",
-            func=partial(update_profile.set_string_field, user_id),
-            description="Set a string field. Args: field_name, value"
-        ),
-        Tool.from_function(
-            name="AddPendingQuestion",
-            func=partial(update_profile.add_to_list_field, user_id),
-            description=(
-                "Store a question that the agent should ask the user in the next conversation. "
-                "Args: field_name=pending_questions, item"
-            )
-        ),
-        Tool.from_function(
-    name="RemovePendingQuestion",
-    func=partial(update_profile.remove_from_list_field, user_id),
-    description=(
-        "Remove a previously stored pending question after it has been answered. "
-        "Args: field_name=pending_questions, item"
-    )
+from utils import intent_router, pending_questions, resume_ingest
+from utils.background_jobs import get_job_queue
+from utils.conversation_memory import DEFAULT_SESSION, MEMORY_RECENT_TURNS, get_conversation_memory
+from utils.dbutils import aget_user_profile, get_user_profile
+from utils.metrics import span
+from utils.profile_index import PARAGRAPH_FIELDS, PROFILE_CONTEXT_TOP_K, get_profile_index
+from utils.prompt_context import PROFILE_CONTEXT_TOKEN_BUDGET, render_profile_context
+from utils.response_cache import CachedResponse, config_fingerprint, get_response_cache
+from utils.tool_loop import (
+    AGENT_MAX_STEPS,
+    AGENT_TIME_BUDGET,
+    LoopState,
+    ToolLoop,
+    default_conflict_key,
+    planned_actions,
+    response_text,
+    tool_call,
 )
-    ]
 
-def run_agent(prompt: str, user_id: str) -> str:
-    """
-    Runs the agent with the provided prompt and user ID.
-    
-    Args:
-        prompt (str): The natural language input from the user.
-        user_id (str): The ID of the user whose profile is being updated.
+logger = logging.getLogger(__name__)
 
-    Returns:
-        str: The output from the agent after processing the prompt.
-    """
-    
-    system_prompt = """
+
+SYSTEM_PROMPT = """
 You are an intelligent assistant that helps users build a professional profile by extracting structured data from their conversation.
 
 The profile has the following schema:
@@ -71,46 +50,743 @@ Each time the user shares information, determine if it maps to any field and cal
 - Be cautious with partial or vague responses. Ask clarifying questions if needed.
 - Assume user identity is known (user_id is handled by backend)
 
-If the user answers a question that was previously stored in `pending_questions`, 
+If the user answers one of the pending questions listed before their message,
 call RemovePendingQuestion with that question text to remove it from the list.
 
 """
-    prompt_template = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("user", "{prompt}")
-    ])
 
-     # Fetch user profile if needed, can be used for context in the agent
-    user_profile = get_user_profile(user_id)
-    tools = get_tools_for_user(user_id)
+# The user whose profile the tools act on. Set by run_agent for the duration
+# of a turn so the tools and the compiled agent can be shared across requests.
+_current_user_id: ContextVar[str] = ContextVar("current_user_id")
+
+
+def _add_to_list_field(field_name: str, item: str) -> str:
+    return update_profile.add_to_list_field(_current_user_id.get(), field_name=field_name, item=item)
+
+
+def _remove_from_list_field(field_name: str, item: str) -> str:
+    return update_profile.remove_from_list_field(_current_user_id.get(), field_name=field_name, item=item)
+
+
+def _set_string_field(field_name: str, value: str) -> str:
+    return update_profile.set_string_field(_current_user_id.get(), field_name=field_name, value=value)
+
 
+def _add_pending_question(question: str, priority: int = 0) -> str:
+    return update_profile.add_pending_question(_current_user_id.get(), question=question, priority=priority)
 
-    context = {
-    "user_profile": json.dumps(user_profile, indent=2),
-    "prompt": prompt
+
+def _remove_pending_question(question: str) -> str:
+    return update_profile.remove_pending_question(_current_user_id.get(), question=question)
+
+
+TOOL_SPECS = [
+    ("AddToListField", _add_to_list_field, "Add an item to a list field. Args: field_name, item"),
+    ("RemoveFromListField", _remove_from_list_field, "Remove an item from a list field. Args: field_name, item"),
+    ("SetStringField", _set_string_field, "Set a string field. Args: field_name, value"),
+    (
+        "AddPendingQuestion",
+        _add_pending_question,
+        "Store a question that the agent should ask the user in the next conversation. "
+        "Args: question, priority (optional integer, higher is asked first)",
+    ),
+    (
+        "RemovePendingQuestion",
+        _remove_pending_question,
+        "Remove a previously stored pending question after it has been answered. "
+        "Args: question",
+    ),
+]
+
+PROMPT_MESSAGES = [
+    ("system", SYSTEM_PROMPT),
+    ("system", "The user's current profile (JSON, empty fields omitted):\n{profile_context}"),
+    ("system", "The conversation so far:\n{conversation}"),
+    ("user", "{input}"),
+]
+
+MODEL_CONFIG = {
+    "azure_deployment": "gpt-35-turbo",  # replace with your actual deployment name
+    "temperature": 0,
 }
 
-    llm = AzureChatOpenAI(
-        # Removed openai_api_version as it is not a valid parameter
-        azure_deployment="gpt-35-turbo",         # replace with your actual deployment name
-        temperature=0
+# Everything besides the prompt and profile that decides what the model
+# answers; cached responses are only reused under the same fingerprint.
+MODEL_FINGERPRINT = config_fingerprint({
+    **MODEL_CONFIG,
+    "prompt": PROMPT_MESSAGES,
+    "tools": [(name, description) for name, _, description in TOOL_SPECS],
+    "profile_context_top_k": PROFILE_CONTEXT_TOP_K,
+    "profile_context_budget": PROFILE_CONTEXT_TOKEN_BUDGET,
+    "memory_recent_turns": MEMORY_RECENT_TURNS,
+    "agent": "openai-tools",
+    "agent_max_steps": AGENT_MAX_STEPS,
+    "agent_time_budget": AGENT_TIME_BUDGET,
+})
+
+# LangChain takes about a second to import, so the tools, prompt template
+# and callback handlers are built on first use instead of at import time
+# (gunicorn.conf.py warms them up right after each worker forks).
+_langchain = None
+_langchain_lock = threading.Lock()
+
+
+def _conflict_key(call: Dict[str, Any]) -> str:
+    # Both pending-question tools rewrite the same queue document.
+    if call["tool"] in ("AddPendingQuestion", "RemovePendingQuestion"):
+        return "pending_questions"
+    return default_conflict_key(call)
+
+
+def _build_langchain() -> SimpleNamespace:
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.tools import StructuredTool
+    from utils.llm_callbacks import UsageHandler
+
+    tools = [StructuredTool.from_function(name=name, func=func, description=description) for name, func, description in TOOL_SPECS]
+    tools_by_name = {tool.name: tool for tool in tools}
+    return SimpleNamespace(
+        tools=tools,
+        tools_by_name=tools_by_name,
+        loop=ToolLoop(tools_by_name, conflict_key=_conflict_key),
+        prompt=ChatPromptTemplate.from_messages([*PROMPT_MESSAGES, MessagesPlaceholder("agent_scratchpad")]),
+        usage_handler=UsageHandler(),
     )
 
 
-    agent = create_openai_functions_agent(llm=llm, tools=tools, prompt=prompt_template)
+def _lc() -> SimpleNamespace:
+    global _langchain
+    if _langchain is None:
+        with _langchain_lock:
+            if _langchain is None:
+                _langchain = _build_langchain()
+    return _langchain
+
+
+_LAZY_ATTRIBUTES = {"TOOLS": "tools", "PROMPT_TEMPLATE": "prompt", "_usage_handler": "usage_handler"}
+
+
+def __getattr__(name: str) -> Any:
+    # The LangChain objects stay reachable under their module-level names.
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(_lc(), _LAZY_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# One model client (and its connection pool) and one compiled agent per worker process.
+_agent = None
+_agent_lock = threading.Lock()
+
+
+def _build_llm():
+    from langchain_openai import AzureChatOpenAI
+
+    # Removed openai_api_version as it is not a valid parameter
+    return AzureChatOpenAI(**MODEL_CONFIG)
 
 
-    # Load profile to fetch pending questions
-    pending = user_profile.get("pending_questions", []) if user_profile else []
+def get_agent():
+    """Return the worker-wide agent runnable, building it on first use."""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                with span("agent_build"):
+                    # The tools agent can plan several tool calls in one step.
+                    from langchain.agents import create_openai_tools_agent
+
+                    lc = _lc()
+                    _agent = create_openai_tools_agent(llm=_build_llm(), tools=lc.tools, prompt=lc.prompt)
+    return _agent
+
+
+PARAGRAPH_INDEX_JOB = "paragraph_index"
+
+
+def _refresh_paragraph_index(user_id: str, payload: Any) -> None:
+    profile = get_user_profile(user_id)
+    if not profile:
+        raise RuntimeError(f"profile of {user_id} could not be read")
+    get_profile_index().refresh(user_id, profile)
+
+
+def _queue_paragraph_refresh(user_id: str, changes: List[ProfileChange]) -> None:
+    # Embedding new paragraphs takes a model call; do it after the reply.
+    if any(change.field in PARAGRAPH_FIELDS for change in changes):
+        get_job_queue().enqueue(PARAGRAPH_INDEX_JOB, user_id)
+
+
+get_job_queue().register(PARAGRAPH_INDEX_JOB, _refresh_paragraph_index)
+update_profile.add_change_listener(_queue_paragraph_refresh)
+
+_summary_llm = None
+
+
+def _summarize(prompt: str) -> str:
+    """Plain model call (no tools) used to fold old turns into a conversation summary."""
+    global _summary_llm
+    if _summary_llm is None:
+        with _agent_lock:
+            if _summary_llm is None:
+                _summary_llm = _build_llm()
+    return response_text(_summary_llm.invoke(prompt))
+
+
+get_conversation_memory().set_summarizer(_summarize)
+
+
+def _profile_context(user_id: str, user_profile: dict, prompt: str) -> str:
+    """
+    Serialise the profile for the prompt.
+
+    Of the (potentially many) experience and project paragraphs only the
+    ones most relevant to `prompt` are kept, and the result is rendered
+    compactly within the profile-context token budget.
+    """
+    if not user_profile:
+        return "{}"
+    try:
+        paragraphs = get_profile_index().relevant_paragraphs(user_id, user_profile, prompt, PROFILE_CONTEXT_TOP_K)
+    except Exception as e:
+        logger.error("Paragraph retrieval failed for %s: %s", user_id, e)
+        paragraphs = {
+            field: (user_profile.get(field) or [])[-PROFILE_CONTEXT_TOP_K:]
+            for field in PARAGRAPH_FIELDS
+        }
+    return render_profile_context(user_profile, {field: paragraphs.get(field, []) for field in PARAGRAPH_FIELDS})
+
+
+def _build_inputs(prompt: str, user_id: str, user_profile: dict, pending: List[str], conversation: str) -> Dict[str, Any]:
+    return {
+        "input": _build_full_prompt(prompt, pending),
+        "profile_context": _profile_context(user_id, user_profile, prompt),
+        "conversation": conversation,
+    }
+
+
+def _state_version(profile_version: Optional[str], memory_version: Optional[str]) -> Optional[str]:
+    """Cache version of what the model sees besides the prompt: the profile and the conversation."""
+    return f"{profile_version}|{memory_version}" if profile_version and memory_version else None
+
+
+def _model_prompt(routed: intent_router.RouteResult, edits: Optional[List[str]] = None) -> str:
+    """The part of the prompt the model still has to handle, noting edits already made locally."""
+    if not routed.commands:
+        return routed.remainder
+    return f"(Already applied: {intent_router.summarize(routed.commands, edits)})\n{routed.remainder}"
+
+
+def _join_replies(routed: intent_router.RouteResult, edits: Optional[List[str]], reply: str) -> str:
+    return f"{intent_router.summarize(routed.commands, edits)} {reply}" if routed.commands else reply
+
+
+def _build_full_prompt(prompt: str, pending: List[str]) -> str:
     # If any pending questions exist, prepend them
     if pending:
-        preamble = "Before we continue, I still need to ask:\n" + "\n".join(f"- {q}" for q in pending[:3])
-        full_prompt = preamble + "\n\n" + prompt
-    else:
-        full_prompt = prompt
+        preamble = "Before we continue, I still need to ask:\n" + "\n".join(f"- {q}" for q in pending)
+        return preamble + "\n\n" + prompt
+    return prompt
+
+
+def _reply(result: CachedResponse, outputs: List[str]) -> str:
+    return result.reply or " ".join(outputs)
+
+
+def run_agent(prompt: str, user_id: str, session_id: str = DEFAULT_SESSION) -> str:
+    """
+    Runs the agent with the provided prompt and user ID.
+    
+    Args:
+        prompt (str): The natural language input from the user.
+        user_id (str): The ID of the user whose profile is being updated.
+        session_id (str): The conversation the turn belongs to; its recent
+            turns and summary are given to the model.
+
+    Returns:
+        str: The output from the agent after processing the prompt.
+    """
+    routed = intent_router.route(prompt)
+    cache = get_response_cache()
+    memory = get_conversation_memory()
+    token = _current_user_id.set(user_id)
+    try:
+        # Tools mutate one in-memory copy of the profile; it is written once when the turn ends.
+        with update_profile.profile_turn(user_id) as turn:
+            # Simple structured edits are applied locally; only the rest goes to the model.
+            edits = intent_router.apply(user_id, routed.commands)
+            if routed.fully_handled:
+                reply = intent_router.summarize(routed.commands, edits)
+                memory.record(user_id, session_id, prompt, reply)
+                return reply
+            model_prompt = _model_prompt(routed, edits)
+            # The turn's copy, so the profile is read once and the model sees the routed edits.
+            user_profile = turn.snapshot()
+            pending = pending_questions.head(user_id)
+            conversation, memory_version = memory.context(user_id, session_id)
+            etag = user_profile.get("_etag")
+            version = _state_version(etag, memory_version)
+            # A repeat of this prompt (and preamble) against the same profile and conversation replays the cached plan.
+            cache_prompt = _build_full_prompt(model_prompt, pending)
+            result = cache.get(user_id, cache_prompt, version, MODEL_FINGERPRINT)
+            hit = result is not None
+            if not hit:
+                started = time.perf_counter()
+                inputs = _build_inputs(model_prompt, user_id, user_profile, pending, conversation)
+                config = {"callbacks": [_lc().usage_handler]}
+                loop = _lc().loop.run(lambda steps: get_agent().invoke({**inputs, "intermediate_steps": steps}, config=config))
+                result = CachedResponse(loop.reply, loop.tool_calls, time.perf_counter() - started)
+                outputs = loop.outputs
+            else:
+                outputs = _lc().loop.execute(result.tool_calls)
+        reply = _join_replies(routed, edits, _reply(result, outputs))
+        memory_version = memory.record(user_id, session_id, prompt, reply)
+        if not hit:
+            # Also under the post-turn versions, so an immediate retry hits.
+            after = _state_version(turn.version or etag, memory_version)
+            cache.put(user_id, cache_prompt, (version, after), MODEL_FINGERPRINT, result)
+        return reply
+    except Exception as e:
+        logger.error("Agent failed: %s", e)
+        return "Sorry, something went wrong while processing your request."
+    finally:
+        _current_user_id.reset(token)
+
+
+async def arun_agent(prompt: str, user_id: str, session_id: str = DEFAULT_SESSION) -> str:
+    """
+    Async variant of `run_agent`.
+
+    The profile is read with the async Cosmos client and the model is
+    called with `ainvoke`, so an event-loop worker can hold many turns in
+    flight while they wait on Cosmos and Azure OpenAI.
+    """
+    routed = intent_router.route(prompt)
+    cache = get_response_cache()
+    memory = get_conversation_memory()
+    token = _current_user_id.set(user_id)
     try:
-        response = agent.invoke({"input": full_prompt})
-        return response.content if hasattr(response, "content") else str(response)
+        async with update_profile.aprofile_turn(user_id) as turn:
+            edits = []
+            if routed.commands:
+                edits = await asyncio.to_thread(intent_router.apply, user_id, routed.commands)
+            if routed.fully_handled:
+                reply = intent_router.summarize(routed.commands, edits)
+                await asyncio.to_thread(memory.record, user_id, session_id, prompt, reply)
+                return reply
+            model_prompt = _model_prompt(routed, edits)
+            # One profile read per turn: the turn's copy if the routed edits loaded it,
+            # else an async read that the turn's tool calls then reuse.
+            read = asyncio.to_thread(turn.snapshot) if turn.loaded else aget_user_profile(user_id)
+            user_profile, pending, (conversation, memory_version) = await asyncio.gather(
+                read,
+                pending_questions.ahead(user_id),
+                asyncio.to_thread(memory.context, user_id, session_id),
+            )
+            turn.seed(user_profile)
+            etag = user_profile.get("_etag")
+            version = _state_version(etag, memory_version)
+            cache_prompt = _build_full_prompt(model_prompt, pending)
+            # With a shared store these are SQLite queries, which must not block the loop.
+            result = await asyncio.to_thread(cache.get, user_id, cache_prompt, version, MODEL_FINGERPRINT)
+            hit = result is not None
+            if not hit:
+                started = time.perf_counter()
+                # Paragraph retrieval may call the embedding service; keep it off the loop.
+                inputs = await asyncio.to_thread(_build_inputs, model_prompt, user_id, user_profile, pending, conversation)
+                config = {"callbacks": [_lc().usage_handler]}
+
+                async def plan(steps):
+                    return await get_agent().ainvoke({**inputs, "intermediate_steps": steps}, config=config)
+
+                loop = await _lc().loop.arun(plan)
+                result = CachedResponse(loop.reply, loop.tool_calls, time.perf_counter() - started)
+                outputs = loop.outputs
+            else:
+                outputs = await asyncio.to_thread(_lc().loop.execute, result.tool_calls) if result.tool_calls else []
+        reply = _join_replies(routed, edits, _reply(result, outputs))
+        memory_version = await asyncio.to_thread(memory.record, user_id, session_id, prompt, reply)
+        if not hit:
+            after = _state_version(turn.version or etag, memory_version)
+            await asyncio.to_thread(cache.put, user_id, cache_prompt, (version, after), MODEL_FINGERPRINT, result)
+        return reply
     except Exception as e:
-        print(f"[ERROR] Agent failed: {e}")
+        logger.error("Agent failed: %s", e)
         return "Sorry, something went wrong while processing your request."
+    finally:
+        _current_user_id.reset(token)
+
+
+def stream_agent(prompt: str, user_id: str, session_id: str = DEFAULT_SESSION) -> Iterator[Dict[str, Any]]:
+    """
+    Run the agent like `run_agent`, yielding events as they happen.
+
+    Events are dicts with an `event` name and a JSON-serialisable `data`
+    payload: `token` for each model token, `tool_call` for each tool the
+    model decided to call, `tool` for each tool result (after each step of
+    the tool loop), and a final `done` (with the full response) or `error`.
+    """
+    from utils.llm_callbacks import StreamEventHandler
+
+    events: "queue.Queue[Dict[str, Any] | None]" = queue.Queue()
+    handler = StreamEventHandler(events)
+    memory = get_conversation_memory()
+
+    def turn() -> None:
+        token = _current_user_id.set(user_id)
+        try:
+            routed = intent_router.route(prompt)
+            result = None
+            with update_profile.profile_turn(user_id) as profile:
+                edits = intent_router.apply(user_id, routed.commands)
+                for command, output in zip(routed.commands, edits):
+                    events.put({"event": "tool", "data": {"name": command.tool, "output": output}})
+                if not routed.fully_handled:
+                    conversation, _ = memory.context(user_id, session_id)
+                    inputs = _build_inputs(
+                        _model_prompt(routed, edits), user_id, profile.snapshot(), pending_questions.head(user_id), conversation
+                    )
+                    config = {"callbacks": [handler, _lc().usage_handler]}
+
+                    def plan(steps):
+                        # stream() drives the model's streaming API, so tokens reach
+                        # the handler as they arrive; the last chunk is the plan.
+                        response = None
+                        for response in get_agent().stream({**inputs, "intermediate_steps": steps}, config=config):
+                            pass
+                        return response
+
+                    def on_step(calls, outputs):
+                        for call, output in zip(calls, outputs):
+                            events.put({"event": "tool_call", "data": call})
+                            events.put({"event": "tool", "data": {"name": call["tool"], "output": output}})
+
+                    result = _lc().loop.run(plan, on_step)
+            if routed.fully_handled:
+                reply, tool_calls = intent_router.summarize(routed.commands, edits), []
+            else:
+                reply, tool_calls = _join_replies(routed, edits, _reply(result, result.outputs)), result.tool_calls
+            memory.record(user_id, session_id, prompt, reply)
+            events.put({"event": "done", "data": {"response": reply, "tool_calls": tool_calls}})
+        except Exception as e:
+            logger.error("Agent stream failed: %s", e)
+            events.put({"event": "error", "data": {"error": "Sorry, something went wrong while processing your request."}})
+        finally:
+            _current_user_id.reset(token)
+            events.put(None)
+
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(turn,), daemon=True)
+    worker.start()
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        yield event
+    worker.join()
+
+
+# Users whose prompts a batch works on at once; each has one model call in flight.
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "5000"))
+
+
+def _routed_tool_calls(commands: List[intent_router.RoutedCommand]) -> List[Dict[str, Any]]:
+    # Reported under the model's tool names, like the calls the model plans.
+    calls = []
+    for command in commands:
+        name = "".join(part.title() for part in command.tool.split("_"))
+        value_arg = "value" if command.tool == "set_string_field" else "item"
+        calls.append({"tool": name, "args": {"field_name": command.field, value_arg: command.value}})
+    return calls
+
+
+class _BatchTurn:
+    """One prompt of a batch that is waiting on the model."""
+
+    def __init__(
+        self,
+        index: int,
+        routed: intent_router.RouteResult,
+        edits: Optional[List[str]],
+        inputs: Dict[str, Any],
+        state: LoopState,
+    ):
+        self.index = index
+        self.routed = routed
+        self.edits = edits
+        self.inputs = inputs
+        self.state = state
+
+
+class _BatchUser:
+    """
+    A user's share of a batch.
+
+    Their prompts run in order, inside one profile turn: the profile is read
+    once, every prompt sees the edits of the ones before it, and the changes
+    are written once when the user is closed.  The turn and the current user
+    live in a context of their own so the tools can run on any thread.
+    """
+
+    def __init__(self, user_id: str, prompts: List[Tuple[int, str]]):
+        self.user_id = user_id
+        self.prompts: Deque[Tuple[int, str]] = deque(prompts)
+        self.current: Optional[_BatchTurn] = None
+        self.context = contextvars.copy_context()
+        self._stack = ExitStack()
+        self.pending: List[str] = []
+
+    def open(self) -> None:
+        self.context.run(_current_user_id.set, self.user_id)
+        self.turn = self.context.run(self._stack.enter_context, update_profile.profile_turn(self.user_id))
+        self.turn.snapshot()  # the one profile read
+        self.pending = pending_questions.head(self.user_id)
+
+    def close(self) -> bool:
+        """Write the user's changes; True if there were any."""
+        written = self.turn.dirty
+        self.context.run(self._stack.close)
+        return written
+
+
+def _batch_result(index: int, user_id: str, response: str, tool_calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"event": "result", "data": {"index": index, "user_id": user_id, "response": response, "tool_calls": tool_calls}}
+
+
+def _batch_error(user_id: str, error: str, index: Optional[int] = None) -> Dict[str, Any]:
+    data = {"user_id": user_id, "error": error}
+    if index is not None:
+        data["index"] = index
+    return {"event": "error", "data": data}
+
+
+def _next_batch_turn(user: _BatchUser, dry_run: bool) -> List[Dict[str, Any]]:
+    """
+    Move `user` on to their next prompt that needs the model.
+
+    Returns the events of prompts the intent router handled on its own and,
+    once the user has no prompts left, of closing them.
+    """
+    events = []
+    user.current = None
+    while user.prompts:
+        index, prompt = user.prompts.popleft()
+        routed = intent_router.route(prompt)
+        # A dry run reports the routed edits without applying them.
+        edits = None
+        if routed.commands and not dry_run:
+            edits = user.context.run(intent_router.apply, user.user_id, routed.commands)
+        if routed.fully_handled:
+            reply = intent_router.summarize(routed.commands, edits)
+            events.append(_batch_result(index, user.user_id, reply, _routed_tool_calls(routed.commands)))
+            continue
+        try:
+            # Batch turns replay stored messages outside any live conversation.
+            inputs = user.context.run(_build_inputs, _model_prompt(routed, edits), user.user_id, user.turn.snapshot(), user.pending, "")
+        except Exception as e:
+            logger.error("Batch prompt %d for %s failed: %s", index, user.user_id, e)
+            events.append(_batch_error(user.user_id, "Could not build the prompt.", index))
+            continue
+        user.current = _BatchTurn(index, routed, edits, inputs, _lc().loop.start())
+        return events
+    try:
+        written = user.close()
+    except Exception as e:
+        logger.error("Batch write for %s failed: %s", user.user_id, e)
+        return events + [_batch_error(user.user_id, "Profile write failed.")]
+    if not dry_run:
+        events.append({"event": "saved", "data": {"user_id": user.user_id, "written": written}})
+    return events
+
+
+def _start_batch_user(user: _BatchUser, dry_run: bool) -> List[Dict[str, Any]]:
+    try:
+        user.open()
+    except Exception as e:
+        logger.error("Batch could not load %s: %s", user.user_id, e)
+        user.prompts.clear()
+        return [_batch_error(user.user_id, "Profile read failed.")]
+    return _next_batch_turn(user, dry_run)
+
+
+def _step_batch_user(user: _BatchUser, response: Any, dry_run: bool) -> List[Dict[str, Any]]:
+    """Handle the model's plan for the user's current prompt."""
+    turn = user.current
+    routed_calls = _routed_tool_calls(turn.routed.commands)
+    if isinstance(response, Exception):
+        logger.error("Batch prompt %d for %s failed: %s", turn.index, user.user_id, response)
+        events = [_batch_error(user.user_id, "Sorry, something went wrong while processing your request.", turn.index)]
+    elif dry_run:
+        # Report the first plan without running it.
+        calls = [tool_call(action) for action in planned_actions(response)]
+        reply = "" if calls else response_text(response)
+        events = [_batch_result(turn.index, user.user_id, reply, routed_calls + calls)]
+    else:
+        result = user.context.run(_lc().loop.advance, turn.state, response)
+        if result is None:
+            return []
+        reply = _join_replies(turn.routed, turn.edits, _reply(result, result.outputs))
+        events = [_batch_result(turn.index, user.user_id, reply, routed_calls + result.tool_calls)]
+    return events + _next_batch_turn(user, dry_run)
+
+
+def run_agent_batch(
+    requests: Iterable[Tuple[str, str]],
+    dry_run: bool = False,
+    max_concurrency: int = CHAT_BATCH_CONCURRENCY,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run many (user_id, prompt) turns, e.g. to re-extract stored messages
+    after a change to the prompt, yielding events as they finish.
+
+    Up to `max_concurrency` users are worked on at once.  Each round plans
+    the current step of every open prompt with one `batch` call to the
+    agent, then runs the planned tools; a user's prompts run in order
+    against one profile read, and their changes are written once after
+    their last prompt.  Batch turns get no conversation history, are not
+    recorded in it and bypass the response cache.
+
+    Events are dicts with an `event` name and `data`, like `stream_agent`:
+    `result` (index, user_id, response, tool_calls) for each prompt,
+    `error` for a failed prompt (with its index) or user (without),
+    `saved` (user_id, written) once a user's changes are written, and a
+    final `done` with totals.  With `dry_run` nothing is written: each
+    prompt is planned once and the planned tool calls are returned
+    without running them.
+    """
+    by_user: Dict[str, List[Tuple[int, str]]] = {}
+    for index, (user_id, prompt) in enumerate(requests):
+        by_user.setdefault(user_id, []).append((index, prompt))
+    waiting = deque(_BatchUser(user_id, prompts) for user_id, prompts in by_user.items())
+    active: List[_BatchUser] = []
+    totals = {"results": 0, "errors": 0, "users": len(by_user)}
+    config = {"callbacks": [_lc().usage_handler], "max_concurrency": max(1, max_concurrency)}
+    started = time.perf_counter()
+
+    def counted(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        for event in events:
+            if event["event"] in ("result", "error"):
+                totals[f"{event['event']}s"] += 1
+        return events
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="chat-batch") as pool:
+        try:
+            while waiting or active:
+                opening = []
+                while waiting and len(active) + len(opening) < max_concurrency:
+                    opening.append(waiting.popleft())
+                opened = list(pool.map(lambda user: _start_batch_user(user, dry_run), opening))
+                active += [user for user in opening if user.current is not None]
+                for events in opened:
+                    yield from counted(events)
+                if not active:
+                    continue
+                with span("chat_batch_round"):
+                    responses = get_agent().batch(
+                        [{**user.current.inputs, "intermediate_steps": list(user.current.state.steps)} for user in active],
+                        config=config,
+                        return_exceptions=True,
+                    )
+                stepped = list(pool.map(lambda pair: _step_batch_user(pair[0], pair[1], dry_run), zip(active, responses)))
+                active = [user for user in active if user.current is not None]
+                for events in stepped:
+                    yield from counted(events)
+        finally:
+            # Also when the caller stops early: keep what the finished prompts changed.
+            for user in active:
+                try:
+                    user.close()
+                except Exception as e:
+                    logger.error("Batch write for %s failed: %s", user.user_id, e)
+    yield {"event": "done", "data": {**totals, "seconds": round(time.perf_counter() - started, 3)}}
+
+
+# Resume chunks planned at once; a resume's wall time is that of its slowest chunk.
+RESUME_MAX_PARALLEL = int(os.getenv("RESUME_MAX_PARALLEL", "8"))
+
+RESUME_CHUNK_PROMPT = """Below is {where} of my resume. Record everything in it that belongs in my profile:
+- add each job or role as one experience paragraph and each project as one project paragraph, each a short self-contained summary of what I did and achieved
+- add skills, tools, strengths and industries one item at a time
+- set name, headline, summary, current title, current company or location only if this part states them
+Do not ask me anything; only call the tools.
+
+{text}"""
+
+
+def _resume_chunk_prompt(chunk: resume_ingest.Chunk) -> str:
+    where = f'the "{chunk.section}" section'
+    if chunk.parts > 1:
+        where += f" (part {chunk.part} of {chunk.parts})"
+    return RESUME_CHUNK_PROMPT.format(where=where, text=chunk.text)
+
+
+def _plan_resume_chunk(chunk: resume_ingest.Chunk, user_id: str, user_profile: dict) -> List[Dict[str, Any]]:
+    """The tool calls the model plans for one chunk; nothing is run."""
+    inputs = _build_inputs(_resume_chunk_prompt(chunk), user_id, user_profile, [], "")
+    with span("resume_chunk"):
+        response = get_agent().invoke({**inputs, "intermediate_steps": []}, config={"callbacks": [_lc().usage_handler]})
+    return [tool_call(action) for action in planned_actions(response)]
+
+
+def ingest_resume(chunks: List[resume_ingest.Chunk], user_id: str) -> Iterator[Dict[str, Any]]:
+    """
+    Extract a resume, split with `resume_ingest.split_resume`, into the
+    profile of `user_id`, yielding progress events.
+
+    The chunks are planned concurrently (up to `RESUME_MAX_PARALLEL` at a
+    time), their tool calls merged with `resume_ingest.merge_tool_calls`
+    and then run in one profile turn, so the profile is written once.
+
+    Events are dicts with an `event` name and `data`, like `stream_agent`:
+    `chunks` (count and section titles) first, then `chunk` (index,
+    section, planned tool_calls) as each chunk is planned or `error` if
+    that failed, and a final `done` (the merged tool_calls, their outputs,
+    whether the profile was written and how many chunks failed) or
+    `error` if the write failed.
+    """
+    started = time.perf_counter()
+    yield {"event": "chunks", "data": {"count": len(chunks), "sections": list(dict.fromkeys(chunk.section for chunk in chunks))}}
+    user_profile = get_user_profile(user_id)
+    planned: List[List[Dict[str, Any]]] = [[] for _ in chunks]
+    failed = 0
+    pool = ThreadPoolExecutor(max_workers=max(1, min(RESUME_MAX_PARALLEL, len(chunks))), thread_name_prefix="resume")
+    try:
+        futures = {
+            pool.submit(contextvars.copy_context().run, _plan_resume_chunk, chunk, user_id, user_profile): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                planned[chunk.index] = future.result()
+            except Exception as e:
+                logger.error("Resume chunk %d (%s) for %s failed: %s", chunk.index, chunk.section, user_id, e)
+                failed += 1
+                yield {"event": "error", "data": {"index": chunk.index, "section": chunk.section, "error": "Could not read this part of the resume."}}
+                continue
+            yield {"event": "chunk", "data": {"index": chunk.index, "section": chunk.section, "tool_calls": planned[chunk.index]}}
+    finally:
+        # A client that went away leaves nothing running behind it.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    calls = resume_ingest.merge_tool_calls(planned, user_profile)
+    token = _current_user_id.set(user_id)
+    try:
+        with update_profile.profile_turn(user_id) as turn:
+            outputs = _lc().loop.execute(calls)
+            written = turn.dirty
+    except Exception as e:
+        logger.error("Resume ingestion for %s failed: %s", user_id, e)
+        yield {"event": "error", "data": {"error": "Sorry, the profile could not be updated."}}
+        return
+    finally:
+        _current_user_id.reset(token)
+    yield {
+        "event": "done",
+        "data": {
+            "tool_calls": calls,
+            "outputs": outputs,
+            "written": written,
+            "failed_chunks": failed,
+            "seconds": round(time.perf_counter() - started, 3),
+        },
+    }
@@ -1,14 +1,90 @@
-from flask import Flask, request, jsonify
-from agent import run_agent
+import json
+import logging
+import os
+import time
+from contextlib import ExitStack
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from agent import CHAT_BATCH_MAX_ITEMS, get_agent, ingest_resume, run_agent, run_agent_batch, stream_agent
+from utils import cosmos, pending_questions
+from utils.admission import Rejected, get_admission_controller, request_key
+from utils.background_jobs import get_job_queue
+from utils.conversation_memory import DEFAULT_SESSION
 from utils.dbutils import get_user_profile, upsert_user_profile
-from auth.jwt_utils import require_auth
+from utils.job_match import MATCH_TOP_K, get_match_index
+from utils.profile_bulk import BULK_PAGE_SIZE, IMPORT_MODES, export_profiles, import_profiles
+from utils.profile_schema import new_profile, preference_profile
+from utils.prompt_context import count_tokens
+from utils.resume_ingest import ResumeTooLong, split_resume
+from auth.jwt_utils import prefetch_jwks, require_auth
+from tools import update_profile
 from flask_cors import CORS
 from agent import run_agent
+from utils.metrics import HTTP_SECONDS, REGISTRY, MetricsLogHandler
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger().addHandler(MetricsLogHandler())
+logger = logging.getLogger(__name__)
 
 
 app = Flask(__name__)
 CORS(app, origins=["https://salmon-mud-01e8de810.1.azurestaticapps.net"])
 
+update_profile.add_change_listener(get_match_index().on_profile_change)
+
+
+def warm_up() -> None:
+    """
+    Do the expensive one-off initialisation before the first request needs it.
+
+    Called from gunicorn's `post_fork` hook (see gunicorn.conf.py).  Each
+    step is independent and a failure is only logged: anything that did
+    not warm up is initialised by the first request that uses it.
+    """
+    steps = [
+        ("agent", get_agent),
+        ("cosmos profiles container", cosmos.get_container),
+        ("JWKS", prefetch_jwks),
+        ("tokenizer", lambda: count_tokens("warm up")),
+        ("background jobs", lambda: get_job_queue().start()),
+        # Loads every profile, so it finishes in the background.
+        ("match index", lambda: get_match_index().refresh_async()),
+    ]
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+            logger.info("Warmed up %s in %.0f ms", name, (time.perf_counter() - started) * 1000)
+        except Exception as e:
+            logger.warning("Warm-up of %s failed, will retry on first use: %s", name, e)
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=response.status_code)
+    return response
+
+
+def _rejected(e: Rejected):
+    """429 for a request the admission controller turned away."""
+    response = jsonify({"error": "Too many requests", "reason": e.reason})
+    response.status_code = 429
+    response.headers["Retry-After"] = e.retry_after_header
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/healthz", methods=["GET"])
 def healthz():
     try:
@@ -27,14 +103,114 @@ def chat():
         return jsonify({"error": "Missing prompt"}), 400
 
     user_id = data.get("user_id", "zil@example.com")
+    session_id = data.get("session_id", DEFAULT_SESSION)
     try:
-        response = run_agent(data["prompt"], user_id)
+        response = get_admission_controller().run(
+            user_id, request_key(user_id, session_id, data["prompt"]), lambda: run_agent(data["prompt"], user_id, session_id)
+        )
         return jsonify({"response": response})
+    except Rejected as e:
+        return _rejected(e)
     except Exception as e:
-        print(f"[ERROR] /chat failed: {e}")
+        logger.error("/chat failed: %s", e)
         return jsonify({"error": "Agent failure"}), 500
 
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Like /chat, but streams tokens and tool events as server-sent events."""
+    data = request.get_json(force=True)
+
+    if not data or "prompt" not in data:
+        return jsonify({"error": "Missing prompt"}), 400
+
+    user_id = data.get("user_id", "zil@example.com")
+    session_id = data.get("session_id", DEFAULT_SESSION)
+    # The turn's slot is held until the stream is closed.
+    admitted = ExitStack()
+    try:
+        admitted.enter_context(get_admission_controller().admit(user_id))
+    except Rejected as e:
+        return _rejected(e)
+
+    def events():
+        for event in stream_agent(data["prompt"], user_id, session_id):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Stop proxies (App Service front end, nginx) from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(admitted.close)
+    return response
+
+
+@app.route("/chat/batch", methods=["POST"])
+@require_auth
+def chat_batch():
+    """
+    Run many chat turns, e.g. to re-extract stored messages after a prompt
+    change, streaming NDJSON events as the turns finish.
+
+    Body: {"items": [{"user_id": ..., "prompt": ...}, ...], "dry_run": false}.
+    A dry run returns the tool calls each prompt would make without writing
+    anything.  See `agent.run_agent_batch` for the events.
+    """
+    data = request.get_json(force=True)
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Missing items"}), 400
+    if len(items) > CHAT_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {CHAT_BATCH_MAX_ITEMS} items per batch"}), 400
+    if not all(isinstance(item, dict) and item.get("user_id") and item.get("prompt") for item in items):
+        return jsonify({"error": "Every item needs a user_id and a prompt"}), 400
+
+    def lines():
+        for event in run_agent_batch([(item["user_id"], item["prompt"]) for item in items], dry_run=bool(data.get("dry_run"))):
+            yield json.dumps(event) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+
+@app.route("/ingest/resume", methods=["POST"])
+def upload_resume():
+    """
+    Extract a pasted resume into the profile, streaming progress as NDJSON.
+
+    Body: {"user_id": ..., "text": ...}.  The resume is split into sections
+    that are read concurrently; see `agent.ingest_resume` for the events.
+    """
+    data = request.get_json(force=True)
+
+    if not data or not data.get("text"):
+        return jsonify({"error": "Missing text"}), 400
+
+    user_id = data.get("user_id", "zil@example.com")
+    try:
+        chunks = split_resume(data["text"])
+    except ResumeTooLong as e:
+        return jsonify({"error": str(e)}), 413
+    admitted = ExitStack()
+    try:
+        admitted.enter_context(get_admission_controller().admit(user_id))
+    except Rejected as e:
+        return _rejected(e)
+
+    def lines():
+        for event in ingest_resume(chunks, user_id):
+            yield json.dumps(event) + "\n"
+
+    response = Response(
+        stream_with_context(lines()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(admitted.close)
+    return response
+
+
 @app.route("/", methods=["GET"])
 def index():
     return "Zil's LangChain Agent is running!"
@@ -52,31 +228,10 @@ def profile():
 @app.route("/reset-profile", methods=["POST"])
 def reset_profile():
     user_id = request.args.get("user_id", "zil@example.com")
-    default_profile = {
-        "job_titles": [],
-        "locations": [],
-        "required_skills": [],
-        "industries": [],
-        "employment_type": "",
-        "experience_level": "",
-        "certifications": [],
-        "must_have_keywords": [],
-        "excluded_keywords": [],
-        "education": [],
-        "preferred_company_types": [],
-        "language_preferences": [],
-        "remote_flexibility": "flexible",
-        "minimum_salary_expectation": "",
-        "resume_version_notes": "",
-        "summary_profile": "",
-        "experience_paragraphs": [],
-        "project_paragraphs": [],
-        "strengths_paragraphs": [],
-        "custom_profile_notes": "",
-        "user_id": user_id,
-        "pending_questions": []
-    }
+    default_profile = preference_profile(user_id)
     upsert_user_profile(user_id, default_profile)
+    pending_questions.clear(user_id)
+    get_match_index().merge(user_id, default_profile)
     return jsonify({"message": "Profile reset successfully"}), 200
 
 @app.route("/create-user", methods=["POST"])
@@ -91,32 +246,66 @@ def create_user():
         if existing:
             return jsonify({"message": "User already exists"}), 200
         
-        print(f"[INFO] Creating user {user_id} with name {name}")
+        logger.info("Creating user %s with name %s", user_id, name)
         # Default profile structure
-        default_profile = {
-            "user_id": user_id,
-            "name": name,
-            "headline": "",
-            "summary": "",
-            "current_title": "",
-            "current_company": "",
-            "location": "",
-            "skills": [],
-            "tools": [],
-            "strengths": [],
-            "industries": [],
-            "experience_paragraphs": [],
-            "project_paragraphs": [],
-            "custom_profile_notes": [],
-            "pending_questions": []
-        }
+        default_profile = new_profile(user_id, name)
 
         upsert_user_profile(user_id, default_profile)
+        get_match_index().add(user_id, default_profile)
         return jsonify({"message": "User created"}), 201
 
     except Exception as e:
-        print(f"[ERROR] /create-user failed: {e}")
+        logger.error("/create-user failed: %s", e)
         return jsonify({"error": "Failed to create user"}), 500
 
+
+@app.route("/match", methods=["POST"])
+@require_auth
+def match():
+    """
+    Rank profiles against a job.
+
+    Body: {"title": ..., "skills": [...], "location": ..., "industry": ...,
+    "description": ..., "k": 10}; every field is optional but the job needs
+    a title, skills or a description.  Returns the `k` best matches.
+    """
+    job = request.get_json(force=True)
+    if not isinstance(job, dict) or not any(job.get(field) for field in ("title", "skills", "description")):
+        return jsonify({"error": "The job needs a title, skills or a description"}), 400
+    try:
+        k = min(int(job.get("k", MATCH_TOP_K)), 100)
+    except (TypeError, ValueError):
+        return jsonify({"error": "k must be an integer"}), 400
+    return jsonify({"matches": get_match_index().match(job, k)}), 200
+
+
+@app.route("/profiles/import", methods=["POST"])
+@require_auth
+def bulk_import():
+    """
+    Create profiles from an NDJSON request body, one profile per line.
+
+    `?mode=upsert` replaces existing profiles instead of skipping them;
+    `?start_after=N` skips the first N lines, to resume from the `position`
+    of an earlier, partly failed import.
+    """
+    mode = request.args.get("mode", "create")
+    if mode not in IMPORT_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(IMPORT_MODES)}"}), 400
+    report = import_profiles(request.stream, mode=mode, start_after=request.args.get("start_after", 0, type=int))
+    if report.created or report.upserted:
+        # Changes are only applied to users the index holds; pick up the new ones.
+        get_match_index().refresh_async()
+    return jsonify(report.as_dict()), 200
+
+
+@app.route("/profiles/export", methods=["GET"])
+@require_auth
+def bulk_export():
+    """Stream every profile as NDJSON."""
+    page_size = request.args.get("page_size", BULK_PAGE_SIZE, type=int)
+    return Response(stream_with_context(export_profiles(page_size=page_size)), mimetype="application/x-ndjson")
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
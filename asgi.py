@@ -0,0 +1,112 @@
+"""
+ASGI entry point for the Zil agent.
+
+The Flask app in `app.py` runs on sync gunicorn workers, where every /chat
+holds a whole worker for the several seconds it spends waiting on Azure
+OpenAI and Cosmos.  This module serves the hot routes (/chat, /profile,
+/healthz) as async handlers built on `arun_agent` and the async Cosmos
+client, so one worker process multiplexes many in-flight conversations on
+its event loop.  Every other route (/create-user, /reset-profile,
+/chat/stream, ...) is delegated unchanged to the Flask app, so this module
+is a drop-in replacement for `app:app`.
+
+Worker configuration lives in gunicorn.conf.py (see startup.sh):
+
+    gunicorn -c gunicorn.conf.py asgi:app
+
+Use roughly one worker per CPU core; concurrency within a worker is bound
+by the model quota rather than the worker count.  The Flask routes still
+run synchronously, on a2wsgi's thread pool, so they do not block the loop.
+"""
+
+import logging
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Mount, Route
+
+from agent import arun_agent
+from app import app as flask_app
+from utils.admission import Rejected, get_admission_controller, request_key
+from utils.conversation_memory import DEFAULT_SESSION
+from utils.dbutils import aget_user_profile
+from utils.metrics import HTTP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+async def healthz(request: Request):
+    try:
+        await aget_user_profile("healthcheck@example.com")
+        return PlainTextResponse("OK", 200)
+    except Exception as e:
+        return PlainTextResponse(f"Health check failed: {e}", 500)
+
+
+async def chat(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    if not data or "prompt" not in data:
+        return JSONResponse({"error": "Missing prompt"}, 400)
+
+    user_id = data.get("user_id", "zil@example.com")
+    session_id = data.get("session_id", DEFAULT_SESSION)
+    try:
+        response = await get_admission_controller().arun(
+            user_id, request_key(user_id, session_id, data["prompt"]), lambda: arun_agent(data["prompt"], user_id, session_id)
+        )
+        return JSONResponse({"response": response})
+    except Rejected as e:
+        return JSONResponse(
+            {"error": "Too many requests", "reason": e.reason}, 429, headers={"Retry-After": e.retry_after_header}
+        )
+    except Exception as e:
+        logger.error("/chat failed: %s", e)
+        return JSONResponse({"error": "Agent failure"}, 500)
+
+
+async def profile(request: Request):
+    user_id = request.query_params.get("user_id", "zil@example.com")
+    profile_data = await aget_user_profile(user_id)
+    if profile_data:
+        return JSONResponse(profile_data, 200)
+    return JSONResponse({"error": "Profile not found"}, 404)
+
+
+def _timed(route: str, handler):
+    """Record the handler's latency like app.py does for the Flask routes."""
+
+    async def endpoint(request: Request):
+        started = time.perf_counter()
+        response = await handler(request)
+        HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=response.status_code)
+        return response
+
+    return endpoint
+
+
+app = Starlette(
+    routes=[
+        Route("/healthz", _timed("/healthz", healthz), methods=["GET"]),
+        Route("/chat", _timed("/chat", chat), methods=["POST"]),
+        Route("/profile", _timed("/profile", profile), methods=["GET"]),
+        Mount("/", WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        # Same policy as flask-cors in app.py (all methods and headers).
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["https://salmon-mud-01e8de810.1.azurestaticapps.net"],
+            allow_methods=["*"],
+            allow_headers=["*"],
+        ),
+    ],
+)
@@ -14,23 +14,29 @@ retrieved or did not contain a `jwks_uri` field, the module raised a
 `KeyError` during import, causing the entire application to fail on
 startup.  This implementation instead lazily discovers the JWKS URI and
 provides clearer error messages when it cannot be determined.
+
+Signing keys are cached in-process (see `_JWKSCache`) and refreshed when
+their TTL lapses or when a token names a `kid` that is not yet known, so
+the hot path performs no network I/O.  Successfully verified tokens are
+also remembered, keyed by a hash of the token, until they expire.
+Downloads go through the shared keep-alive session in `utils.http_session`.
 """
 
 from __future__ import annotations
+import hashlib
+import logging
 import os
-import requests
-from jose import jwt
+import threading
+import time
+from collections import OrderedDict
+from jose import jwk, jwt
 from flask import request, jsonify
-from typing import Any, Callable, Dict
-
+from typing import Any, Callable, Dict, Tuple
 
-TENANT_ID = os.getenv("TENANT_ID")
-CLIENT_ID = os.getenv("AUTH_CLIENT_ID")
-OPENID_CONFIG_URL = f"https://login.microsoftonline.com/{TENANT_ID}/v2.0/.well-known/openid-configuration"
+from utils import http_session
+from utils.metrics import span
 
-openid_config = requests.get(OPENID_CONFIG_URL).json()
-jwks_uri = openid_config["jwks_uri"]
-jwks = requests.get(jwks_uri).json()
+logger = logging.getLogger(__name__)
 
 # Environment variables used by this module:
 #
@@ -41,6 +47,17 @@ jwks = requests.get(jwks_uri).json()
 #   tenant.  This is used as the expected audience when decoding tokens.
 # JWKS_URI (optional): If provided, this URL is used directly to
 #   retrieve the JWKS instead of reading it from the OpenID configuration.
+# JWKS_CACHE_TTL (optional): Seconds a downloaded JWKS is trusted before
+#   it is fetched again.  Defaults to one hour.
+# JWKS_MIN_REFRESH_INTERVAL (optional): Minimum seconds between refreshes
+#   triggered by an unknown `kid`, so forged headers cannot make us hammer
+#   the key endpoint.  Defaults to 30 seconds.
+# TOKEN_CACHE_SIZE (optional): Maximum number of verified tokens kept in
+#   memory.  Defaults to 1024.
+
+JWKS_CACHE_TTL = float(os.getenv("JWKS_CACHE_TTL", "3600"))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
 
 
 def _get_openid_configuration_url(tenant_id: str) -> str:
@@ -72,7 +89,7 @@ def _discover_jwks_uri(tenant_id: str) -> str:
 
     openid_url = _get_openid_configuration_url(tenant_id)
     try:
-        resp = requests.get(openid_url, timeout=5)
+        resp = http_session.get(openid_url, timeout=5)
         resp.raise_for_status()
         config = resp.json()
     except Exception as exc:
@@ -103,7 +120,7 @@ def _fetch_jwks(jwks_uri: str) -> Dict[str, Any]:
         RuntimeError: If the JWKS cannot be fetched or parsed.
     """
     try:
-        resp = requests.get(jwks_uri, timeout=5)
+        resp = http_session.get(jwks_uri, timeout=5)
         resp.raise_for_status()
         jwks = resp.json()
         if "keys" not in jwks:
@@ -121,41 +138,192 @@ def _get_jwks(tenant_id: str) -> Dict[str, Any]:
 
     This function first determines the JWKS URI (via environment override
     or discovery) and then downloads the JWKS.  It does not cache the
-    result; callers may implement caching if desired.
+    result; `_JWKSCache` wraps it for the request path.
     """
     jwks_uri = _discover_jwks_uri(tenant_id)
     return _fetch_jwks(jwks_uri)
 
 
-def _get_rsa_key(token: str, jwks: Dict[str, Any]) -> Dict[str, str] | None:
+class _JWKSCache:
+    """
+    Thread-safe cache of parsed signing keys indexed by `kid`.
+
+    Keys are downloaded through `_get_jwks` and converted to `jose` key
+    objects once, so verification never re-parses the JWK.  A refresh
+    happens when the TTL has lapsed or when a token carries an unknown
+    `kid` (key rotation), the latter rate-limited by
+    `min_refresh_interval`.  Refreshes are single-flight: concurrent
+    callers wait on one download instead of each issuing their own.
+    If a refresh fails while keys are already cached, the stale keys
+    keep being served and the refresh is retried later.
+    """
+
+    def __init__(self, ttl: float, min_refresh_interval: float) -> None:
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, Any] = {}
+        self._tenant_id: str | None = None
+        self._expires_at = 0.0
+        self._last_refresh = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, tenant_id: str, kid: str | None) -> Any | None:
+        """
+        Return the parsed key for `kid`, refreshing the cache if needed.
+
+        Args:
+            tenant_id: The Azure tenant identifier.
+            kid: The key identifier from the token header.
+
+        Returns:
+            A `jose` key object, or `None` if no such key is published.
+        """
+        now = time.monotonic()
+        generation = self._generation
+        fresh = self._tenant_id == tenant_id and now < self._expires_at
+        key = self._keys.get(kid) if self._tenant_id == tenant_id else None
+        if fresh and key is not None:
+            return key
+        if fresh and now - self._last_refresh < self.min_refresh_interval:
+            # Unknown kid, but we just refreshed; don't let it force a fetch.
+            return None
+        self._refresh(tenant_id, generation)
+        return self._keys.get(kid) if self._tenant_id == tenant_id else None
+
+    def _refresh(self, tenant_id: str, seen_generation: int) -> None:
+        with self._lock:
+            if self._generation != seen_generation:
+                # Another thread refreshed while we were waiting.
+                return
+            try:
+                jwks = _get_jwks(tenant_id)
+            except RuntimeError as exc:
+                if self._tenant_id != tenant_id or not self._keys:
+                    raise
+                logger.warning("JWKS refresh failed, serving cached keys: %s", exc)
+                self._expires_at = time.monotonic() + self.min_refresh_interval
+                self._last_refresh = time.monotonic()
+                self._generation += 1
+                return
+            self._keys = _parse_jwks(jwks)
+            self._tenant_id = tenant_id
+            self._last_refresh = time.monotonic()
+            self._expires_at = self._last_refresh + self.ttl
+            self._generation += 1
+
+    def clear(self) -> None:
+        """Drop all cached keys, forcing the next lookup to download them."""
+        with self._lock:
+            self._keys = {}
+            self._tenant_id = None
+            self._expires_at = 0.0
+            self._last_refresh = 0.0
+            self._generation += 1
+
+
+class _VerifiedTokenCache:
+    """
+    Bounded LRU of decoded token payloads keyed by SHA-256 of the token.
+
+    Entries are only returned while the token's `exp` claim is in the
+    future, so a cached result never outlives the token itself.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str, tenant_id: str, client_id: str) -> Tuple[str, str, str]:
+        return (hashlib.sha256(token.encode("utf-8")).hexdigest(), tenant_id, client_id)
+
+    def get(self, token: str, tenant_id: str, client_id: str) -> Dict[str, Any] | None:
+        key = self._key(token, tenant_id, client_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            exp, payload = entry
+            if time.time() >= exp:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, token: str, tenant_id: str, client_id: str, payload: Dict[str, Any]) -> None:
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)) or self.maxsize <= 0:
+            return
+        key = self._key(token, tenant_id, client_id)
+        with self._lock:
+            self._entries[key] = (float(exp), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_jwks_cache = _JWKSCache(JWKS_CACHE_TTL, JWKS_MIN_REFRESH_INTERVAL)
+_token_cache = _VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
+
+def prefetch_jwks() -> None:
+    """
+    Download the signing keys ahead of the first authenticated request.
+
+    Does nothing when `TENANT_ID` is not configured.  Raises `RuntimeError`
+    if the keys cannot be fetched; callers warming up should log and move
+    on, as the first request will retry.
     """
-    Find the appropriate RSA key from the JWKS using the token's 'kid'.
+    tenant_id = os.getenv("TENANT_ID")
+    if tenant_id:
+        _jwks_cache.get_key(tenant_id, None)
+
+
+def _parse_jwks(jwks: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert the RSA signing keys of a JWKS into `jose` key objects.
 
     Args:
-        token: The encoded JWT string.
         jwks: The JWKS dictionary.
 
     Returns:
-        A dictionary containing the RSA key parameters or `None` if not found.
+        A mapping from `kid` to a ready-to-use key object.  Keys that are
+        not RSA or cannot be parsed are skipped.
     """
-    unverified_header = jwt.get_unverified_header(token)
-    kid = unverified_header.get("kid")
+    keys: Dict[str, Any] = {}
     for key in jwks.get("keys", []):
-        if key.get("kid") == kid:
-            return {
-                "kty": key.get("kty"),
-                "kid": key.get("kid"),
-                "use": key.get("use"),
-                "n": key.get("n"),
-                "e": key.get("e"),
-            }
-    return None
+        kid = key.get("kid")
+        if not kid or key.get("kty") != "RSA":
+            continue
+        try:
+            keys[kid] = jwk.construct(
+                {
+                    "kty": key.get("kty"),
+                    "kid": kid,
+                    "use": key.get("use"),
+                    "n": key.get("n"),
+                    "e": key.get("e"),
+                },
+                algorithm="RS256",
+            )
+        except Exception as exc:
+            logger.warning("Skipping unparseable JWK %s: %s", kid, exc)
+    return keys
 
 
 def _validate_token(token: str, tenant_id: str, client_id: str) -> Dict[str, Any] | None:
     """
     Decode and verify a JWT using the tenant's keys.
 
+    Previously verified tokens are served from `_token_cache`; otherwise
+    the signing key is looked up in `_jwks_cache`.
+
     Args:
         token: The encoded JWT string.
         tenant_id: The Azure tenant identifier.
@@ -164,10 +332,13 @@ def _validate_token(token: str, tenant_id: str, client_id: str) -> Dict[str, Any
     Returns:
         The decoded JWT payload if valid, otherwise `None`.
     """
+    cached = _token_cache.get(token, tenant_id, client_id)
+    if cached is not None:
+        return cached
     try:
-        jwks = _get_jwks(tenant_id)
-        rsa_key = _get_rsa_key(token, jwks)
-        if not rsa_key:
+        kid = jwt.get_unverified_header(token).get("kid")
+        rsa_key = _jwks_cache.get_key(tenant_id, kid)
+        if rsa_key is None:
             raise ValueError("No matching RSA key found for token")
         payload = jwt.decode(
             token,
@@ -176,11 +347,12 @@ def _validate_token(token: str, tenant_id: str, client_id: str) -> Dict[str, Any
             audience=client_id,
             issuer=f"https://login.microsoftonline.com/{tenant_id}/v2.0",
         )
-        return payload
     except Exception as exc:
         # Log a simple error; the calling function will decide how to respond.
-        print(f"[ERROR] Invalid token: {exc}")
+        logger.error("Invalid token: %s", exc)
         return None
+    _token_cache.put(token, tenant_id, client_id, payload)
+    return payload
 
 
 def require_auth(func: Callable[..., Any]) -> Callable[..., Any]:
@@ -206,7 +378,8 @@ def require_auth(func: Callable[..., Any]) -> Callable[..., Any]:
         if not auth_header.startswith("Bearer "):
             return jsonify({"error": "Missing token"}), 401
         token = auth_header.split(" ", 1)[1]
-        payload = _validate_token(token, tenant_id, client_id)
+        with span("auth"):
+            payload = _validate_token(token, tenant_id, client_id)
         if payload is None:
             return jsonify({"error": "Invalid token"}), 403
         # Optionally attach the payload to request for downstream use
@@ -0,0 +1,363 @@
+"""
+Local stand-ins for Cosmos DB and Azure OpenAI.
+
+The unit tests and the benchmarks share these so that a run needs no
+network access:
+
+- `FakeContainer` mimics the ContainerProxy calls we use, with ETags,
+  optional per-call latency and an approximate request-charge (RU) model;
+- `AsyncFakeContainer` exposes the same store through the
+  `azure.cosmos.aio` call signatures;
+- `ScriptedChatModel` is a chat model that answers from a script of
+  regex rules, emitting OpenAI tool calls like the real deployment;
+- `hash_embedder` is a deterministic bag-of-words embedder.
+"""
+
+import asyncio
+import copy
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Approximate Cosmos charges: (base RU, RU per KB of document).
+DEFAULT_RU_MODEL = {
+    "read_item": (1.0, 1.0),
+    "create_item": (6.0, 2.0),
+    "upsert_item": (6.0, 2.0),
+    "replace_item": (6.0, 2.0),
+    "patch_item": (6.5, 2.0),
+}
+
+# Set while an async call has already awaited the latency for the sync store.
+_latency_awaited: ContextVar[bool] = ContextVar("latency_awaited", default=False)
+
+
+def _unescape(token):
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+class FakeContainer:
+    """
+    Dict-backed container that mimics the ContainerProxy calls we use.
+
+    Every write bumps the document's `_etag`, and `patch_item` /
+    `replace_item` honour `etag` + `match_condition` the way Cosmos does,
+    raising `CosmosAccessConditionFailedError` on a mismatch.  Each call is
+    recorded in `calls` as `(method, request_bytes)` and, like Cosmos,
+    reports a request charge to the caller's `response_hook`.
+
+    Args:
+        latency: Seconds each call sleeps (outside the lock), to model the
+            round trip to the account.
+        ru_model: Charge per method as (base RU, RU per KB of document).
+    """
+
+    def __init__(self, latency: float = 0.0, ru_model: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.items = {}
+        self.calls = []
+        self.latency = latency
+        self.ru_model = ru_model or DEFAULT_RU_MODEL
+        self.request_units = 0.0
+        self._etags = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def _record(self, method, payload=None):
+        self.calls.append((method, len(json.dumps(payload, default=str)) if payload is not None else 0))
+
+    def _charge(self, method, doc, response_hook=None):
+        base, per_kb = self.ru_model.get(method, (1.0, 1.0))
+        charge = round(base + per_kb * len(json.dumps(doc, default=str)) / 1024, 2)
+        with self._lock:
+            self.request_units += charge
+        if response_hook is not None:
+            response_hook({"x-ms-request-charge": str(charge)}, doc)
+
+    def _wait(self):
+        if self.latency and not _latency_awaited.get():
+            time.sleep(self.latency)
+
+    def count(self, method):
+        return sum(1 for name, _ in self.calls if name == method)
+
+    def counts(self) -> Dict[str, int]:
+        return dict(Counter(name for name, _ in self.calls))
+
+    def _store(self, body):
+        doc = copy.deepcopy(body)
+        doc["_etag"] = f'"{next(self._etags)}"'
+        self.items[doc["id"]] = doc
+        return copy.deepcopy(doc)
+
+    def _check_etag(self, current, etag, match_condition):
+        if match_condition == MatchConditions.IfNotModified and etag != current["_etag"]:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Precondition failed")
+
+    def read_item(self, item, partition_key, response_hook=None, **kwargs):
+        self._wait()
+        with self._lock:
+            self._record("read_item")
+            if item not in self.items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="Not found")
+            doc = copy.deepcopy(self.items[item])
+        self._charge("read_item", doc, response_hook)
+        return doc
+
+    def create_item(self, body, response_hook=None, **kwargs):
+        self._wait()
+        with self._lock:
+            self._record("create_item", body)
+            if body["id"] in self.items:
+                raise exceptions.CosmosResourceExistsError(status_code=409, message="Conflict")
+            doc = self._store(body)
+        self._charge("create_item", doc, response_hook)
+        return doc
+
+    def upsert_item(self, body, response_hook=None, **kwargs):
+        self._wait()
+        with self._lock:
+            self._record("upsert_item", body)
+            doc = self._store(body)
+        self._charge("upsert_item", doc, response_hook)
+        return doc
+
+    def replace_item(self, item, body, etag=None, match_condition=None, response_hook=None, **kwargs):
+        self._wait()
+        with self._lock:
+            self._record("replace_item", body)
+            if item not in self.items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="Not found")
+            self._check_etag(self.items[item], etag, match_condition)
+            doc = self._store(body)
+        self._charge("replace_item", doc, response_hook)
+        return doc
+
+    def read_all_items(self, max_item_count=None, **kwargs):
+        """Cross-partition read; page with `.by_page(continuation_token)` like `ItemPaged`."""
+        return FakeItemPaged(self, max_item_count or 100)
+
+    def _read_page(self, start, size):
+        self._wait()
+        with self._lock:
+            ids = sorted(self.items)[start:start + size]
+            docs = [copy.deepcopy(self.items[i]) for i in ids]
+            self._record("read_all_items")
+        self._charge("read_all_items", docs)
+        return docs, len(self.items)
+
+    def patch_item(self, item, partition_key, patch_operations, etag=None, match_condition=None, response_hook=None, **kwargs):
+        self._wait()
+        with self._lock:
+            self._record("patch_item", patch_operations)
+            if len(patch_operations) > 10:
+                raise exceptions.CosmosHttpResponseError(status_code=400, message="Too many patch operations")
+            if item not in self.items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message="Not found")
+            self._check_etag(self.items[item], etag, match_condition)
+            doc = copy.deepcopy(self.items[item])
+            for operation in patch_operations:
+                self._apply(doc, operation)
+            doc = self._store(doc)
+        self._charge("patch_item", doc, response_hook)
+        return doc
+
+    @staticmethod
+    def _apply(doc, operation):
+        *parents, last = [_unescape(t) for t in operation["path"].lstrip("/").split("/")]
+        target = doc
+        for token in parents:
+            target = target[int(token)] if isinstance(target, list) else target[token]
+        op = operation["op"]
+        if isinstance(target, list):
+            if op == "add":
+                if last == "-":
+                    target.append(operation["value"])
+                else:
+                    target.insert(int(last), operation["value"])
+            elif op == "remove":
+                del target[int(last)]
+            elif op in ("set", "replace"):
+                target[int(last)] = operation["value"]
+            else:
+                raise ValueError(op)
+        else:
+            if op in ("add", "set", "replace"):
+                target[last] = operation["value"]
+            elif op == "remove":
+                del target[last]
+            elif op == "incr":
+                target[last] = target.get(last, 0) + operation["value"]
+            else:
+                raise ValueError(op)
+
+
+class FakeItemPaged:
+    """Pages of a `FakeContainer` in id order; continuation tokens are offsets."""
+
+    def __init__(self, container: FakeContainer, page_size: int):
+        self.container = container
+        self.page_size = page_size
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return _FakePageIterator(self, int(continuation_token or 0))
+
+
+class _FakePageIterator:
+    def __init__(self, paged: FakeItemPaged, start: int):
+        self.paged = paged
+        self.continuation_token = str(start) if start else None
+        self._next = start
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        docs, total = self.paged.container._read_page(self._next, self.paged.page_size)
+        self._next += len(docs)
+        self._done = self._next >= total or not docs
+        self.continuation_token = None if self._done else str(self._next)
+        if not docs:
+            raise StopIteration
+        return iter(docs)
+
+
+class AsyncFakeContainer:
+    """`azure.cosmos.aio`-style view of a `FakeContainer`; latency is awaited, not slept."""
+
+    def __init__(self, container: FakeContainer):
+        self.container = container
+
+    def __getattr__(self, name):
+        method = getattr(self.container, name)
+        if name not in DEFAULT_RU_MODEL:
+            return method
+
+        async def call(*args, **kwargs):
+            if self.container.latency:
+                await asyncio.sleep(self.container.latency)
+            token = _latency_awaited.set(True)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                _latency_awaited.reset(token)
+
+        return call
+
+
+Rule = Tuple[str, Callable[[re.Match], Any]]
+
+
+_call_ids = itertools.count(1)
+
+
+def tool_call(name: str, **arguments: Any) -> AIMessage:
+    """An assistant message calling tool `name`, as the OpenAI tools API returns it."""
+    call = {"id": f"call_{next(_call_ids)}", "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+    return AIMessage(content="", additional_kwargs={"tool_calls": [call]})
+
+
+# Enough of the real extraction behaviour to drive the tools.
+DEFAULT_SCRIPT: List[Rule] = [
+    (r"\bi (?:know|use|used|picked up) ([\w+#. -]+?)(?: at| daily| every| for|[.!]|$)",
+     lambda m: tool_call("AddToListField", field_name="skills", item=m.group(1).strip())),
+    (r"\bi work(?:ed)? at ([\w&. -]+?)(?: as| for|[.!]|$)",
+     lambda m: tool_call("SetStringField", field_name="current_company", value=m.group(1).strip())),
+    (r"\bi(?: am|'m) an? ([\w -]+?)(?: at| in|[.!]|$)",
+     lambda m: tool_call("SetStringField", field_name="current_title", value=m.group(1).strip())),
+    (r"\bi led (.+?)[.!]?$",
+     lambda m: tool_call("AddToListField", field_name="experience_paragraphs", item=f"Led {m.group(1).strip()}.")),
+]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model that answers from `script` after sleeping `latency` seconds.
+
+    The first rule whose regex matches the last human message (case
+    insensitively) produces the reply; once the agent has sent a tool
+    result back, or nothing matches, the model answers with plain text.
+    Token usage is reported from a chars/4 estimate so the usage metrics
+    see realistic numbers.
+    """
+
+    script: List[Rule] = DEFAULT_SCRIPT
+    latency: float = 0.0
+    reply: str = "Thanks, noted."
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        self.calls += 1
+        last = messages[-1]
+        message = None
+        if last.type == "human":
+            for pattern, build in self.script:
+                match = re.search(pattern, str(last.content), re.IGNORECASE)
+                if match:
+                    message = build(match)
+                    break
+        if message is None:
+            message = AIMessage(content=self.reply)
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = max(1, len(json.dumps(message.additional_kwargs) + str(message.content)) // 4)
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}},
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+
+def hash_embedder(texts: Sequence[str], dim: int = 256) -> List[np.ndarray]:
+    """Deterministic bag-of-words vectors built from hashed, lower-cased words."""
+    vectors = []
+    for text in texts:
+        vector = np.zeros(dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "little") % dim] += 1.0
+        vector[0] += 0.01  # never all-zero
+        vectors.append(vector)
+    return vectors
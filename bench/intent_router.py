@@ -0,0 +1,40 @@
+"""
+Throughput of the local intent router and the share of a sample prompt mix it
+handles without a model call.
+
+    python -m bench.intent_router
+"""
+
+import time
+
+from utils.intent_router import route
+
+PROMPTS = [
+    "Add budgeting, Tableau, and Excel to my skills.",
+    "Remove COBOL from my skills.",
+    "Set my title to Senior Analyst.",
+    "Change my company to Contoso.",
+    "I live in Austin, TX.",
+    "Add Power BI to my tools. I used it for the quarterly board pack.",
+    "I led a team of five analysts on the tax audit for three years.",
+    "Can you add Excel to my skills?",
+    "What should I highlight for a data engineering role?",
+    "Don't add Python to my skills, I barely used it.",
+]
+
+
+def main(rounds: int = 20000) -> None:
+    handled = sum(route(p).fully_handled for p in PROMPTS)
+    partial = sum(bool(route(p).commands) and not route(p).fully_handled for p in PROMPTS)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for prompt in PROMPTS:
+            route(prompt)
+    elapsed = time.perf_counter() - start
+    total = rounds * len(PROMPTS)
+    print(f"routed {total} prompts in {elapsed:.2f}s ({total / elapsed:,.0f} prompts/s, {elapsed / total * 1e6:.1f} us each)")
+    print(f"handled locally: {handled}/{len(PROMPTS)}; partially: {partial}/{len(PROMPTS)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Offline load test of the Flask app against local stand-ins for Cosmos DB
+and Azure OpenAI (see bench/fakes.py).
+
+A pool of threads drives /chat, /profile, /create-user and /reset-profile
+in a weighted mix at a fixed concurrency, through the real routes, agent,
+tools and data-access code; only the network edges are replaced.  For each
+route it reports throughput, p50/p95/p99 latency and the backend calls
+(Cosmos requests, RUs and model calls) per request, so runs can be
+compared before and after a change on a machine without network access.
+
+Run from the repository root:
+
+    python -m bench.load --requests 2000 --concurrency 32
+    python -m bench.load --llm-latency 0.3 --db-latency 0.005 --json before.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, List
+from unittest.mock import MagicMock, patch
+
+ROUTES = ("chat", "profile", "create-user", "reset-profile")
+DEFAULT_MIX = "chat=70,profile=20,create-user=5,reset-profile=5"
+
+CHAT_PROMPTS = [
+    "Add {skill} to my skills.",
+    "Add {skill} and {tool} to my tools.",
+    "I use {skill} every day.",
+    "I work at {company} as an analyst.",
+    "I led the {skill} migration for the finance team.",
+    "What should I highlight for a data role?",
+    "Set my location to {city}.",
+    "Hi there!",
+]
+WORDS = {
+    "skill": ["SQL", "Python", "Excel", "Tableau", "budgeting", "forecasting", "dbt", "Power BI"],
+    "tool": ["Jira", "Looker", "Snowflake", "Git"],
+    "company": ["Contoso", "Fabrikam", "Northwind"],
+    "city": ["Austin", "Remote", "Seattle"],
+}
+
+# Which route the current thread is serving, for per-route call counts.
+_route: ContextVar[str] = ContextVar("bench_route", default="setup")
+_calls: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+_calls_lock = threading.Lock()
+
+
+def _count(name: str, amount: float = 1.0) -> None:
+    with _calls_lock:
+        _calls[_route.get()][name] += amount
+
+
+def install_fakes(llm_latency: float, db_latency: float, users: int):
+    """Point the app at in-memory backends and seed `users` profiles."""
+    os.environ.setdefault("AZURE_COSMOS_URL", "https://localhost:8081/")
+    os.environ.setdefault("AZURE_COSMOS_KEY", "offline")
+    os.environ.setdefault("TENANT_ID", "bench-tenant")
+    os.environ.setdefault("AUTH_CLIENT_ID", "bench-client")
+    patch("azure.cosmos.CosmosClient", MagicMock()).start()
+    patch("azure.cosmos.aio.CosmosClient", MagicMock()).start()
+
+    import agent
+    import cosmos_profile
+    from bench.fakes import AsyncFakeContainer, FakeContainer, ScriptedChatModel, hash_embedder
+    from utils import admission, conversation_memory, dbutils, pending_questions
+    from utils.profile_index import get_profile_index
+    from utils.profile_schema import new_profile
+
+    class CountingContainer(FakeContainer):
+        def _record(self, method, payload=None):
+            super()._record(method, payload)
+            _count(f"cosmos.{method}")
+
+        def _charge(self, method, doc, response_hook=None):
+            before = self.request_units
+            super()._charge(method, doc, response_hook)
+            _count("cosmos.ru", self.request_units - before)
+
+    class CountingModel(ScriptedChatModel):
+        def _respond(self, messages):
+            _count("llm.calls")
+            return super()._respond(messages)
+
+    container = CountingContainer(latency=db_latency)
+    for i in range(users):
+        container.create_item(dict(new_profile(f"user{i}", f"User {i}"), id=f"user{i}"))
+    model = CountingModel(latency=llm_latency)
+
+    patch.object(cosmos_profile, "get_container", lambda: container).start()
+    patch.object(dbutils, "_profiles_container", lambda: container).start()
+    patch.object(dbutils, "_async_profiles_container", lambda: AsyncFakeContainer(container)).start()
+    questions = CountingContainer(latency=db_latency)
+    patch.object(pending_questions, "_container", lambda: questions).start()
+    patch.object(pending_questions, "_async_container", lambda: AsyncFakeContainer(questions)).start()
+    conversations = CountingContainer(latency=db_latency)
+    patch.object(conversation_memory, "_container", lambda: conversations).start()
+    patch.object(agent, "_build_llm", lambda: model).start()
+    patch("auth.jwt_utils._validate_token", return_value={"sub": "bench"}).start()
+    # A few hundred simulated users send far more turns each than real ones
+    # would; keep the concurrency limit but not the per-user rate limit.
+    patch.object(admission, "_default_controller", admission.AdmissionController(user_rate=0)).start()
+    agent._agent = None
+    get_profile_index()._embed_many = hash_embedder
+    with _calls_lock:
+        _calls.clear()
+    return container, model
+
+
+def _parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        route, _, weight = part.partition("=")
+        if route.strip() not in ROUTES:
+            raise SystemExit(f"Unknown route in --mix: {route}")
+        weights[route.strip()] = float(weight)
+    return weights
+
+
+def _request(client, route: str, rng: random.Random, users: int, seq: int):
+    user_id = f"user{rng.randrange(users)}"
+    if route == "chat":
+        prompt = rng.choice(CHAT_PROMPTS).format(**{k: rng.choice(v) for k, v in WORDS.items()})
+        return client.post("/chat", json={"prompt": prompt, "user_id": user_id})
+    if route == "profile":
+        return client.get("/profile", query_string={"user_id": user_id})
+    if route == "create-user":
+        return client.post(
+            "/create-user",
+            json={"user_id": f"new{seq}", "name": "New User"},
+            headers={"Authorization": "Bearer bench"},
+        )
+    return client.post("/reset-profile", query_string={"user_id": user_id})
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    # Nearest-rank percentile.
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def run(total: int, concurrency: int, mix: Dict[str, float], users: int, seed: int = 0) -> dict:
+    from app import app
+
+    routes, weights = zip(*mix.items())
+    plan = random.Random(seed).choices(routes, weights=weights, k=total)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def worker(worker_id: int) -> None:
+        client = app.test_client()
+        rng = random.Random(seed * 1000 + worker_id)
+        while True:
+            with lock:
+                seq = next(counter)
+            if seq >= total:
+                return
+            route = plan[seq]
+            token = _route.set(route)
+            start = time.perf_counter()
+            try:
+                response = _request(client, route, rng, users, seq)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            finally:
+                elapsed = time.perf_counter() - start
+                _route.reset(token)
+            with lock:
+                latencies[route].append(elapsed)
+                if failed:
+                    errors[route] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    report = {"requests": total, "concurrency": concurrency, "seconds": round(wall, 3), "rps": round(total / wall, 1), "routes": {}}
+    for route in routes:
+        values = latencies[route]
+        if not values:
+            continue
+        calls = _calls.get(route, {})
+        report["routes"][route] = {
+            "requests": len(values),
+            "errors": errors[route],
+            "rps": round(len(values) / wall, 1),
+            "p50_ms": round(_percentile(values, 50) * 1000, 2),
+            "p95_ms": round(_percentile(values, 95) * 1000, 2),
+            "p99_ms": round(_percentile(values, 99) * 1000, 2),
+            "per_request": {name: round(count / len(values), 3) for name, count in sorted(calls.items())},
+        }
+    return report
+
+
+def _print(report: dict) -> None:
+    print(f"{report['requests']} requests, concurrency {report['concurrency']}: "
+          f"{report['rps']} req/s over {report['seconds']}s")
+    print(f"{'route':<14}{'reqs':>7}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  backend calls per request")
+    for route, stats in report["routes"].items():
+        calls = ", ".join(f"{name}={value:g}" for name, value in stats["per_request"].items())
+        print(f"{route:<14}{stats['requests']:>7}{stats['errors']:>5}{stats['rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}  {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"route weights (default {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=200, help="seeded profiles the requests spread over")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per model call")
+    parser.add_argument("--db-latency", type=float, default=0.003, help="seconds per Cosmos request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's log output")
+    args = parser.parse_args()
+    if not args.verbose:
+        # Expected misses (e.g. /create-user checking for a profile) log errors.
+        logging.disable(logging.CRITICAL)
+
+    install_fakes(args.llm_latency, args.db_latency, args.users)
+    report = run(args.requests, args.concurrency, _parse_mix(args.mix), args.users, args.seed)
+    report["config"] = {"llm_latency": args.llm_latency, "db_latency": args.db_latency, "mix": args.mix, "users": args.users}
+    _print(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Load test: sync Flask worker vs. async ASGI worker against stubbed backends.
+
+Cosmos and Azure OpenAI are replaced by stubs that only sleep for a
+configurable latency, so the numbers isolate how many chats one worker
+process can keep in flight.  A sync gunicorn worker serves one request at
+a time, which is modelled by driving the Flask app serially; the ASGI app
+is driven with `--concurrency` simultaneous requests on one event loop.
+
+Run from the repository root:
+
+    python -m bench.load_async --requests 400 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from unittest.mock import MagicMock, patch
+
+
+def _stub_backends(llm_latency: float, db_latency: float):
+    # Module-level Cosmos clients must not reach the network when imported.
+    os.environ.setdefault("AZURE_COSMOS_URL", "https://localhost:8081/")
+    os.environ.setdefault("AZURE_COSMOS_KEY", "offline")
+    patch("azure.cosmos.CosmosClient", MagicMock()).start()
+
+    class StubAgent:
+        def invoke(self, inputs, config=None):
+            time.sleep(llm_latency)
+            return "ok"
+
+        async def ainvoke(self, inputs, config=None):
+            await asyncio.sleep(llm_latency)
+            return "ok"
+
+    def get_profile(user_id):
+        time.sleep(db_latency)
+        return {}
+
+    async def aget_user_profile(user_id):
+        await asyncio.sleep(db_latency)
+        return {}
+
+    patch("agent.get_agent", return_value=StubAgent()).start()
+    # The sync path reads the profile through the turn, the async one directly.
+    patch("tools.update_profile.get_profile", get_profile).start()
+    patch("agent.aget_user_profile", aget_user_profile).start()
+    # Measure multiplexing itself, not the admission limits in front of it.
+    from utils import admission
+
+    patch.object(admission, "_default_controller", admission.AdmissionController(max_concurrent=0, user_rate=0)).start()
+
+
+def run_sync(total: int) -> float:
+    from app import app
+
+    client = app.test_client()
+    start = time.perf_counter()
+    for i in range(total):
+        assert client.post("/chat", json={"prompt": "hi", "user_id": f"u{i}"}).status_code == 200
+    return total / (time.perf_counter() - start)
+
+
+async def run_async(total: int, concurrency: int) -> float:
+    import httpx
+    from asgi import app
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i):
+            async with semaphore:
+                response = await client.post("/chat", json={"prompt": "hi", "user_id": f"u{i}"})
+                assert response.status_code == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per model call")
+    parser.add_argument("--db-latency", type=float, default=0.01, help="seconds per Cosmos read")
+    args = parser.parse_args()
+
+    _stub_backends(args.llm_latency, args.db_latency)
+    # The sync worker is slow by design; a handful of requests pins its rate.
+    sync_total = max(1, min(args.requests, 10))
+    sync_rps = run_sync(sync_total)
+    async_rps = asyncio.run(run_async(args.requests, args.concurrency))
+
+    print(f"sync  worker: {sync_rps:8.1f} req/s ({sync_total} requests, 1 in flight)")
+    print(f"async worker: {async_rps:8.1f} req/s ({args.requests} requests, {args.concurrency} in flight)")
+    print(f"speedup:      {async_rps / sync_rps:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
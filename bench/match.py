@@ -0,0 +1,116 @@
+"""
+Latency of the job match index (utils/job_match.py) at production scale.
+
+Builds the index from synthetic profiles drawn from realistic vocabularies,
+then times matches for random jobs and incremental updates.  Runs fully in
+memory; no Cosmos or model access.
+
+Run from the repository root:
+
+    python -m bench.match --profiles 50000 --queries 1000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+from unittest.mock import MagicMock, patch
+
+TITLES = [
+    "Data Analyst", "Senior Data Analyst", "Data Scientist", "Machine Learning Engineer", "Software Engineer",
+    "Backend Engineer", "Frontend Developer", "Product Manager", "Financial Analyst", "Business Analyst",
+    "DevOps Engineer", "Data Engineer", "Research Scientist", "Project Manager", "UX Designer",
+]
+SKILLS = [
+    "SQL", "Python", "Excel", "Tableau", "Power BI", "R", "Java", "JavaScript", "TypeScript", "React", "Node.js",
+    "AWS", "Azure", "Google Cloud Platform", "Docker", "Kubernetes", "Terraform", "Spark", "Airflow", "dbt",
+    "Snowflake", "PostgreSQL", "MongoDB", "Machine Learning", "Deep Learning", "NLP", "Statistics", "Forecasting",
+    "Financial Modeling", "Budgeting", "Scrum", "Agile", "Figma", "C++", "C#", "Go", "Rust", "Scala", "Looker",
+    "Pandas", "PyTorch", "TensorFlow", "Git", "Linux", "CI/CD", "GraphQL", "REST APIs", "Kafka", "Redis", "SAS",
+]
+SKILLS += [f"Skill {i}" for i in range(450)]  # long tail of rarer skills
+LOCATIONS = ["Toronto, ON", "Vancouver, BC", "Montreal, QC", "New York, NY", "London", "Berlin", "Remote", "Austin, TX"]
+INDUSTRIES = ["Finance", "Healthcare", "Retail", "Technology", "Energy", "Education", "Government", "Insurance"]
+KEYWORDS = ["hybrid", "equity", "visa sponsorship", "four day week", "startup", "enterprise", "on call", "travel"]
+
+
+def _profile(rng: random.Random, i: int) -> dict:
+    return {
+        "id": f"user{i}",
+        "current_title": rng.choice(TITLES),
+        "job_titles": rng.sample(TITLES, 2),
+        "skills": rng.sample(SKILLS[:50], 6) + rng.sample(SKILLS[50:], 4),
+        "tools": rng.sample(SKILLS[:50], 3),
+        "locations": rng.sample(LOCATIONS, 2),
+        "industries": rng.sample(INDUSTRIES, 2),
+        "must_have_keywords": rng.sample(KEYWORDS, 1) if rng.random() < 0.1 else [],
+        "excluded_keywords": rng.sample(KEYWORDS, 1) if rng.random() < 0.2 else [],
+    }
+
+
+def _job(rng: random.Random) -> dict:
+    skills = rng.sample(SKILLS[:50], 5) + rng.sample(SKILLS[50:], 1)
+    description = (
+        f"We are hiring a {rng.choice(TITLES)} to join our {rng.choice(INDUSTRIES)} team. "
+        f"You will work with {', '.join(rng.sample(SKILLS[:50], 4))} every day. "
+        f"This is a {rng.choice(KEYWORDS)} role. " * 3
+    )
+    return {
+        "title": rng.choice(TITLES),
+        "skills": skills,
+        "location": rng.choice(LOCATIONS),
+        "industry": rng.choice(INDUSTRIES),
+        "description": description,
+    }
+
+
+def _ms(samples):
+    samples = sorted(samples)
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AZURE_COSMOS_URL", "https://localhost:8081/")
+    os.environ.setdefault("AZURE_COSMOS_KEY", "offline")
+    patch("azure.cosmos.CosmosClient", MagicMock()).start()
+    from cosmos_profile import ProfileChange
+    from utils.job_match import MatchIndex
+
+    rng = random.Random(args.seed)
+    profiles = [_profile(rng, i) for i in range(args.profiles)]
+    index = MatchIndex(load=lambda: profiles, ttl=0)
+    started = time.perf_counter()
+    index.build()
+    print(f"build: {args.profiles} profiles, {index.stats()['terms']} terms in {time.perf_counter() - started:.2f} s")
+
+    latencies = []
+    for _ in range(args.queries):
+        job = _job(rng)
+        started = time.perf_counter()
+        matches = index.match(job, args.k)
+        latencies.append(time.perf_counter() - started)
+        assert len(matches) == args.k
+    p50, p99 = _ms(latencies)
+    print(f"match (top {args.k}): p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+    updates = []
+    for i in range(args.queries):
+        user_id = f"user{rng.randrange(args.profiles)}"
+        change = ProfileChange("add", "skills", rng.choice(SKILLS))
+        started = time.perf_counter()
+        index.on_profile_change(user_id, [change])
+        updates.append(time.perf_counter() - started)
+    p50, p99 = _ms(updates)
+    print(f"incremental update: p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Startup cost: time to import the app and time to the first response.
+
+Each sample runs in a fresh interpreter, as a newly forked worker would.
+Cosmos and the model are replaced by the local fakes (bench/fakes.py), so
+the numbers measure import and initialisation work, not the network.
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --top 15     # also list the slowest imports
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_PROBE = r"""
+import json, os, sys, time
+started = time.perf_counter()
+import asgi
+imported = time.perf_counter()
+
+from bench.load import install_fakes
+install_fakes(llm_latency=0.0, db_latency=0.0, users=1)
+from app import app
+client = app.test_client()
+assert client.get("/").status_code == 200
+first_response = time.perf_counter()
+assert client.post("/chat", json={"prompt": "I use SQL daily", "user_id": "user0"}).status_code == 200
+first_chat = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "first_response_s": first_response - started,
+    "first_chat_s": first_chat - started,
+}))
+"""
+
+_MODULES = "import sys, asgi; print(len(sys.modules), int(any(m.startswith('langchain') for m in sys.modules)))"
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    # Exercise the real lazy client set-up: no account configured.
+    env.pop("AZURE_COSMOS_URL", None)
+    env.pop("AZURE_COSMOS_KEY", None)
+    env["PYTHONPATH"] = os.getcwd() + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def sample() -> dict:
+    output = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, env=_env(), check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit: int) -> list:
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import asgi"], capture_output=True, text=True, env=_env())
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith(" ") and not name.startswith("   "):  # direct imports of asgi and their children
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="list the N slowest top-level imports")
+    args = parser.parse_args()
+
+    samples = [sample() for _ in range(args.runs)]
+    for key, label in (("import_s", "import asgi"), ("first_response_s", "first response"), ("first_chat_s", "first /chat")):
+        values = [s[key] * 1000 for s in samples]
+        print(f"{label:<15} median {statistics.median(values):7.0f} ms   min {min(values):7.0f} ms   max {max(values):7.0f} ms")
+    modules, langchain = subprocess.run(
+        [sys.executable, "-c", _MODULES], capture_output=True, text=True, env=_env(), check=True
+    ).stdout.split()
+    print(f"modules loaded by import: {modules}; LangChain imported: {'yes' if langchain == '1' else 'no'}")
+    if args.top:
+        print("slowest imports (cumulative):")
+        for micros, name in top_imports(args.top):
+            print(f"  {micros / 1000:7.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
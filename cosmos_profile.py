@@ -1,41 +1,37 @@
 # cosmos_profile.py
 
+import copy
 import os
-from azure.cosmos import CosmosClient, exceptions
+import random
+import time
+from typing import Iterable, List, NamedTuple, Optional
 
-from dotenv import load_dotenv
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
 
-load_dotenv()  # Load environment variables from .env file
-# Initialize Cosmos DB client
-COSMOS_URL = os.getenv("AZURE_COSMOS_URL")
-COSMOS_KEY = os.getenv("AZURE_COSMOS_KEY")
+# One pooled client and container handle, shared process-wide with utils.dbutils.
+from utils.cosmos import get_container
+from utils.metrics import COSMOS_RETRIES, cosmos_call
 
+# Cosmos accepts at most 10 operations in a single patch request.
+MAX_PATCH_OPERATIONS = 10
+# Attempts (and backoff, in seconds) when a conditional patch loses an ETag race.
+PATCH_MAX_ATTEMPTS = int(os.getenv("PROFILE_PATCH_MAX_ATTEMPTS", "5"))
+PATCH_BACKOFF_BASE = float(os.getenv("PROFILE_PATCH_BACKOFF_BASE", "0.02"))
+PATCH_BACKOFF_MAX = 0.5
 
-if not COSMOS_URL:
-    raise ValueError("Missing environment variable: AZURE_COSMOS_URL")
-if not COSMOS_KEY:
-    raise ValueError("Missing environment variable: AZURE_COSMOS_KEY")
-
-DATABASE_NAME = "zil_ai"
-CONTAINER_NAME = "profiles"
-
-
-
-client = CosmosClient(COSMOS_URL, COSMOS_KEY)
-db = client.get_database_client(DATABASE_NAME)
-container = db.get_container_client(CONTAINER_NAME)
 
 # Load profile for a given user
 def get_profile(user_id: str) -> dict:
     try:
-        return container.read_item(item=user_id, partition_key=user_id)
+        return cosmos_call("read_item", get_container().read_item, item=user_id, partition_key=user_id)
     except exceptions.CosmosResourceNotFoundError:
         return create_empty_profile(user_id)
 
 # Save or update profile
 def save_profile(user_id: str, profile_dict: dict):
     profile_dict["id"] = user_id
-    container.upsert_item(profile_dict)
+    cosmos_call("upsert_item", get_container().upsert_item, profile_dict)
 
 # Create default empty profile
 def create_empty_profile(user_id: str) -> dict:
@@ -55,5 +51,135 @@ def create_empty_profile(user_id: str) -> dict:
             "diversity_friendly": None
         }
     }
-    container.create_item(profile)
-    return profile
+    try:
+        return cosmos_call("create_item", get_container().create_item, profile)
+    except exceptions.CosmosResourceExistsError:
+        # Another request created it first.
+        return cosmos_call("read_item", get_container().read_item, item=user_id, partition_key=user_id)
+
+
+class ProfileChange(NamedTuple):
+    """One field mutation: op is "add" or "remove" (list fields) or "set" (any field)."""
+    op: str
+    field: str
+    value: object
+
+
+class ProfileConflictError(RuntimeError):
+    """Raised when a profile patch keeps losing ETag races after all retries."""
+
+
+def _pointer(field: str) -> str:
+    # JSON Pointer escaping (RFC 6901).
+    return "/" + field.replace("~", "~0").replace("/", "~1")
+
+
+def apply_change(profile: dict, change: ProfileChange) -> Optional[dict]:
+    """
+    Apply `change` to `profile` in place.
+
+    Returns the equivalent Cosmos patch operation, or None when the change
+    is a no-op against this version of the document (item already present,
+    item not there to remove, value already set).
+    """
+    path = _pointer(change.field)
+    if change.op == "add":
+        values = profile.get(change.field)
+        if values is None:
+            profile[change.field] = [change.value]
+            return {"op": "set", "path": path, "value": [change.value]}
+        if change.value in values:
+            return None
+        values.append(change.value)
+        return {"op": "add", "path": f"{path}/-", "value": change.value}
+    if change.op == "remove":
+        values = profile.get(change.field) or []
+        if change.value not in values:
+            return None
+        index = values.index(change.value)
+        del values[index]
+        return {"op": "remove", "path": f"{path}/{index}"}
+    if change.op == "set":
+        if change.field in profile and profile[change.field] == change.value:
+            return None
+        profile[change.field] = change.value
+        return {"op": "set", "path": path, "value": change.value}
+    raise ValueError(f"Unsupported profile change: {change.op}")
+
+
+def build_patch_operations(profile: dict, changes: Iterable[ProfileChange]) -> List[dict]:
+    """
+    Translate `changes` into patch operations against `profile`.
+
+    Operations are applied in order by Cosmos, so list indexes for removals
+    are computed against the document as the previous operations leave it.
+    `profile` is not modified.
+    """
+    working = copy.deepcopy(profile)
+    operations = []
+    for change in changes:
+        operation = apply_change(working, change)
+        if operation is not None:
+            operations.append(operation)
+    return operations
+
+
+def backoff(attempt: int) -> None:
+    """Sleep before retry `attempt` of a write that lost an ETag race (jittered, exponential)."""
+    delay = min(PATCH_BACKOFF_MAX, PATCH_BACKOFF_BASE * (2 ** attempt))
+    time.sleep(random.uniform(0, delay))
+
+
+def patch_profile(user_id: str, changes: List[ProfileChange], profile: Optional[dict] = None) -> Optional[dict]:
+    """
+    Write `changes` as partial-document patches conditioned on the profile's ETag.
+
+    Only the changed values travel over the wire, so the request size does
+    not grow with the profile.  If another writer modified the document in
+    the meantime (HTTP 412), the profile is re-read, the changes are
+    re-evaluated against it and the patch is retried with jittered
+    exponential backoff, so concurrent turns never overwrite each other.
+
+    Args:
+        user_id: The profile id (and partition key).
+        changes: Mutations in the order they were made.
+        profile: The document the changes were made against, including its
+            `_etag`.  Read from Cosmos when omitted.
+
+    Returns:
+        The updated document, or `profile` unchanged if nothing needed writing.
+
+    Raises:
+        ProfileConflictError: If every attempt lost an ETag race.
+    """
+    if profile is None:
+        profile = get_profile(user_id)
+    for attempt in range(PATCH_MAX_ATTEMPTS):
+        operations = build_patch_operations(profile, changes)
+        if not operations:
+            return profile
+        etag = profile.get("_etag")
+        try:
+            for start in range(0, len(operations), MAX_PATCH_OPERATIONS):
+                condition = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+                profile = cosmos_call(
+                    "patch_item",
+                    get_container().patch_item,
+                    item=user_id,
+                    partition_key=user_id,
+                    patch_operations=operations[start:start + MAX_PATCH_OPERATIONS],
+                    **condition,
+                )
+                etag = profile.get("_etag")
+            return profile
+        except exceptions.CosmosAccessConditionFailedError:
+            # A chunk may already have landed; re-reading and re-evaluating
+            # the changes makes the retry idempotent.
+            COSMOS_RETRIES.inc(operation="patch_item", reason="precondition_failed")
+            backoff(attempt)
+            profile = get_profile(user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            profile = create_empty_profile(user_id)
+    raise ProfileConflictError(
+        f"Profile {user_id} was modified concurrently {PATCH_MAX_ATTEMPTS} times; giving up"
+    )
@@ -0,0 +1,33 @@
+"""
+Gunicorn settings; startup.sh runs `gunicorn -c gunicorn.conf.py asgi:app`.
+
+Importing the app does no network I/O and defers LangChain, so workers
+boot quickly.  `post_fork` then starts the slow initialisation (model
+client, Cosmos client, JWKS, tokenizer) in the background of each new
+worker, so it overlaps with the worker starting to accept connections
+instead of landing on the first user's request.  `child_exit` drops an
+exited worker's metrics snapshot, so /metrics stops reporting it.
+"""
+
+import os
+import threading
+
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+timeout = 120
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "debug")
+
+
+def post_fork(server, worker):
+    def warm():
+        from app import warm_up
+
+        warm_up()
+
+    threading.Thread(target=warm, name="warm-up", daemon=True).start()
+
+
+def child_exit(server, worker):
+    from utils.metrics import REGISTRY
+
+    REGISTRY.remove_snapshot(worker.pid)
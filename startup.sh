@@ -1 +1,4 @@
-gunicorn app:app --log-level debug
\ No newline at end of file
+# Async workers: each process multiplexes many in-flight chats (see asgi.py).
+# Worker settings and the post-fork warm-up live in gunicorn.conf.py.
+# The plain Flask app can still be served with: gunicorn -c gunicorn.conf.py app:app -k sync
+gunicorn -c gunicorn.conf.py asgi:app
@@ -0,0 +1,31 @@
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+# cosmos_profile and utils.dbutils build Cosmos clients on first use. When no
+# account is configured, hand them an inert client so unit tests run offline.
+if not os.getenv("AZURE_COSMOS_URL"):
+    os.environ["AZURE_COSMOS_URL"] = "https://localhost:8081/"
+    os.environ["AZURE_COSMOS_KEY"] = "offline"
+    patch("azure.cosmos.CosmosClient", MagicMock()).start()
+
+
+@pytest.fixture(autouse=True)
+def conversation_memory(monkeypatch):
+    """A fresh, in-memory conversation store per test, so turns do not leak between tests."""
+    from utils import conversation_memory
+
+    memory = conversation_memory.ConversationMemory(persist=False)
+    monkeypatch.setattr(conversation_memory, "_default_memory", memory)
+    return memory
+
+
+@pytest.fixture(autouse=True)
+def admission_controller(monkeypatch):
+    """A fresh admission controller per test, so rate-limit buckets do not carry over."""
+    from utils import admission
+
+    controller = admission.AdmissionController()
+    monkeypatch.setattr(admission, "_default_controller", controller)
+    return controller
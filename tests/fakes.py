@@ -0,0 +1,3 @@
+"""In-process stand-ins for Cosmos DB used by the unit tests (shared with bench/)."""
+
+from bench.fakes import AsyncFakeContainer, FakeContainer, ScriptedChatModel, tool_call, hash_embedder  # noqa: F401
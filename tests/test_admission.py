@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+import app as app_module
+from utils import admission
+from utils.admission import AdmissionController, Rejected
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_user_bucket_allows_a_burst_then_refills():
+    clock = Clock()
+    controller = AdmissionController(user_rate=60, user_burst=2, clock=clock)
+    controller.run("u1", "a", lambda: "ok")
+    controller.run("u1", "b", lambda: "ok")
+
+    with pytest.raises(Rejected) as rejected:
+        controller.run("u1", "c", lambda: "ok")
+    assert rejected.value.reason == "rate_limited"
+    assert rejected.value.retry_after == pytest.approx(1.0)
+    # Other users have their own bucket.
+    assert controller.run("u2", "c", lambda: "ok") == "ok"
+
+    clock.now = 1.0
+    assert controller.run("u1", "c", lambda: "ok") == "ok"
+
+
+def test_waiters_get_slots_in_order():
+    controller = AdmissionController(max_concurrent=1, user_rate=0)
+    release = threading.Event()
+    order = []
+
+    def hold():
+        with controller.slot():
+            release.wait(1)
+
+    def wait(name):
+        with controller.slot():
+            order.append(name)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    while controller.stats()["in_flight"] == 0:
+        time.sleep(0.001)
+    waiters = []
+    for name in ("first", "second"):
+        waiters.append(threading.Thread(target=wait, args=(name,)))
+        waiters[-1].start()
+        while controller.stats()["queued"] < len(waiters):
+            time.sleep(0.001)
+    release.set()
+    for thread in [holder, *waiters]:
+        thread.join(1)
+
+    assert order == ["first", "second"]
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_full_queue_rejects_immediately():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, user_rate=0)
+    with controller.slot():
+        with pytest.raises(Rejected) as rejected:
+            with controller.slot():
+                pass
+    assert rejected.value.reason == "overloaded"
+
+
+def test_expected_wait_beyond_deadline_is_rejected_without_waiting():
+    controller = AdmissionController(max_concurrent=1, max_wait=5, user_rate=0)
+    controller._service_time = 8.0  # turns have been taking 8s
+    with controller.slot():
+        started = time.perf_counter()
+        with pytest.raises(Rejected) as rejected:
+            with controller.slot():
+                pass
+    assert time.perf_counter() - started < 0.1
+    assert rejected.value.retry_after_header == "8"
+
+
+def test_waiting_past_the_deadline_is_rejected():
+    controller = AdmissionController(max_concurrent=1, max_wait=0.05, user_rate=0)
+    with controller.slot():
+        with pytest.raises(Rejected):
+            with controller.slot():
+                pass
+    stats = controller.stats()
+    assert (stats["in_flight"], stats["queued"]) == (0, 0)
+
+
+def test_identical_requests_share_one_turn():
+    controller = AdmissionController(user_rate=0)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    results = []
+
+    def turn():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return "Added Excel."
+
+    leader = threading.Thread(target=lambda: results.append(controller.run("u1", "k", turn)))
+    leader.start()
+    started.wait(1)
+    follower = threading.Thread(target=lambda: results.append(controller.run("u1", "k", turn)))
+    follower.start()
+    time.sleep(0.02)
+    release.set()
+    leader.join(1)
+    follower.join(1)
+
+    assert results == ["Added Excel.", "Added Excel."]
+    assert len(calls) == 1
+
+
+def test_async_requests_queue_and_collapse():
+    controller = AdmissionController(max_concurrent=2, user_rate=0)
+    calls = []
+
+    async def turn(n):
+        calls.append(n)
+        await asyncio.sleep(0.05)
+        return n
+
+    async def go():
+        return await asyncio.gather(
+            controller.arun("u1", "same", lambda: turn("same")),
+            controller.arun("u1", "same", lambda: turn("same")),
+            *(controller.arun("u1", f"k{i}", lambda i=i: turn(i)) for i in range(4)),
+        )
+
+    results = asyncio.run(go())
+
+    assert results == ["same", "same", 0, 1, 2, 3]
+    assert calls.count("same") == 1
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_chat_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "_default_controller", AdmissionController(user_rate=60, user_burst=1))
+    client = app_module.app.test_client()
+    with patch("app.run_agent", return_value="ok"):
+        assert client.post("/chat", json={"prompt": "hi", "user_id": "u1"}).status_code == 200
+        response = client.post("/chat", json={"prompt": "hello", "user_id": "u1"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json()["reason"] == "rate_limited"
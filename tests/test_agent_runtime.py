@@ -0,0 +1,120 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel, GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+import agent
+import cosmos_profile
+from fakes import FakeContainer
+from utils.response_cache import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_runtime(monkeypatch):
+    monkeypatch.setattr(agent, "_agent", None)
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: FakeContainer())
+
+
+def _fake_llm(*replies):
+    return FakeMessagesListChatModel(responses=[AIMessage(content=r) for r in replies])
+
+
+def test_agent_is_built_once_per_worker():
+    with patch("agent._build_llm", return_value=_fake_llm("hi", "hello")) as build_llm:
+        assert "hi" in agent.run_agent("first", "u1")
+        assert "hello" in agent.run_agent("second", "u2")
+    assert build_llm.call_count == 1
+
+
+@patch("agent.update_profile.add_to_list_field", return_value="OK")
+def test_tools_act_on_the_current_user(mock_add):
+    tool = next(t for t in agent.TOOLS if t.name == "AddToListField")
+
+    token = agent._current_user_id.set("u1")
+    try:
+        assert tool.invoke({"field_name": "skills", "item": "Excel"}) == "OK"
+    finally:
+        agent._current_user_id.reset(token)
+
+    mock_add.assert_called_once_with("u1", field_name="skills", item="Excel")
+
+
+def test_user_binding_is_cleared_after_turn():
+    with patch("agent._build_llm", return_value=_fake_llm("done")):
+        agent.run_agent("hello", "u1")
+    with pytest.raises(LookupError):
+        agent._current_user_id.get()
+
+
+def _streaming_llm(*messages):
+    return GenericFakeChatModel(messages=iter(messages))
+
+
+def test_stream_agent_yields_tokens_then_done():
+    with patch("agent._build_llm", return_value=_streaming_llm(AIMessage(content="Hello there friend"))):
+        events = list(agent.stream_agent("hi", "u1"))
+
+    tokens = [e["data"]["text"] for e in events if e["event"] == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == "Hello there friend"
+    assert events[-1] == {"event": "done", "data": {"response": "Hello there friend", "tool_calls": []}}
+
+
+@patch("agent.update_profile.add_to_list_field", return_value="Added 'Excel' to skills.")
+def test_stream_agent_reports_tool_calls(mock_add):
+    call = {"id": "call_1", "type": "function", "function": {"name": "AddToListField", "arguments": '{"field_name": "skills", "item": "Excel"}'}}
+    message = AIMessage(content="", additional_kwargs={"tool_calls": [call]})
+    with patch("agent._build_llm", return_value=_streaming_llm(message, AIMessage(content="Added Excel"))):
+        events = list(agent.stream_agent("I picked up Excel at my last job", "u1"))
+
+    assert {"event": "tool_call", "data": {"tool": "AddToListField", "args": {"field_name": "skills", "item": "Excel"}}} in events
+    assert {"event": "tool", "data": {"name": "AddToListField", "output": "Added 'Excel' to skills."}} in events
+    assert events[-1]["event"] == "done"
+    assert events[-1]["data"]["response"] == "Added Excel"
+    mock_add.assert_called_once_with("u1", field_name="skills", item="Excel")
+
+
+def test_stream_agent_reports_errors():
+    with patch("agent._build_llm", side_effect=RuntimeError("no model")):
+        events = list(agent.stream_agent("hi", "u1"))
+    assert [e["event"] for e in events] == ["error"]
+
+
+def test_arun_agent_uses_async_profile_read(monkeypatch):
+    async def aget_user_profile(user_id):
+        return {"pending_questions": ["Where are you based?"]}
+
+    monkeypatch.setattr(agent, "aget_user_profile", aget_user_profile)
+    with patch("agent._build_llm", return_value=_fake_llm("Noted")):
+        assert asyncio.run(agent.arun_agent("hi", "u1")) == "Noted"
+
+
+def test_arun_agent_keeps_response_cache_calls_off_the_loop(monkeypatch):
+    threads = []
+
+    class RecordingCache(ResponseCache):
+        def get(self, *args):
+            threads.append(threading.get_ident())
+            return super().get(*args)
+
+        def put(self, *args):
+            threads.append(threading.get_ident())
+            return super().put(*args)
+
+    async def aget_user_profile(user_id):
+        return {"_etag": '"1"'}
+
+    async def run():
+        loop_thread = threading.get_ident()
+        assert await agent.arun_agent("hi", "u1") == "Noted"
+        return loop_thread
+
+    monkeypatch.setattr(agent, "aget_user_profile", aget_user_profile)
+    monkeypatch.setattr(agent, "get_response_cache", lambda: RecordingCache())
+    with patch("agent._build_llm", return_value=_fake_llm("Noted")):
+        loop_thread = asyncio.run(run())
+
+    assert len(threads) == 2 and loop_thread not in threads
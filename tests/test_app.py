@@ -0,0 +1,41 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def _parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@patch("app.stream_agent")
+def test_chat_stream_sends_server_sent_events(mock_stream, client):
+    mock_stream.return_value = iter([
+        {"event": "token", "data": {"text": "Hi"}},
+        {"event": "done", "data": {"response": "Hi", "tool_calls": []}},
+    ])
+
+    response = client.post("/chat/stream", json={"prompt": "hello", "user_id": "u1"})
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert _parse_sse(response.get_data(as_text=True)) == [
+        ("token", {"text": "Hi"}),
+        ("done", {"response": "Hi", "tool_calls": []}),
+    ]
+    mock_stream.assert_called_once_with("hello", "u1", "default")
+
+
+def test_chat_stream_requires_prompt(client):
+    assert client.post("/chat/stream", json={"user_id": "u1"}).status_code == 400
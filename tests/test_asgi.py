@@ -0,0 +1,64 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import httpx
+
+import agent
+import asgi
+
+
+def _request(method, path, **kwargs):
+    async def go():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, **kwargs)
+
+    return asyncio.run(go())
+
+
+@patch("asgi.arun_agent")
+def test_chat_returns_agent_response(mock_run):
+    mock_run.return_value = "Added Excel."
+    response = _request("POST", "/chat", json={"prompt": "Add Excel", "user_id": "u1"})
+    assert response.status_code == 200
+    assert response.json() == {"response": "Added Excel."}
+    mock_run.assert_awaited_once_with("Add Excel", "u1", "default")
+
+
+def test_chat_requires_prompt():
+    assert _request("POST", "/chat", json={"user_id": "u1"}).status_code == 400
+
+
+def test_other_routes_fall_through_to_flask():
+    response = _request("GET", "/")
+    assert response.status_code == 200
+    assert "running" in response.text
+
+
+def test_chats_are_multiplexed_on_one_loop(monkeypatch):
+    class SlowAgent:
+        async def ainvoke(self, inputs, config=None):
+            await asyncio.sleep(0.2)
+            return "ok"
+
+    async def aget_user_profile(user_id):
+        return {}
+
+    monkeypatch.setattr(agent, "get_agent", lambda: SlowAgent())
+    monkeypatch.setattr(agent, "aget_user_profile", aget_user_profile)
+
+    async def go():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.post("/chat", json={"prompt": "hi", "user_id": f"u{i}"}) for i in range(50)
+            ))
+
+    start = time.perf_counter()
+    responses = asyncio.run(go())
+    elapsed = time.perf_counter() - start
+
+    assert all(r.json() == {"response": "ok"} for r in responses)
+    # 50 sequential turns would take 10s.
+    assert elapsed < 2
@@ -0,0 +1,138 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+import agent
+from cosmos_profile import ProfileChange
+from utils.background_jobs import JobQueue, MemoryJobStore, SQLiteJobStore
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(workers=2, retry_base=0.01, poll_interval=0.01)
+    yield queue
+    queue.stop(timeout=1)
+
+
+def test_jobs_run_in_the_background(queue):
+    ran = []
+    queue.register("index", lambda user_id, payload: ran.append((user_id, payload)))
+
+    assert queue.enqueue("index", "u1", {"field": "skills"})
+    assert queue.drain()
+    assert ran == [("u1", {"field": "skills"})]
+
+
+def test_waiting_duplicates_are_coalesced():
+    store = MemoryJobStore()
+    queue = JobQueue(store)
+    queue.register("index", lambda user_id, payload: None)
+    # Not started, so the first job is still waiting.
+    with patch.object(queue, "start"):
+        assert queue.enqueue("index", "u1")
+        assert not queue.enqueue("index", "u1")
+        assert queue.enqueue("index", "u2")
+    assert store.depth() == 2
+
+
+def test_a_running_job_does_not_swallow_new_work(queue):
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def handler(user_id, payload):
+        runs.append(user_id)
+        started.set()
+        release.wait(1)
+
+    queue.register("index", handler)
+    queue.enqueue("index", "u1")
+    assert started.wait(1)
+    # The running job may have read the profile before this edit.
+    assert queue.enqueue("index", "u1")
+    release.set()
+    assert queue.drain()
+    assert runs == ["u1", "u1"]
+
+
+def test_a_slow_claim_does_not_block_enqueue():
+    class BusyStore(MemoryJobStore):
+        """Claims stall the way a locked SQLite spool does under its busy timeout."""
+
+        def __init__(self):
+            super().__init__()
+            self.busy = threading.Event()
+            self.unlocked = threading.Event()
+
+        def claim(self, now):
+            self.busy.set()
+            self.unlocked.wait(2)
+            return super().claim(now)
+
+    store = BusyStore()
+    queue = JobQueue(store, workers=1, poll_interval=0.01)
+    ran = []
+    queue.register("index", lambda user_id, payload: ran.append(user_id))
+    queue.start()
+    try:
+        assert store.busy.wait(1)
+        enqueued = threading.Thread(target=queue.enqueue, args=("index", "u1"))
+        enqueued.start()
+        enqueued.join(0.5)
+        assert not enqueued.is_alive()
+        store.unlocked.set()
+        assert queue.drain(2)
+        assert ran == ["u1"]
+    finally:
+        store.unlocked.set()
+        queue.stop(timeout=1)
+
+
+def test_failures_are_retried_then_dropped(queue):
+    attempts = []
+
+    def flaky(user_id, payload):
+        attempts.append(user_id)
+        if len(attempts) < 3:
+            raise RuntimeError("embedding service down")
+
+    queue.register("flaky", flaky)
+    queue.register("broken", lambda user_id, payload: 1 / 0)
+    queue.enqueue("flaky", "u1")
+    queue.enqueue("broken", "u2")
+
+    assert queue.drain()
+    assert attempts == ["u1"] * 3
+    assert queue.stats() == {"depth": 0, "running": 0}
+
+
+def test_spool_is_shared_and_survives_restarts(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    SQLiteJobStore(path).push("index", "u1", {"n": 1}, run_at=0, enqueued_at=0)
+
+    ran = []
+    other = JobQueue(SQLiteJobStore(path), poll_interval=0.01)
+    other.register("index", lambda user_id, payload: ran.append((user_id, payload)))
+    other.start()
+    try:
+        assert other.drain()
+    finally:
+        other.stop(timeout=1)
+    assert ran == [("u1", {"n": 1})]
+
+
+def test_expired_leases_are_claimed_again(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite"), lease=10)
+    store.push("index", "u1", None, run_at=0, enqueued_at=0)
+
+    assert store.claim(now=1).user_id == "u1"
+    assert store.claim(now=5) is None
+    assert store.claim(now=12).user_id == "u1"
+
+
+def test_paragraph_changes_queue_an_index_refresh():
+    with patch("agent.get_job_queue") as get_job_queue:
+        agent._queue_paragraph_refresh("u1", [ProfileChange("add", "skills", "Excel")])
+        get_job_queue.return_value.enqueue.assert_not_called()
+        agent._queue_paragraph_refresh("u1", [ProfileChange("add", "experience_paragraphs", "Led a migration.")])
+    get_job_queue.return_value.enqueue.assert_called_once_with(agent.PARAGRAPH_INDEX_JOB, "u1")
@@ -0,0 +1,126 @@
+import pytest
+
+import cosmos_profile
+from fakes import FakeContainer
+from tools import update_profile
+from utils.canonical_terms import AliasTable, ListIndex, canonical_list, canonicalize, compact_profiles, fold, suggest
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("  MS  Excel. ", "Excel"),
+        ("excel ", "Excel"),
+        ("microsoft power bi", "Power BI"),
+        ("golang", "Go"),
+        ("- C++,", "C++"),
+        ("Pyhton", "Pyhton"),  # typos are only suggested
+        ("Scale", "Scale"),
+        ("Budget  forecasting;", "Budget forecasting"),
+    ],
+)
+def test_skills_are_canonicalized(value, expected):
+    assert canonicalize("skills", value) == expected
+
+
+def test_fields_have_their_own_tables():
+    assert canonicalize("industries", "Oil & Gas") == "Oil and Gas"
+    assert canonicalize("industries", "Software") == "Software"
+    assert canonicalize("industries", "Investment Banking") == "Investment Banking"
+    assert canonicalize("industries", "Excel") == "Excel"
+    assert canonicalize("tools", "ms excel") == "Excel"
+    assert canonicalize("locations", " toronto ") == "toronto"
+    assert fold(" Power\tBI ") == "power bi"
+
+
+def test_typos_are_suggested_not_applied():
+    assert suggest("skills", "Pyhton") == "Python"
+    assert suggest("skills", "Kubernets") == "Kubernetes"
+    assert suggest("skills", "Machine Lerning") == "Machine Learning"
+    assert suggest("skills", "Python") is None
+    assert suggest("skills", "Rx") is None  # too short
+    assert suggest("locations", "Torronto") is None
+
+
+def test_ambiguous_typos_get_no_suggestion():
+    table = AliasTable({"Stata": (), "Strata": ()})
+
+    assert table.nearest("stratta", 1) == "Strata"
+    assert table.nearest("strta", 1) is None
+    assert table.nearest("xtata", 1) is None  # first letter must match
+    with pytest.raises(ValueError):
+        AliasTable({"Go": ("golang",), "Golang": ()})
+
+
+def test_list_index_matches_any_spelling():
+    index = ListIndex("skills", ["excel", "Budgeting", 3])
+
+    assert "MS Excel" in index and "budgeting " in index and len(index) == 2
+    assert index.get("Microsoft Excel") == "excel"
+    index.add("Python")
+    index.discard("budgeting")
+    assert "python3" in index and "pyhton" not in index and "Budgeting" not in index
+    assert canonical_list("skills", ["excel", "MS Excel", "Python", "python3", 3]) == ["Excel", "Python", 3]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "u1", "skills": ["excel", "SQL"], "tools": []})
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    return container
+
+
+def test_turn_dedupes_spellings_and_removes_the_stored_one(store):
+    with update_profile.profile_turn("u1"):
+        assert update_profile.add_to_list_field("u1", field_name="skills", item="MS Excel") == "'Excel' is already in skills."
+        assert update_profile.add_to_list_field("u1", field_name="skills", item="python3") == "Added 'Python' to skills."
+        update_profile.add_to_list_field("u1", field_name="skills", item="Python")
+        update_profile.add_to_list_field("u1", field_name="skills", item="Baking")
+        update_profile.remove_from_list_field("u1", field_name="skills", item="Microsoft Excel")
+        update_profile.remove_from_list_field("u1", field_name="skills", item="Pyhton")  # not a spelling of Python
+        update_profile.add_to_list_field("u1", field_name="tools", item="k8s")
+
+    assert store.items["u1"]["skills"] == ["SQL", "Python", "Baking"]
+    assert store.items["u1"]["tools"] == ["Kubernetes"]
+    assert store.counts()["patch_item"] == 1
+
+
+def test_compaction_rewrites_profiles_once(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "a", "skills": ["excel", "MS Excel", "sql"], "industries": ["telecom"]})
+    container.create_item({"id": "b", "skills": ["SQL"], "tools": ["Tablaeu"]})
+
+    preview = compact_profiles(container, dry_run=True, page_size=1)
+    assert (preview.scanned, preview.compacted, container.count("patch_item")) == (2, 1, 0)
+    assert preview.changes == [{
+        "id": "a",
+        "skills": {"before": ["excel", "MS Excel", "sql"], "after": ["Excel", "SQL"]},
+        "industries": {"before": ["telecom"], "after": ["Telecommunications"]},
+    }]
+
+    report = compact_profiles(container, page_size=1)
+    assert (report.compacted, report.values_before, report.values_after) == (1, 4, 3)
+    assert container.items["a"]["skills"] == ["Excel", "SQL"]
+    assert report.suggestions == [{"id": "b", "field": "tools", "value": "Tablaeu", "suggestion": "Tableau"}]
+    assert container.items["b"]["tools"] == ["Tablaeu"]
+    assert compact_profiles(container).compacted == 0
+
+
+def test_compaction_keeps_values_written_concurrently(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "a", "skills": ["excel"]})
+    original = container.patch_item
+    raced = []
+
+    def patch_after_a_chat_turn(*args, **kwargs):
+        if not raced:
+            raced.append(True)
+            original(item="a", partition_key="a", patch_operations=[{"op": "add", "path": "/skills/-", "value": "Go"}])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(container, "patch_item", patch_after_a_chat_turn)
+    report = compact_profiles(container)
+
+    assert report.failed == 0
+    assert container.items["a"]["skills"] == ["Excel", "Go"]
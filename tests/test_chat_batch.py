@@ -0,0 +1,119 @@
+import json
+import threading
+
+import pytest
+from langchain_core.agents import AgentActionMessageLog, AgentFinish
+
+import agent
+import cosmos_profile
+from fakes import FakeContainer
+
+
+def _add(item):
+    return [AgentActionMessageLog(tool="AddToListField", tool_input={"field_name": "skills", "item": item}, log="", message_log=[])]
+
+
+class Planner:
+    """Agent stand-in: plans one AddToListField for prompts naming a skill, then answers."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def plan(self, inputs):
+        prompt = inputs["input"]
+        if self.fail_on and self.fail_on in prompt:
+            return RuntimeError("model unavailable")
+        if inputs["intermediate_steps"] or not prompt.startswith("I use "):
+            return AgentFinish({"output": "Noted."}, "")
+        return _add(prompt[len("I use "):])
+
+    def batch(self, inputs, config=None, return_exceptions=False):
+        with self.lock:
+            self.batches.append(len(inputs))
+        return [self.plan(i) for i in inputs]
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = FakeContainer()
+    for user_id in ("u1", "u2", "u3"):
+        container.create_item({"id": user_id, "skills": []})
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    monkeypatch.setattr(agent.pending_questions, "head", lambda user_id: [])
+    return container
+
+
+def _run(planner, requests, **kwargs):
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(agent, "get_agent", lambda: planner)
+        return list(agent.run_agent_batch(requests, **kwargs))
+
+
+def test_batch_runs_each_users_prompts_in_order_with_one_read_and_write(container):
+    planner = Planner()
+    requests = [("u1", "I use SQL"), ("u2", "I use Excel"), ("u1", "I use Tableau"), ("u3", "hello")]
+
+    events = _run(planner, requests, max_concurrency=2)
+
+    results = {e["data"]["index"]: e["data"] for e in events if e["event"] == "result"}
+    assert sorted(results) == [0, 1, 2, 3]
+    assert results[2]["tool_calls"] == [{"tool": "AddToListField", "args": {"field_name": "skills", "item": "Tableau"}}]
+    assert container.items["u1"]["skills"] == ["SQL", "Tableau"]
+    assert container.items["u2"]["skills"] == ["Excel"]
+    # Profiles are read once and written once per user that changed.
+    assert container.counts()["read_item"] == 3
+    assert container.counts()["patch_item"] == 2
+    assert {e["data"]["user_id"]: e["data"]["written"] for e in events if e["event"] == "saved"} == {"u1": True, "u2": True, "u3": False}
+    # Never more than max_concurrency prompts per model batch.
+    assert max(planner.batches) <= 2
+    assert events[-1]["event"] == "done"
+    assert events[-1]["data"]["results"] == 4
+
+
+def test_dry_run_reports_planned_calls_without_writing(container):
+    events = _run(Planner(), [("u1", "I use SQL"), ("u2", "Add Excel to my skills.")], dry_run=True)
+
+    calls = {e["data"]["user_id"]: e["data"]["tool_calls"] for e in events if e["event"] == "result"}
+    assert calls["u1"] == [{"tool": "AddToListField", "args": {"field_name": "skills", "item": "SQL"}}]
+    assert calls["u2"] == [{"tool": "AddToListField", "args": {"field_name": "skills", "item": "Excel"}}]
+    assert container.items["u1"]["skills"] == container.items["u2"]["skills"] == []
+    assert "patch_item" not in container.counts()
+    assert not [e for e in events if e["event"] == "saved"]
+
+
+def test_a_failed_prompt_does_not_stop_the_batch(container):
+    events = _run(Planner(fail_on="Excel"), [("u1", "I use Excel"), ("u1", "I use SQL"), ("u2", "I use R")])
+
+    errors = [e["data"] for e in events if e["event"] == "error"]
+    assert [error["index"] for error in errors] == [0]
+    assert container.items["u1"]["skills"] == ["SQL"]
+    assert container.items["u2"]["skills"] == ["R"]
+    assert events[-1]["data"]["errors"] == 1
+
+
+@pytest.fixture
+def authed_client(monkeypatch):
+    import app as app_module
+    from auth import jwt_utils
+
+    monkeypatch.setenv("TENANT_ID", "tenant")
+    monkeypatch.setenv("AUTH_CLIENT_ID", "client")
+    monkeypatch.setattr(jwt_utils, "_validate_token", lambda token, tenant_id, client_id: {"sub": "admin"})
+    return app_module.app.test_client()
+
+
+def test_chat_batch_endpoint_streams_ndjson(authed_client, monkeypatch):
+    monkeypatch.setattr("app.run_agent_batch", lambda requests, dry_run: iter([{"event": "done", "data": {"requests": requests, "dry_run": dry_run}}]))
+    body = {"items": [{"user_id": "u1", "prompt": "I use SQL"}], "dry_run": True}
+
+    response = authed_client.post("/chat/batch", json=body, headers={"Authorization": "Bearer t"})
+
+    assert response.mimetype == "application/x-ndjson"
+    assert json.loads(response.get_data(as_text=True)) == {"event": "done", "data": {"requests": [["u1", "I use SQL"]], "dry_run": True}}
+
+
+def test_chat_batch_endpoint_validates_items(authed_client):
+    response = authed_client.post("/chat/batch", json={"items": [{"user_id": "u1"}]}, headers={"Authorization": "Bearer t"})
+    assert response.status_code == 400
@@ -0,0 +1,124 @@
+import threading
+from unittest.mock import patch
+
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+
+import agent
+import cosmos_profile
+from fakes import FakeContainer
+from utils import conversation_memory
+from utils.conversation_memory import ConversationMemory
+from utils.prompt_context import count_tokens
+
+
+def _chat(memory, n, user_id="u1", session_id="s1"):
+    for i in range(n):
+        memory.record(user_id, session_id, f"message {i} " + "word " * 50, f"reply {i}")
+
+
+def test_recent_turns_are_kept_verbatim():
+    memory = ConversationMemory(recent_turns=3, persist=False)
+    memory.record("u1", "s1", "I work at Contoso", "Noted.")
+
+    context, version = memory.context("u1", "s1")
+    assert context == "User: I work at Contoso\nAssistant: Noted."
+    assert version != memory.context("u1", "other")[1]
+    assert memory.context("u1", "other")[0] == "(new conversation)"
+
+
+def test_prompt_size_stays_bounded():
+    memory = ConversationMemory(recent_turns=4, summary_tokens=60, message_tokens=30, persist=False)
+    sizes = []
+    for n in (5, 20, 60):
+        _chat(memory, n)
+        memory.drain()
+        sizes.append(count_tokens(memory.context("u1", "s1")[0]))
+
+    assert max(sizes) <= 60 + 4 * 2 * (30 + 4) + 20
+    assert "message 59" in memory.context("u1", "s1")[0]
+
+
+def test_old_turns_are_folded_into_the_summary_in_the_background():
+    release = threading.Event()
+    prompts = []
+
+    def summarizer(prompt):
+        release.wait(5)
+        prompts.append(prompt)
+        return "User works at Contoso."
+
+    memory = ConversationMemory(recent_turns=2, persist=False, summarizer=summarizer)
+    memory.record("u1", "s1", "I work at Contoso", "Noted.")
+    memory.record("u1", "s1", "I use SQL", "Added.")
+    memory.record("u1", "s1", "I use Excel", "Added.")  # pushes the first turn out
+
+    # The turn does not wait for the summary.
+    assert "Contoso" not in memory.context("u1", "s1")[0]
+    release.set()
+    memory.drain()
+
+    context = memory.context("u1", "s1")[0]
+    assert context.startswith("Summary of earlier turns: User works at Contoso.")
+    assert "I use SQL" in context and "I use Excel" in context
+    assert len(prompts) == 1 and "I work at Contoso" in prompts[0]
+
+
+def test_failed_summary_falls_back_to_extractive():
+    def summarizer(prompt):
+        raise RuntimeError("model down")
+
+    memory = ConversationMemory(recent_turns=1, persist=False, summarizer=summarizer)
+    memory.record("u1", "s1", "I work at Contoso", "Noted.")
+    memory.record("u1", "s1", "I use SQL", "Added.")
+    memory.drain()
+
+    assert "User said: I work at Contoso" in memory.context("u1", "s1")[0]
+
+
+def test_sessions_persist_and_reload(monkeypatch):
+    container = FakeContainer()
+    monkeypatch.setattr(conversation_memory, "_container", lambda: container)
+    writer = ConversationMemory(recent_turns=2, persist=True)
+    writer.record("u1", "s/1", "I work at Contoso", "Noted.")
+
+    reader = ConversationMemory(recent_turns=2, persist=True)
+    assert reader.context("u1", "s/1") == writer.context("u1", "s/1")
+    assert container.count("read_item") == 2
+
+    reader.context("u1", "s/1")
+    assert container.count("read_item") == 2  # served from the LRU
+
+    doc = container.items["u1:s_1"]
+    assert writer.context("u1", "s/1")[1] == doc["_etag"]
+    assert doc["ttl"] == conversation_memory.MEMORY_DOCUMENT_TTL
+
+
+def test_concurrent_workers_do_not_overwrite_each_other(monkeypatch):
+    container = FakeContainer()
+    monkeypatch.setattr(conversation_memory, "_container", lambda: container)
+    first = ConversationMemory(recent_turns=4, persist=True)
+    second = ConversationMemory(recent_turns=4, persist=True)
+    first.record("u1", "s1", "I work at Contoso", "Noted.")
+    second.context("u1", "s1")
+
+    first_version = first.record("u1", "s1", "I use SQL", "Added.")
+    second_version = second.record("u1", "s1", "I use Excel", "Added.")  # stale ETag: reloads and retries
+
+    assert [t[0] for t in container.items["u1:s1"]["turns"]] == ["I work at Contoso", "I use SQL", "I use Excel"]
+    assert first_version != second_version == container.items["u1:s1"]["_etag"]
+    assert container.count("upsert_item") == 0
+
+
+def test_agent_sees_previous_turns(monkeypatch):
+    model = FakeMessagesListChatModel(responses=[AIMessage(content="Nice to meet you."), AIMessage(content="Contoso.")])
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: FakeContainer())
+
+    with patch.object(agent, "_agent", None), \
+            patch("agent._build_llm", return_value=model), \
+            patch("agent._build_inputs", wraps=agent._build_inputs) as build_inputs:
+        agent.run_agent("I work at Contoso", "u1", "s1")
+        assert agent.run_agent("Where do I work?", "u1", "s1") == "Contoso."
+
+    conversation = build_inputs.call_args.args[4]
+    assert conversation == "User: I work at Contoso\nAssistant: Nice to meet you."
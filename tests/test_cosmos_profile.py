@@ -0,0 +1,162 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+import cosmos_profile
+from cosmos_profile import ProfileChange
+from fakes import FakeContainer
+from tools import update_profile
+from utils import dbutils
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "u1", "skills": ["SQL", "Excel", "R"], "location": ""})
+    container.calls.clear()
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    monkeypatch.setattr(cosmos_profile, "PATCH_BACKOFF_BASE", 0)
+    return container
+
+
+def test_build_patch_operations_tracks_list_indexes():
+    profile = {"skills": ["SQL", "Excel", "R"], "location": ""}
+    operations = cosmos_profile.build_patch_operations(profile, [
+        ProfileChange("remove", "skills", "Excel"),
+        ProfileChange("remove", "skills", "R"),
+        ProfileChange("add", "skills", "Go"),
+        ProfileChange("add", "skills", "SQL"),
+        ProfileChange("add", "tools", "Jira"),
+        ProfileChange("set", "location", "Remote"),
+        ProfileChange("set", "a/b", "x"),
+    ])
+    assert operations == [
+        {"op": "remove", "path": "/skills/1"},
+        {"op": "remove", "path": "/skills/1"},
+        {"op": "add", "path": "/skills/-", "value": "Go"},
+        {"op": "set", "path": "/tools", "value": ["Jira"]},
+        {"op": "set", "path": "/location", "value": "Remote"},
+        {"op": "set", "path": "/a~1b", "value": "x"},
+    ]
+    assert profile == {"skills": ["SQL", "Excel", "R"], "location": ""}
+
+
+def test_patch_payload_does_not_grow_with_profile(container):
+    container.items["u1"]["experience_paragraphs"] = ["x" * 2000] * 200
+    cosmos_profile.patch_profile("u1", [ProfileChange("add", "skills", "Go")])
+    method, size = container.calls[-1]
+    assert method == "patch_item"
+    assert size < 200
+    assert container.count("upsert_item") == 0
+
+
+def test_patch_is_chunked_and_conditioned(container):
+    changes = [ProfileChange("add", "skills", f"s{i}") for i in range(25)]
+    result = cosmos_profile.patch_profile("u1", changes)
+    assert container.count("patch_item") == 3
+    assert result["skills"][-1] == "s24"
+    assert result["_etag"] == container.items["u1"]["_etag"]
+
+
+def test_stale_etag_is_retried_against_fresh_document(container):
+    stale = container.read_item("u1", "u1")
+    container.patch_item("u1", "u1", [{"op": "add", "path": "/skills/-", "value": "Go"}])
+
+    result = cosmos_profile.patch_profile("u1", [
+        ProfileChange("add", "skills", "Go"),
+        ProfileChange("remove", "skills", "Excel"),
+    ], stale)
+
+    assert result["skills"] == ["SQL", "R", "Go"]
+
+
+def test_gives_up_after_bounded_attempts(container, monkeypatch):
+    original = container.patch_item
+
+    def always_conflicting(*args, **kwargs):
+        # Someone else writes between our read and our patch, every time.
+        container.items["u1"]["_etag"] += "'"
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(container, "patch_item", always_conflicting)
+    with pytest.raises(cosmos_profile.ProfileConflictError):
+        cosmos_profile.patch_profile("u1", [ProfileChange("add", "skills", "Go")])
+    assert container.count("patch_item") == cosmos_profile.PATCH_MAX_ATTEMPTS
+
+
+def test_concurrent_turns_do_not_lose_updates(container):
+    # Each retry round lets at least one writer through, so 4 writers fit in the attempt budget.
+    barrier = threading.Barrier(4)
+
+    def turn(i):
+        with update_profile.profile_turn("u1") as t:
+            t.snapshot()
+            barrier.wait()
+            update_profile.add_to_list_field("u1", field_name="skills", item=f"skill-{i}")
+
+    threads = [threading.Thread(target=turn, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(container.items["u1"]["skills"][3:]) == sorted(f"skill-{i}" for i in range(4))
+
+
+def test_missing_profile_is_created(container):
+    result = cosmos_profile.patch_profile("new", [ProfileChange("add", "skills", "Go")])
+    assert result["skills"] == ["Go"]
+    assert container.items["new"]["skills"] == ["Go"]
+
+
+def test_upsert_user_profile_creates_missing_profiles_as_given(container, monkeypatch):
+    monkeypatch.setattr(dbutils, "_profiles_container", lambda: container)
+
+    dbutils.upsert_user_profile("new", {"name": "Zil", "skills": []})
+
+    assert container.counts() == {"read_item": 1, "create_item": 1}
+    assert container.items["new"] == {"id": "new", "name": "Zil", "skills": [], "user_id": "new", "_etag": container.items["new"]["_etag"]}
+
+
+def test_upsert_user_profile_merges_with_conditioned_patches(container, monkeypatch):
+    monkeypatch.setattr(dbutils, "_profiles_container", lambda: container)
+
+    dbutils.upsert_user_profile("u1", {"name": "Zil", "skills": []})
+    dbutils.upsert_user_profile("u1", {"headline": "Analyst", "name": "Zil"})
+
+    assert container.items["u1"]["name"] == "Zil"
+    assert container.items["u1"]["headline"] == "Analyst"
+    assert container.items["u1"]["user_id"] == "u1"
+    assert container.counts() == {"read_item": 2, "patch_item": 2}
+
+
+def test_upsert_user_profile_retries_after_a_concurrent_write(container, monkeypatch):
+    monkeypatch.setattr(dbutils, "_profiles_container", lambda: container)
+    original = container.patch_item
+    attempts = []
+
+    def patch_after_a_chat_turn(*args, **kwargs):
+        attempts.append(kwargs.get("etag"))
+        if len(attempts) == 1:
+            original(item="u1", partition_key="u1", patch_operations=[{"op": "add", "path": "/skills/-", "value": "Go"}])
+        return original(*args, **kwargs)
+
+    container.patch_item = patch_after_a_chat_turn
+    dbutils.upsert_user_profile("u1", {"name": "Zil"})
+
+    assert len(attempts) == 2 and all(attempts)  # the stale patch and its retry
+    assert container.items["u1"]["skills"] == ["SQL", "Excel", "R", "Go"]
+    assert container.items["u1"]["name"] == "Zil"
+
+
+def test_profile_modules_share_one_client_and_container(monkeypatch):
+    from utils import cosmos
+
+    monkeypatch.setattr(cosmos, "CosmosClient", MagicMock())
+    monkeypatch.setattr(cosmos, "_client", None)
+    monkeypatch.setattr(cosmos, "_containers", {})
+
+    assert cosmos_profile.get_container() is dbutils._profiles_container()
+    assert cosmos.get_container() is cosmos.get_container()
+    cosmos.CosmosClient.assert_called_once()
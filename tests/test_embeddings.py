@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from utils.embeddings import DiskVectorStore, EmbeddingService, embedding_key
+
+
+class CountingEmbedder(DeterministicFakeEmbedding):
+    calls: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def embedder():
+    return CountingEmbedder(size=8, calls=[])
+
+
+def test_repeated_texts_hit_memory_cache(embedder, tmp_path):
+    service = EmbeddingService(embedder, store_path=str(tmp_path))
+    first = service.embed("Excel")
+    second = service.embed("Excel")
+
+    np.testing.assert_array_equal(first, second)
+    np.testing.assert_allclose(first, embedder.embed_query("Excel"), rtol=1e-6)
+    assert first.dtype == np.float32
+    assert len(embedder.calls) == 1
+    assert service.stats()["hits"] == 1
+    assert service.stats()["misses"] == 1
+
+
+def test_disk_store_is_shared_across_services(embedder, tmp_path):
+    EmbeddingService(embedder, store_path=str(tmp_path)).embed_many(["SQL", "Tableau"])
+    other = EmbeddingService(embedder, store_path=str(tmp_path))
+
+    vectors = other.embed_many(["SQL", "Tableau", "Python"])
+
+    assert [len(batch) for batch in embedder.calls] == [2, 1]
+    assert other.stats()["disk_hits"] == 2
+    np.testing.assert_allclose(vectors[0], embedder.embed_query("SQL"), rtol=1e-6)
+
+
+def test_repeated_texts_are_stored_once(embedder, tmp_path):
+    service = EmbeddingService(embedder, store_path=str(tmp_path), cache_size=0)
+    service.embed_many(["a", "a", "bb"])
+    service.embed_many(["ccc"])
+
+    vectors = EmbeddingService(embedder, store_path=str(tmp_path)).embed_many(["a", "bb", "ccc"])
+    for text, vector in zip(["a", "bb", "ccc"], vectors):
+        np.testing.assert_allclose(vector, embedder.embed_query(text), rtol=1e-6)
+    assert embedder.calls == [["a", "bb"], ["ccc"]]  # the fresh service reads every vector from disk
+
+
+def test_rows_are_counted_from_the_key_file(tmp_path):
+    a, b, c = (embedding_key(text) for text in "abc")
+    # A store written before repeated keys were skipped holds `a` twice.
+    DiskVectorStore(str(tmp_path)).put_many([a], [np.ones(4, dtype=np.float32)])
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.array([1, 1, 1, 1, 2, 2, 2, 2], dtype=np.float32).tobytes())
+    with open(tmp_path / "keys.bin", "ab") as f:
+        f.write(a + b)
+
+    DiskVectorStore(str(tmp_path)).put_many([c], [np.full(4, 3, dtype=np.float32)])
+
+    assert [v[0] for v in DiskVectorStore(str(tmp_path)).get_many([a, b, c])] == [1, 2, 3]
+
+
+def test_namespaces_do_not_share_vectors(embedder, tmp_path):
+    EmbeddingService(embedder, namespace="model-a", store_path=str(tmp_path)).embed("SQL")
+    EmbeddingService(embedder, namespace="model-b", store_path=str(tmp_path)).embed("SQL")
+    assert len(embedder.calls) == 2
+
+
+def test_concurrent_requests_are_micro_batched(embedder):
+    service = EmbeddingService(embedder, store_path=None, max_batch=64, max_wait_ms=50)
+    barrier = threading.Barrier(16)
+    results = {}
+
+    def worker(i):
+        barrier.wait()
+        results[i] = service.embed(f"text {i % 8}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(embedder.calls) < 16
+    assert sum(len(batch) for batch in embedder.calls) <= 16
+    for i, vector in results.items():
+        np.testing.assert_allclose(vector, embedder.embed_query(f"text {i % 8}"), rtol=1e-6)
+
+
+def test_batcher_propagates_errors(tmp_path):
+    class Broken:
+        def embed_documents(self, texts):
+            raise RuntimeError("quota exceeded")
+
+    service = EmbeddingService(Broken(), store_path=None)
+    with pytest.raises(RuntimeError, match="quota"):
+        service.embed("SQL")
+
+
+def test_disk_store_rejects_dimension_change(tmp_path):
+    store = DiskVectorStore(str(tmp_path))
+    store.put_many([embedding_key("a")], [np.ones(4, dtype=np.float32)])
+    with pytest.raises(ValueError):
+        DiskVectorStore(str(tmp_path), dim=8)
+    assert len(DiskVectorStore(str(tmp_path))) == 1
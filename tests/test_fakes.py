@@ -0,0 +1,61 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+import agent
+import cosmos_profile
+from fakes import AsyncFakeContainer, FakeContainer, ScriptedChatModel, tool_call, hash_embedder
+from utils import dbutils
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "u1", "skills": []})
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    monkeypatch.setattr(dbutils, "_profiles_container", lambda: container)
+    monkeypatch.setattr(agent, "_agent", None)
+    return container
+
+
+def test_scripted_model_drives_the_real_agent(container):
+    model = ScriptedChatModel()
+    with patch("agent._build_llm", return_value=model):
+        reply = agent.run_agent("I use Snowflake every day", "u1")
+
+    assert reply == "Thanks, noted."
+    assert container.items["u1"]["skills"] == ["Snowflake"]
+    assert container.count("read_item") == 1  # the prompt and the tools share one read
+    # One call plans the tool, a second answers after seeing its result.
+    assert model.calls == 2
+
+
+def test_scripted_model_answers_text_when_no_rule_matches():
+    model = ScriptedChatModel(script=[(r"never", lambda m: tool_call("X"))], reply="Hello!")
+    assert model.invoke("hi").content == "Hello!"
+
+
+def test_request_charges_are_reported():
+    container = FakeContainer(ru_model={"create_item": (5.0, 0.0), "read_item": (1.0, 0.0)})
+    charges = []
+    hook = lambda headers, _: charges.append(float(headers["x-ms-request-charge"]))
+
+    container.create_item({"id": "u1"}, response_hook=hook)
+    container.read_item("u1", "u1", response_hook=hook)
+
+    assert charges == [5.0, 1.0]
+    assert container.request_units == 6.0
+    assert container.counts() == {"create_item": 1, "read_item": 1}
+
+
+def test_async_container_shares_the_store():
+    container = FakeContainer(latency=0.001)
+    container.create_item({"id": "u1", "name": "Zil"})
+    doc = asyncio.run(AsyncFakeContainer(container).read_item("u1", partition_key="u1"))
+    assert doc["name"] == "Zil"
+
+
+def test_hash_embedder_is_deterministic():
+    first, second = hash_embedder(["tax audit", "tax audit"])
+    assert (first == second).all()
@@ -0,0 +1,116 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from langchain_core.agents import AgentFinish
+
+import agent
+import cosmos_profile
+from fakes import FakeContainer
+from utils import intent_router
+from utils.intent_router import RoutedCommand, parse_sentence, route, summarize
+
+
+@pytest.mark.parametrize(
+    "sentence, expected",
+    [
+        (
+            "Add budgeting, Tableau, and Excel to my skills.",
+            [("add_to_list_field", "skills", v) for v in ("budgeting", "Tableau", "Excel")],
+        ),
+        ("please add Power BI and dbt to my tools", [("add_to_list_field", "tools", "Power BI"), ("add_to_list_field", "tools", "dbt")]),
+        ("Remove COBOL from my skills list", [("remove_from_list_field", "skills", "COBOL")]),
+        ("Add Research and Development to my industries", [("add_to_list_field", "industries", "Research and Development")]),
+        ("Set my title to a Senior Analyst.", [("set_string_field", "current_title", "Senior Analyst")]),
+        ("Change my company to Contoso", [("set_string_field", "current_company", "Contoso")]),
+        ("I live in Austin, TX.", [("set_string_field", "location", "Austin, TX")]),
+    ],
+)
+def test_parses_structured_edits(sentence, expected):
+    assert parse_sentence(sentence) == [RoutedCommand(*c) for c in expected]
+
+
+@pytest.mark.parametrize(
+    "sentence",
+    [
+        "Can you add Excel to my skills?",
+        "Don't add Excel to my skills.",
+        "Maybe add Excel to my skills.",
+        "Add Excel or Tableau to my skills.",
+        "Add it to my skills.",
+        "Add Excel to my hobbies.",
+        "My role is to lead the analytics team.",
+        "My company is hiring.",
+        "My position is remote.",
+        "My city is beautiful.",
+        "My title is the same.",
+        "Add everything I did at my last job as an analyst for three years to my skills.",
+        "I worked at Contoso for five years.",
+    ],
+)
+def test_leaves_ambiguous_sentences_to_the_model(sentence):
+    assert parse_sentence(sentence) is None
+
+
+def test_route_splits_commands_from_remainder():
+    result = route("Add Excel to my skills. I also led the audit team at Contoso.")
+    assert result.commands == [RoutedCommand("add_to_list_field", "skills", "Excel")]
+    assert result.remainder == "I also led the audit team at Contoso."
+    assert not result.fully_handled
+    assert route("Add Excel to my skills.").fully_handled
+    assert not route("hello").fully_handled
+
+
+def test_abbreviations_do_not_end_a_sentence():
+    assert route("I live in St. Louis.").commands == [RoutedCommand("set_string_field", "location", "St. Louis")]
+    assert route("Set my title to Sr. Data Analyst.").commands == [RoutedCommand("set_string_field", "current_title", "Sr. Data Analyst")]
+    result = route("Add Excel to my skills. Ask J. Smith about it.")
+    assert result.commands == [RoutedCommand("add_to_list_field", "skills", "Excel")]
+    assert result.remainder == "Ask J. Smith about it."
+
+
+def test_summarize_groups_by_field():
+    commands = route("Add budgeting, Tableau and Excel to my skills. Set my location to Remote.").commands
+    assert summarize(commands) == "Added budgeting, Tableau and Excel to your skills. Updated your location to Remote."
+
+
+@pytest.fixture
+def store(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "u1", "skills": ["excel", "SQL"], "location": "Remote"})
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    return container
+
+
+def test_run_agent_skips_model_for_routed_prompts(store, monkeypatch):
+    monkeypatch.setattr(agent, "get_agent", MagicMock(side_effect=AssertionError("model called")))
+
+    reply = agent.run_agent("Add Tableau and Python to my skills", "u1")
+
+    assert reply == "Added Tableau and Python to your skills."
+    assert store.items["u1"]["skills"] == ["excel", "SQL", "Tableau", "Python"]
+
+
+def test_run_agent_confirms_what_was_actually_done(store, monkeypatch):
+    monkeypatch.setattr(agent, "get_agent", MagicMock(side_effect=AssertionError("model called")))
+
+    reply = agent.run_agent("Add MS Excel and python3 to my skills. Remove Go from my skills. Set my location to Remote.", "u1")
+
+    assert reply == (
+        "Excel is already in your skills. Added Python to your skills. "
+        "Go was not in your skills. Your location is already Remote."
+    )
+    assert store.items["u1"]["skills"] == ["excel", "SQL", "Python"]
+
+
+def test_run_agent_sends_only_the_remainder_to_the_model(store, monkeypatch):
+    fake_agent = MagicMock()
+    fake_agent.invoke.return_value = AgentFinish({"output": "Noted the audit work."}, "")
+    monkeypatch.setattr(agent, "get_agent", lambda: fake_agent)
+    monkeypatch.setattr(agent, "_profile_context", lambda *args: "{}")
+
+    reply = agent.run_agent("Add Tableau to my skills. I led the audit team.", "u1")
+
+    sent = fake_agent.invoke.call_args.args[0]["input"]
+    assert "I led the audit team." in sent
+    assert "Add Tableau" not in sent
+    assert reply == "Added Tableau to your skills. Noted the audit work."
@@ -0,0 +1,220 @@
+import threading
+
+import pytest
+
+from cosmos_profile import ProfileChange
+from fakes import FakeContainer
+from utils.job_match import MatchIndex, load_profiles, normalize_term, profile_terms
+
+PROFILES = [
+    {
+        "id": "analyst",
+        "current_title": "Data Analyst",
+        "skills": ["SQL", "Tableau", "Excel"],
+        "locations": ["Toronto, ON"],
+        "industries": ["Finance"],
+    },
+    {
+        "id": "engineer",
+        "job_titles": ["Backend Engineer"],
+        "skills": ["Python", "SQL", "Docker"],
+        "locations": ["Remote"],
+    },
+    {
+        "id": "no-startups",
+        "current_title": "Data Analyst",
+        "skills": ["SQL", "Tableau"],
+        "excluded_keywords": ["startup"],
+    },
+    {
+        "id": "wants-equity",
+        "current_title": "Data Analyst",
+        "skills": ["SQL", "Tableau", "Excel"],
+        "must_have_keywords": ["equity"],
+    },
+]
+
+JOB = {
+    "title": "Senior Data Analyst",
+    "skills": ["SQL", "Tableau"],
+    "location": "Toronto, ON",
+    "industry": "Finance",
+    "description": "Fast-growing startup. Daily reporting in Excel.",
+}
+
+
+@pytest.fixture
+def index():
+    index = MatchIndex(load=lambda: PROFILES, ttl=0)
+    index.build()
+    return index
+
+
+def test_terms_are_normalised_per_facet():
+    terms = profile_terms({"skills": ["Node.js", " Power  BI "], "current_title": "Head of Data", "location": "Toronto, ON"})
+
+    assert normalize_term("C++,  Excel") == "c++ excel"
+    assert terms["skill"] == {"node.js", "power bi"}
+    assert terms["title"] == {"head", "data"}
+    assert terms["location"] == {"toronto on", "toronto", "on"}
+
+
+def test_skills_and_industries_match_by_canonical_name():
+    index = MatchIndex(load=lambda: [{"id": "u", "skills": ["MS Excel", "k8s"], "industries": ["telco"]}], ttl=0)
+
+    [match] = index.match({"skills": ["Microsoft Excel"], "description": "Telecom team running Kubernetes."})
+    assert match["matched"] == {"skill": ["excel", "kubernetes"], "industry": ["telecommunications"]}
+
+
+def test_best_match_first_with_matched_terms(index):
+    matches = index.match(JOB, k=2)
+
+    assert [m["user_id"] for m in matches] == ["analyst", "engineer"]
+    assert matches[0]["matched"] == {
+        "skill": ["excel", "sql", "tableau"],
+        "title": ["analyst", "data"],
+        "location": ["on", "toronto", "toronto on"],
+        "industry": ["finance"],
+    }
+    assert 0 < matches[1]["score"] < matches[0]["score"] <= 1
+
+
+def test_exclusions_and_must_haves_filter_users(index):
+    assert "no-startups" not in [m["user_id"] for m in index.match(JOB)]
+    assert "wants-equity" not in [m["user_id"] for m in index.match(JOB)]
+
+    with_equity = dict(JOB, description="Established bank. Equity and Excel reporting.")
+    found = [m["user_id"] for m in index.match(with_equity)]
+    assert "no-startups" in found and "wants-equity" in found
+
+
+def test_long_keywords_are_searched_in_the_whole_text():
+    profiles = [
+        {"id": "no-agencies", "skills": ["SQL"], "excluded_keywords": ["on behalf of our client"]},
+        {"id": "wants-hybrid", "skills": ["SQL"], "must_have_keywords": ["two days a week in office"]},
+    ]
+    index = MatchIndex(load=lambda: profiles, ttl=0)
+    job = {"skills": ["SQL"], "description": "Hiring on behalf of our client. Two days a week in office."}
+
+    assert [m["user_id"] for m in index.match(job)] == ["wants-hybrid"]
+    assert [m["user_id"] for m in index.match({"skills": ["SQL"], "description": "Two days a week from home."})] == ["no-agencies"]
+
+    index.on_profile_change("no-agencies", [ProfileChange("set", "excluded_keywords", [])])
+    assert [m["user_id"] for m in index.match(job)] == ["no-agencies", "wants-hybrid"]
+
+
+def test_profile_changes_update_the_index_incrementally(index):
+    index.on_profile_change("engineer", [ProfileChange("add", "skills", "Tableau"), ProfileChange("set", "location", "Toronto")])
+    index.on_profile_change("engineer", [ProfileChange("remove", "skills", "Docker")])
+    index.add("newcomer", {"id": "newcomer", "tools": ["Tableau"]})
+
+    matches = {m["user_id"]: m for m in index.match(JOB)}
+    assert matches["engineer"]["matched"]["skill"] == ["sql", "tableau"]
+    assert "toronto" in matches["engineer"]["matched"]["location"]
+    assert "newcomer" in matches
+
+    index.merge("analyst", {"skills": [], "industries": []})
+    assert "analyst" not in {m["user_id"] for m in index.match({"skills": ["Excel"], "industry": "Finance"})}
+
+
+def test_changes_to_unindexed_users_wait_for_the_rebuild():
+    profiles = list(PROFILES)
+    index = MatchIndex(load=lambda: profiles, ttl=0)
+    index.build()
+    # Created after the build; a chat turn then adds a skill.
+    profiles.append({"id": "late", "skills": ["SQL", "Tableau"], "excluded_keywords": ["startup"]})
+    index.on_profile_change("late", [ProfileChange("add", "skills", "Tableau")])
+    assert "late" not in [m["user_id"] for m in index.match(JOB)]
+
+    index.build()
+    assert "late" not in [m["user_id"] for m in index.match(JOB)]
+    assert "late" in [m["user_id"] for m in index.match(dict(JOB, description="Established bank."))]
+
+
+def test_removed_rows_are_reused(index):
+    index.remove("engineer")
+    index.add("replacement", {"skills": ["Docker"]})
+
+    assert [m["user_id"] for m in index.match({"skills": ["Docker"]})] == ["replacement"]
+    assert len(index) == 4
+
+
+def test_changes_during_a_rebuild_are_kept():
+    index = MatchIndex(ttl=0)
+
+    def load():
+        # A write lands while the rebuild is still reading profiles.
+        index.on_profile_change("engineer", [ProfileChange("add", "skills", "Kubernetes")])
+        return PROFILES
+
+    index._load = load
+    index.build()
+
+    assert [m["user_id"] for m in index.match({"skills": ["Kubernetes"]})] == ["engineer"]
+
+
+def test_first_build_does_not_block_profile_writes():
+    loading, release = threading.Event(), threading.Event()
+
+    def load():
+        loading.set()
+        release.wait(5)
+        return PROFILES
+
+    index = MatchIndex(load=load, ttl=0)
+    matcher = threading.Thread(target=index.match, args=(JOB,))
+    matcher.start()
+    assert loading.wait(5)
+
+    writer = threading.Thread(target=index.on_profile_change, args=("engineer", [ProfileChange("add", "skills", "Kubernetes")]))
+    writer.start()
+    writer.join(1)
+    blocked = writer.is_alive()
+    release.set()
+    matcher.join(5)
+    writer.join(5)
+
+    assert not blocked
+    assert [m["user_id"] for m in index.match({"skills": ["Kubernetes"]})] == ["engineer"]
+
+
+def test_stale_index_rebuilds_in_the_background():
+    clock = [0.0]
+    profiles = list(PROFILES)
+    index = MatchIndex(load=lambda: profiles, ttl=60, clock=lambda: clock[0])
+    index.match(JOB)
+    profiles.append({"id": "late", "skills": ["Rust"]})
+
+    clock[0] = 61.0
+    index.match(JOB)  # served from the old index, triggers the rebuild
+    building = index._building
+    if building is not None:
+        building.join(1)
+
+    assert [m["user_id"] for m in index.match({"skills": ["Rust"]})] == ["late"]
+
+
+def test_loads_profiles_page_by_page():
+    container = FakeContainer()
+    for profile in PROFILES:
+        container.create_item(dict(profile))
+
+    assert [p["id"] for p in load_profiles(container, page_size=3)] == [p["id"] for p in PROFILES]
+
+
+def test_match_endpoint(index, monkeypatch):
+    import app as app_module
+    from auth import jwt_utils
+    from utils import job_match
+
+    monkeypatch.setenv("TENANT_ID", "tenant")
+    monkeypatch.setenv("AUTH_CLIENT_ID", "client")
+    monkeypatch.setattr(jwt_utils, "_validate_token", lambda token, tenant_id, client_id: {"sub": "recruiter"})
+    monkeypatch.setattr(job_match, "_default_index", index)
+    client = app_module.app.test_client()
+    headers = {"Authorization": "Bearer t"}
+
+    response = client.post("/match", json=dict(JOB, k=1), headers=headers)
+    assert response.status_code == 200
+    assert [m["user_id"] for m in response.get_json()["matches"]] == ["analyst"]
+    assert client.post("/match", json={"location": "Toronto"}, headers=headers).status_code == 400
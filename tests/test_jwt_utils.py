@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from auth import jwt_utils
+
+TENANT_ID = "test-tenant"
+CLIENT_ID = "test-client"
+ISSUER = f"https://login.microsoftonline.com/{TENANT_ID}/v2.0"
+
+
+def _make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    public = jwk.construct(pem, algorithm="RS256").public_key().to_dict()
+    public.update({"kid": kid, "use": "sig"})
+    return pem, public
+
+
+class _JWKSServer:
+    """Local stand-in for the Entra OpenID configuration and JWKS endpoints."""
+
+    def __init__(self):
+        self.keys = []
+        self.hits = {"openid": 0, "jwks": 0}
+        self.delay = 0.0
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(outer.delay)
+                if self.path == "/openid":
+                    outer.hits["openid"] += 1
+                    body = {"jwks_uri": f"{outer.url}/jwks"}
+                elif self.path == "/jwks":
+                    outer.hits["jwks"] += 1
+                    body = {"keys": list(outer.keys)}
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def jwks_server(monkeypatch):
+    server = _JWKSServer()
+    monkeypatch.delenv("JWKS_URI", raising=False)
+    monkeypatch.setattr(jwt_utils, "_get_openid_configuration_url", lambda tenant_id: f"{server.url}/openid")
+    jwt_utils._jwks_cache.clear()
+    jwt_utils._token_cache.clear()
+    yield server
+    server.close()
+    jwt_utils._jwks_cache.clear()
+    jwt_utils._token_cache.clear()
+
+
+def _token(pem, kid, **claims):
+    now = int(time.time())
+    payload = {"aud": CLIENT_ID, "iss": ISSUER, "iat": now, "exp": now + 600, "sub": "user"}
+    payload.update(claims)
+    return jwt.encode(payload, pem, algorithm="RS256", headers={"kid": kid})
+
+
+def test_keys_fetched_once_across_tokens(jwks_server):
+    pem, public = _make_key("k1")
+    jwks_server.keys = [public]
+
+    for sub in ("a", "b", "c"):
+        payload = jwt_utils._validate_token(_token(pem, "k1", sub=sub), TENANT_ID, CLIENT_ID)
+        assert payload["sub"] == sub
+
+    assert jwks_server.hits == {"openid": 1, "jwks": 1}
+
+
+def test_verified_token_served_from_cache(jwks_server, monkeypatch):
+    pem, public = _make_key("k1")
+    jwks_server.keys = [public]
+    token = _token(pem, "k1")
+
+    assert jwt_utils._validate_token(token, TENANT_ID, CLIENT_ID) is not None
+
+    def fail(*args, **kwargs):
+        raise AssertionError("token should not be decoded again")
+
+    monkeypatch.setattr(jwt_utils.jwt, "decode", fail)
+    assert jwt_utils._validate_token(token, TENANT_ID, CLIENT_ID)["sub"] == "user"
+    # A different audience is a different cache entry.
+    assert jwt_utils._validate_token(token, TENANT_ID, "other-client") is None
+
+
+def test_expired_token_is_not_served_from_cache(jwks_server):
+    pem, public = _make_key("k1")
+    jwks_server.keys = [public]
+    token = _token(pem, "k1", exp=int(time.time()) + 600)
+    payload = jwt_utils._validate_token(token, TENANT_ID, CLIENT_ID)
+
+    jwt_utils._token_cache.put(token, TENANT_ID, CLIENT_ID, dict(payload, exp=time.time() - 1))
+    assert jwt_utils._token_cache.get(token, TENANT_ID, CLIENT_ID) is None
+
+
+def test_unknown_kid_triggers_refresh(jwks_server):
+    pem1, public1 = _make_key("k1")
+    pem2, public2 = _make_key("k2")
+    jwks_server.keys = [public1]
+    assert jwt_utils._validate_token(_token(pem1, "k1"), TENANT_ID, CLIENT_ID) is not None
+
+    # Key rotation: the provider starts publishing k2.
+    jwks_server.keys = [public1, public2]
+    jwt_utils._jwks_cache.min_refresh_interval = 0
+    try:
+        assert jwt_utils._validate_token(_token(pem2, "k2"), TENANT_ID, CLIENT_ID) is not None
+    finally:
+        jwt_utils._jwks_cache.min_refresh_interval = jwt_utils.JWKS_MIN_REFRESH_INTERVAL
+    assert jwks_server.hits["jwks"] == 2
+
+
+def test_unknown_kid_refresh_is_rate_limited(jwks_server):
+    pem, public = _make_key("k1")
+    jwks_server.keys = [public]
+    assert jwt_utils._validate_token(_token(pem, "k1"), TENANT_ID, CLIENT_ID) is not None
+
+    for _ in range(5):
+        assert jwt_utils._validate_token(_token(pem, "forged"), TENANT_ID, CLIENT_ID) is None
+    assert jwks_server.hits["jwks"] == 1
+
+
+def test_concurrent_cold_requests_fetch_once(jwks_server):
+    pem, public = _make_key("k1")
+    jwks_server.keys = [public]
+    jwks_server.delay = 0.05
+    tokens = [_token(pem, "k1", sub=str(i)) for i in range(16)]
+    results = [None] * len(tokens)
+
+    def validate(i):
+        results[i] = jwt_utils._validate_token(tokens[i], TENANT_ID, CLIENT_ID)
+
+    threads = [threading.Thread(target=validate, args=(i,)) for i in range(len(tokens))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(results)
+    assert jwks_server.hits["jwks"] == 1
+
+
+def test_stale_keys_served_when_refresh_fails(jwks_server):
+    pem, public = _make_key("k1")
+    jwks_server.keys = [public]
+    assert jwt_utils._validate_token(_token(pem, "k1", sub="a"), TENANT_ID, CLIENT_ID) is not None
+
+    jwt_utils._jwks_cache._expires_at = 0.0
+    jwks_server.close()
+    assert jwt_utils._validate_token(_token(pem, "k1", sub="b"), TENANT_ID, CLIENT_ID) is not None
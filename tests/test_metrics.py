@@ -0,0 +1,134 @@
+import json
+import os
+import subprocess
+import sys
+import uuid
+
+import pytest
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.messages import AIMessage
+
+import agent
+import app as app_module
+import cosmos_profile
+from fakes import FakeContainer
+from tools import update_profile
+from utils import metrics
+from utils.metrics import Counter, Histogram, Registry, span
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = Histogram("demo_seconds", "Demo latency.", ["stage"], buckets=(0.1, 1.0), registry=registry)
+    calls = Counter("demo_total", "Demo calls.", ["stage"], registry=registry)
+    for value in (0.05, 0.5, 2.0):
+        latency.observe(value, stage="llm")
+    calls.inc(stage='a "quoted" stage')
+
+    text = registry.render()
+
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_seconds_bucket{stage="llm",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="llm",le="1"} 2' in text
+    assert 'demo_seconds_bucket{stage="llm",le="+Inf"} 3' in text
+    assert 'demo_seconds_sum{stage="llm"} 2.55' in text
+    assert 'demo_seconds_count{stage="llm"} 3' in text
+    assert 'demo_total{stage="a \\"quoted\\" stage"} 1' in text
+
+
+def test_span_times_and_counts_errors():
+    stage = f"test-{uuid.uuid4()}"
+    with span(stage):
+        pass
+    with pytest.raises(ValueError):
+        with span(stage):
+            raise ValueError("boom")
+
+    assert metrics.STAGE_SECONDS.count(stage=stage) == 2
+    assert metrics.STAGE_ERRORS.value(stage=stage) == 1
+
+
+def test_profile_turn_records_cosmos_charge_and_retries(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "u1", "skills": []})
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    reads = metrics.STAGE_SECONDS.count(stage="tool_read")
+    writes = metrics.STAGE_SECONDS.count(stage="tool_write")
+    patches = metrics.COSMOS_REQUEST_UNITS.count(operation="patch_item")
+    retries = metrics.COSMOS_RETRIES.value(operation="patch_item", reason="precondition_failed")
+
+    with update_profile.profile_turn("u1"):
+        update_profile.add_to_list_field("u1", field_name="skills", item="SQL")
+        # Another writer gets in first; the patch is retried.
+        container.patch_item("u1", "u1", [{"op": "set", "path": "/name", "value": "Zil"}])
+
+    assert metrics.STAGE_SECONDS.count(stage="tool_read") == reads + 1
+    assert metrics.STAGE_SECONDS.count(stage="tool_write") == writes + 1
+    assert metrics.COSMOS_REQUEST_UNITS.count(operation="patch_item") > patches
+    assert metrics.COSMOS_RETRIES.value(operation="patch_item", reason="precondition_failed") == retries + 1
+    assert metrics.COSMOS_ERRORS.value(operation="patch_item", status=412) >= 1
+
+
+def test_usage_handler_counts_tokens():
+    prompt = metrics.LLM_TOKENS.value(kind="prompt")
+    completion = metrics.LLM_TOKENS.value(kind="completion")
+    run_id = uuid.uuid4()
+    result = LLMResult(
+        generations=[[ChatGeneration(message=AIMessage(content="hi"))]],
+        llm_output={"token_usage": {"prompt_tokens": 120, "completion_tokens": 7}},
+    )
+
+    agent._usage_handler.on_llm_start({}, ["hi"], run_id=run_id)
+    agent._usage_handler.on_llm_end(result, run_id=run_id)
+
+    assert metrics.LLM_TOKENS.value(kind="prompt") == prompt + 120
+    assert metrics.LLM_TOKENS.value(kind="completion") == completion + 7
+
+
+def test_metrics_route_exposes_request_latency():
+    client = app_module.app.test_client()
+    client.get("/")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert 'zil_http_request_duration_seconds_count{method="GET",route="/",status="200"}' in body
+    assert "zil_log_messages_total" in body or "zil_stage_duration_seconds" in body
+
+
+def test_multiprocess_snapshots_are_summed(tmp_path):
+    worker = Registry(str(tmp_path))
+    calls = Counter("demo_total", "Demo calls.", ["route"], registry=worker)
+    latency = Histogram("demo_seconds", "Demo latency.", buckets=(1.0,), registry=worker)
+    calls.inc(2, route="/chat")
+    latency.observe(0.5)
+    # Another (live) worker's last published snapshot.
+    (tmp_path / f"metrics-{os.getppid()}.json").write_text(json.dumps(worker.snapshot()))
+    calls.inc(route="/chat")
+
+    text = worker.render()
+
+    assert 'demo_total{route="/chat"} 5' in text
+    assert 'demo_seconds_bucket{le="1"} 2' in text
+    assert "demo_seconds_count 2" in text
+
+
+def test_gauges_come_from_live_workers_only(tmp_path):
+    worker = Registry(str(tmp_path))
+    worker.add_collector(lambda: [("demo_in_flight", "gauge", "Per worker.", {}, 2.0)])
+    worker.add_collector(lambda: [("demo_spool_depth", "gauge", "Shared.", {}, 7.0)], shared=["demo_spool_depth"])
+    (tmp_path / f"metrics-{os.getppid()}.json").write_text(json.dumps(worker.snapshot()))
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    stale = tmp_path / f"metrics-{exited.pid}.json"
+    stale.write_text(json.dumps(worker.snapshot()))
+
+    text = worker.render()
+
+    assert "demo_in_flight 4" in text
+    assert "demo_spool_depth 7" in text
+    assert not stale.exists()
+    worker.remove_snapshot(os.getppid())
+    assert "demo_in_flight 2" in worker.render()
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from fakes import FakeContainer
+from utils import pending_questions
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = FakeContainer()
+    monkeypatch.setattr(pending_questions, "_container", lambda: container)
+    return container
+
+
+def test_head_is_one_small_point_read(container):
+    pending_questions.add("u1", "Where are you based?")
+    container.calls.clear()
+
+    assert pending_questions.head("u1") == ["Where are you based?"]
+    assert container.counts() == {"read_item": 1}
+
+
+def test_head_of_missing_queue_is_empty(container):
+    assert pending_questions.head("nobody") == []
+
+
+def test_near_duplicates_are_not_queued_twice(container):
+    assert pending_questions.add("u1", "Where are you based?")
+    assert not pending_questions.add("u1", "  where are you BASED ")
+    assert pending_questions.head("u1") == ["Where are you based?"]
+
+
+def test_higher_priority_is_asked_first(container):
+    pending_questions.add("u1", "What is your highest degree?")
+    pending_questions.add("u1", "Where are you based?", priority=5)
+    pending_questions.add("u1", "Which tools do you use?")
+    pending_questions.add("u1", "What is your highest degree", priority=9)
+
+    assert pending_questions.head("u1", n=3) == [
+        "What is your highest degree?",
+        "Where are you based?",
+        "Which tools do you use?",
+    ]
+
+
+def test_expired_questions_are_skipped_and_pruned(container):
+    pending_questions.add("u1", "Old question?", ttl=-1)
+    pending_questions.add("u1", "Fresh question?")
+
+    assert pending_questions.head("u1") == ["Fresh question?"]
+    assert [q["text"] for q in container.items["u1"]["questions"]] == ["Fresh question?"]
+
+
+def test_queue_is_bounded(container, monkeypatch):
+    monkeypatch.setattr(pending_questions, "MAX_PENDING_QUESTIONS", 3)
+    for i in range(10):
+        pending_questions.add("u1", f"Question {i}?", priority=i % 2)
+
+    assert len(container.items["u1"]["questions"]) == 3
+    assert pending_questions.head("u1") == ["Question 1?", "Question 3?", "Question 5?"]
+
+
+def test_remove_matches_normalised_text(container):
+    pending_questions.add("u1", "When did your internship take place?")
+
+    assert pending_questions.remove("u1", "when did your internship take place") == "When did your internship take place?"
+    assert pending_questions.remove("u1", "When did your internship take place?") is None
+    assert pending_questions.head("u1") == []
+
+
+def test_concurrent_pops_remove_each_question_once(container):
+    for i in range(8):
+        pending_questions.add("u1", f"Question {i}?")
+    removed = []
+
+    def pop(i):
+        removed.append(pending_questions.remove("u1", f"Question {i}?"))
+
+    threads = [threading.Thread(target=pop, args=(i % 2,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(r for r in removed if r) == ["Question 0?", "Question 1?"]
+    assert pending_questions.head("u1", n=10) == [f"Question {i}?" for i in range(2, 8)]
+
+
+def test_profile_reset_clears_the_queue(container, monkeypatch):
+    import app as app_module
+
+    pending_questions.add("u1", "Where are you based?")
+    monkeypatch.setattr(app_module, "upsert_user_profile", lambda user_id, profile: None)
+    response = app_module.app.test_client().post("/reset-profile?user_id=u1")
+
+    assert response.status_code == 200
+    assert pending_questions.head("u1") == []
+    assert not pending_questions.clear("u1")
+
+
+def test_questions_left_in_profiles_are_migrated(container):
+    profiles = FakeContainer()
+    profiles.create_item({"id": "u1", "skills": [], "pending_questions": ["Where are you based?", "Which tools do you use?"]})
+    profiles.create_item({"id": "u2", "skills": [], "pending_questions": []})
+    profiles.create_item({"id": "u3", "skills": []})
+
+    report = pending_questions.migrate_profiles(profiles, page_size=2)
+
+    assert report == {"scanned": 3, "migrated": 2, "questions": 2, "failed": 0}
+    assert pending_questions.head("u1") == ["Where are you based?", "Which tools do you use?"]
+    assert all("pending_questions" not in doc for doc in profiles.items.values())
+    assert pending_questions.migrate_profiles(profiles)["migrated"] == 0
@@ -1,9 +1,9 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 from agent import run_agent
 
-@patch("agent.update_profile.add_to_list_field")
-@patch("agent.update_profile.remove_from_list_field")
+@patch("agent.update_profile.add_pending_question")
+@patch("agent.update_profile.remove_pending_question")
 @patch("agent.update_profile.set_string_field")
 def test_add_and_remove_pending_question(mock_set_string, mock_remove, mock_add):
     user_id = "testuser@example.com"
@@ -15,7 +15,7 @@ def test_add_and_remove_pending_question(mock_set_string, mock_remove, mock_add)
     response1 = run_agent(prompt1, user_id)
 
     # Expect it to have queued the follow-up question
-    mock_add.assert_called_with(user_id, field_name="pending_questions", item=pytest.any(str)) # type: ignore
+    mock_add.assert_called_with(user_id, question=ANY, priority=ANY)
     assert "ask" in response1.lower() or "later" in response1.lower()
 
     # Simulate that the agent asked: "When did your internship take place?"
@@ -32,5 +32,5 @@ def test_add_and_remove_pending_question(mock_set_string, mock_remove, mock_add)
     assert mock_set_string.called
 
     # Expect it to remove the question
-    mock_remove.assert_any_call(user_id, field_name="pending_questions", item=pending_question)
+    mock_remove.assert_any_call(user_id, question=pending_question)
     assert "thank" in response2.lower() or "updated" in response2.lower()
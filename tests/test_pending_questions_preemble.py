@@ -2,19 +2,17 @@ import pytest
 from unittest.mock import patch
 from agent import run_agent
 
-@patch("agent.get_user_profile")
+@patch("agent.pending_questions.head")
 @patch("agent.update_profile.set_string_field")
-@patch("agent.update_profile.remove_from_list_field")
-def test_pending_questions_preamble(mock_remove, mock_set, mock_get_profile):
+@patch("agent.update_profile.remove_pending_question")
+def test_pending_questions_preamble(mock_remove, mock_set, mock_head):
     user_id = "testuser@example.com"
 
-    # Simulate profile with pending questions
-    mock_get_profile.return_value = {
-        "pending_questions": [
-            "What is your current location?",
-            "What is your highest degree?"
-        ]
-    }
+    # Simulate a queue of pending questions
+    mock_head.return_value = [
+        "What is your current location?",
+        "What is your highest degree?"
+    ]
 
     # Let agent update string fields and remove questions
     mock_set.return_value = "OK"
@@ -0,0 +1,159 @@
+import json
+import threading
+
+import pytest
+from azure.cosmos import exceptions
+
+from fakes import FakeContainer
+from tools import update_profile
+from utils.profile_bulk import export_profiles, import_profiles, read_checkpoint
+from utils.profile_schema import ProfileValidationError, validate_profile
+
+
+def _lines(*records):
+    return [json.dumps(record) + "\n" for record in records]
+
+
+def test_validate_fills_defaults_and_drops_system_properties():
+    doc = validate_profile({"user_id": "u1", "skills": ["SQL"], "_etag": '"3"', "_ts": 1})
+
+    assert doc["id"] == doc["user_id"] == "u1"
+    assert doc["skills"] == ["SQL"]
+    assert doc["headline"] == ""
+    assert "_etag" not in doc
+
+
+@pytest.mark.parametrize("record, message", [
+    ({"name": "No id"}, "missing user_id"),
+    ({"user_id": "u1", "skills": "SQL"}, "skills must be list"),
+    ({"user_id": "u1", "skills": [1]}, "list of strings"),
+    ({"user_id": "u1", "favourite_colour": {"hex": "#00f"}}, "favourite_colour must be str or list"),
+    ({"user_id": "u1", "hobbies": ["chess", 3]}, "list of strings"),
+    ({"user_id": "u1", "id": "u2"}, "differ"),
+])
+def test_validate_rejects_bad_records(record, message):
+    with pytest.raises(ProfileValidationError, match=message):
+        validate_profile(record)
+
+
+def test_exported_profiles_with_tool_added_fields_import_unchanged():
+    source = FakeContainer()
+    source.create_item({"id": "u1", "user_id": "u1", "skills": ["Excel", "SQL"], "hobbies": ["chess"], "pronouns": "they/them"})
+    target = FakeContainer()
+
+    report = import_profiles(export_profiles(container=source), container=target)
+
+    assert report.created == 1
+    assert {k: v for k, v in target.items["u1"].items() if k in ("skills", "hobbies", "pronouns")} == {
+        "skills": ["Excel", "SQL"], "hobbies": ["chess"], "pronouns": "they/them",
+    }
+
+
+def test_import_canonicalizes_and_notifies_change_listeners():
+    seen = []
+    listener = lambda user_id, changes: seen.append((user_id, {c.field: c.value for c in changes}))
+    update_profile.add_change_listener(listener)
+    try:
+        container = FakeContainer()
+        container.create_item({"id": "u1", "user_id": "u1"})
+        import_profiles(_lines({"user_id": "u1"}, {"user_id": "u2", "skills": ["ms excel", "Excel", "python3"]}), container=container)
+    finally:
+        update_profile.remove_change_listener(listener)
+
+    assert container.items["u2"]["skills"] == ["Excel", "Python"]
+    assert [user_id for user_id, _ in seen] == ["u2"]  # u1 existed and was skipped
+    assert seen[0][1]["skills"] == ["Excel", "Python"]
+
+
+def test_import_creates_new_users_and_skips_existing():
+    container = FakeContainer()
+    container.create_item({"id": "u1", "user_id": "u1", "name": "Kept"})
+    lines = _lines({"user_id": "u1", "name": "Replaced?"}, {"user_id": "u2", "name": "New"}) + ["\n", "not json\n"]
+
+    report = import_profiles(lines, container=container, concurrency=4).as_dict()
+
+    assert (report["created"], report["skipped"], report["invalid"], report["failed"]) == (1, 1, 1, 0)
+    assert report["position"] == 4
+    assert report["errors"][0]["line"] == 4
+    assert container.items["u1"]["name"] == "Kept"
+    assert container.items["u2"]["skills"] == []
+
+
+def test_upsert_mode_replaces_documents():
+    container = FakeContainer()
+    container.create_item({"id": "u1", "user_id": "u1", "name": "Old"})
+    report = import_profiles(_lines({"user_id": "u1", "name": "New"}), container=container, mode="upsert")
+
+    assert report.upserted == 1
+    assert container.items["u1"]["name"] == "New"
+
+
+def test_failed_write_stops_the_checkpoint_and_a_rerun_resumes(tmp_path):
+    checkpoint = str(tmp_path / "import.ckpt")
+    lines = _lines(*({"user_id": f"u{i}"} for i in range(1, 7)))
+
+    class Flaky(FakeContainer):
+        def create_item(self, body, **kwargs):
+            if body["id"] == "u4":
+                raise exceptions.CosmosHttpResponseError(status_code=503, message="Service unavailable")
+            return super().create_item(body, **kwargs)
+
+    flaky = Flaky()
+    report = import_profiles(lines, container=flaky, concurrency=1, checkpoint=checkpoint, checkpoint_every=1)
+    assert report.failed == 1
+    assert read_checkpoint(checkpoint) == 3
+
+    container = FakeContainer()
+    container.items.update(flaky.items)
+    report = import_profiles(lines, container=container, checkpoint=checkpoint)
+    assert (report.created, report.skipped) == (1, 2)
+    assert read_checkpoint(checkpoint) == 6
+    assert sorted(container.items) == [f"u{i}" for i in range(1, 7)]
+
+
+def test_reader_is_held_back_by_outstanding_writes():
+    release = threading.Event()
+    consumed = []
+
+    class Slow(FakeContainer):
+        def create_item(self, body, **kwargs):
+            release.wait(1)
+            return super().create_item(body, **kwargs)
+
+    def lines():
+        for i in range(50):
+            consumed.append(i)
+            yield json.dumps({"user_id": f"u{i}"})
+
+    peak = []
+    watcher = threading.Timer(0.2, lambda: (peak.append(len(consumed)), release.set()))
+    watcher.start()
+    report = import_profiles(lines(), container=Slow(), concurrency=2)
+
+    # 2 * concurrency writes outstanding, plus the line waiting for a slot.
+    assert peak[0] <= 5
+    assert report.created == 50
+
+
+def test_export_round_trips_through_import():
+    source = FakeContainer()
+    import_profiles(_lines(*({"user_id": f"u{i}", "skills": ["SQL"]} for i in range(25))), container=source)
+    tokens = []
+
+    lines = list(export_profiles(source, page_size=10, on_page=tokens.append))
+
+    assert len(lines) == 25
+    assert tokens == ["10", "20", None]
+    assert "_etag" not in json.loads(lines[0])
+    target = FakeContainer()
+    assert import_profiles(lines, container=target).created == 25
+    assert target.items["u7"]["skills"] == ["SQL"]
+
+
+def test_export_resumes_from_a_continuation_token():
+    source = FakeContainer()
+    import_profiles(_lines(*({"user_id": f"u{i:02d}"} for i in range(25))), container=source)
+
+    rest = list(export_profiles(source, page_size=10, continuation="20"))
+
+    assert [json.loads(line)["id"] for line in rest] == [f"u{i:02d}" for i in range(20, 25)]
@@ -0,0 +1,111 @@
+import json
+import re
+
+import numpy as np
+import pytest
+
+import agent
+from utils.profile_index import ProfileParagraphIndex, UserParagraphIndex
+
+VOCAB = ["audit", "tax", "python", "dashboard", "tableau", "budget", "migration", "cloud"]
+
+
+class BagOfWords:
+    """Deterministic embedder: one dimension per vocabulary word."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def __call__(self, texts):
+        self.embedded.extend(texts)
+        vectors = []
+        for text in texts:
+            words = re.findall(r"[a-z]+", text.lower())
+            vectors.append(np.array([words.count(w) for w in VOCAB] + [0.1], dtype=np.float32))
+        return vectors
+
+
+PROFILE = {
+    "id": "u1",
+    "current_title": "Senior Analyst",
+    "skills": ["SQL"],
+    "experience_paragraphs": [
+        "Led the audit of tax filings for 40 clients.",
+        "Built Tableau dashboard reporting for finance.",
+        "Owned the quarterly budget process.",
+    ],
+    "project_paragraphs": [
+        "Python automation for tax reconciliation.",
+        "Cloud migration of the reporting stack.",
+    ],
+}
+
+
+@pytest.fixture
+def embedder():
+    return BagOfWords()
+
+
+def test_search_ranks_by_cosine_similarity():
+    index = UserParagraphIndex()
+    index.add([("f", "a"), ("f", "b"), ("f", "c")], [np.array([1.0, 0.0]), np.array([0.0, 1.0]), np.array([1.0, 1.0])])
+    assert [text for _, text, _ in index.search(np.array([2.0, 0.1]), 2)] == ["a", "c"]
+    index.remove([("f", "a")])
+    assert [text for _, text, _ in index.search(np.array([2.0, 0.1]), 5)] == ["c", "b"]
+
+
+def test_relevant_paragraphs_returns_top_k(embedder):
+    index = ProfileParagraphIndex(embedder)
+    result = index.relevant_paragraphs("u1", PROFILE, "Add my tax audit work", k=2)
+    assert result == {
+        "experience_paragraphs": ["Led the audit of tax filings for 40 clients."],
+        "project_paragraphs": ["Python automation for tax reconciliation."],
+    }
+
+
+def test_small_profiles_skip_embedding(embedder):
+    index = ProfileParagraphIndex(embedder)
+    profile = {"experience_paragraphs": ["One job."], "project_paragraphs": []}
+    assert index.relevant_paragraphs("u1", profile, "anything", k=4) == {"experience_paragraphs": ["One job."]}
+    assert embedder.embedded == []
+
+
+def test_sync_embeds_only_new_paragraphs(embedder):
+    index = ProfileParagraphIndex(embedder)
+    index.sync("u1", PROFILE)
+    embedder.embedded.clear()
+
+    updated = dict(PROFILE, project_paragraphs=["Python automation for tax reconciliation.", "New cloud project."])
+    user_index = index.sync("u1", updated)
+
+    assert embedder.embedded == ["New cloud project."]
+    assert ("project_paragraphs", "Cloud migration of the reporting stack.") not in user_index.keys()
+    assert len(user_index) == 5
+
+
+def test_agent_context_keeps_fields_and_only_relevant_paragraphs(embedder, monkeypatch):
+    monkeypatch.setattr(agent, "get_profile_index", lambda: ProfileParagraphIndex(embedder))
+    monkeypatch.setattr(agent, "PROFILE_CONTEXT_TOP_K", 2)
+
+    context = json.loads(agent._profile_context("u1", PROFILE, "cloud migration"))
+
+    assert context["current_title"] == "Senior Analyst"
+    assert context["skills"] == ["SQL"]
+    assert "id" not in context
+    assert context["project_paragraphs"][0] == "Cloud migration of the reporting stack."
+    paragraphs = context.get("experience_paragraphs", []) + context["project_paragraphs"]
+    assert len(paragraphs) == 2
+
+
+def test_agent_context_falls_back_when_embeddings_fail(monkeypatch):
+    class Broken:
+        def relevant_paragraphs(self, *args, **kwargs):
+            raise RuntimeError("embedding quota")
+
+    monkeypatch.setattr(agent, "get_profile_index", lambda: Broken())
+    monkeypatch.setattr(agent, "PROFILE_CONTEXT_TOP_K", 1)
+
+    context = json.loads(agent._profile_context("u1", PROFILE, "anything"))
+
+    assert context["experience_paragraphs"] == ["Owned the quarterly budget process."]
+    assert context["project_paragraphs"] == ["Cloud migration of the reporting stack."]
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from utils import prompt_context
+from utils.profile_schema import new_profile, preference_profile
+from utils.prompt_context import ProfileContextRenderer, compact_fields, count_tokens, render_fields
+
+
+@pytest.fixture(autouse=True)
+def length_tokenizer(monkeypatch):
+    # Deterministic token counts (chars / 4) regardless of tiktoken's cache.
+    monkeypatch.setattr(prompt_context, "_encoding", None)
+    monkeypatch.setattr(prompt_context, "_encoding_loaded", True)
+
+
+def _profile(**fields):
+    profile = new_profile("u1", "Zil")
+    profile.update(preference_profile("u1"))
+    profile.update(fields)
+    return profile
+
+
+def test_empty_and_default_fields_are_dropped():
+    profile = _profile(current_title="Analyst", skills=["SQL"], soft_preferences={"company_size": "", "work_life_balance": None})
+    profile["id"] = "u1"
+    profile["_etag"] = '"1"'
+
+    assert compact_fields(profile) == [("name", "Zil"), ("current_title", "Analyst"), ("skills", ["SQL"])]
+
+
+def test_rendering_is_compact_and_stable():
+    a = _profile(skills=["SQL"], location="Remote", current_title="Analyst", id="u1", _etag='"1"')
+    b = dict(reversed(list(a.items())))
+    text = render_fields(compact_fields(a), 1000)
+    assert text == render_fields(compact_fields(b), 1000)
+    assert text == '{"name":"Zil","current_title":"Analyst","location":"Remote","skills":["SQL"]}'
+    assert len(text) < len(json.dumps(a, indent=2)) / 10
+
+
+def test_budget_trims_lowest_priority_first():
+    profile = _profile(
+        current_title="Analyst",
+        skills=["SQL", "Excel"],
+        experience_paragraphs=[f"Paragraph {i} " + "x" * 200 for i in range(10)],
+    )
+    text = render_fields(compact_fields(profile), 120)
+    rendered = json.loads(text)
+
+    assert count_tokens(text) <= 120
+    assert rendered["current_title"] == "Analyst"
+    assert rendered["skills"] == ["SQL", "Excel"]
+    assert 0 < len(rendered["experience_paragraphs"]) < 10
+
+
+def test_long_strings_are_truncated():
+    text = render_fields([("summary", "word " * 500)], 50)
+    assert count_tokens(text) <= 50
+    assert json.loads(text)["summary"].endswith("…")
+
+
+def test_renders_are_memoised_per_profile_version():
+    renderer = ProfileContextRenderer(budget=500)
+    profile = _profile(skills=["SQL"], _etag='"1"', id="u1")
+
+    first = renderer.render(profile, {"experience_paragraphs": []})
+    assert renderer.render(profile, {"experience_paragraphs": []}) == first
+    assert (renderer.hits, renderer.misses) == (1, 1)
+
+    renderer.render(dict(profile, skills=["SQL", "Go"], _etag='"2"'), {"experience_paragraphs": []})
+    assert renderer.misses == 2
+
+
+def test_profiles_without_version_are_not_memoised():
+    renderer = ProfileContextRenderer(budget=500)
+    renderer.render(_profile(skills=["SQL"]))
+    renderer.render(_profile(skills=["SQL"]))
+    assert (renderer.hits, renderer.misses) == (0, 2)
@@ -0,0 +1,120 @@
+from unittest.mock import patch
+
+import pytest
+from langchain_core.agents import AgentActionMessageLog, AgentFinish
+
+import agent
+import cosmos_profile
+from fakes import FakeContainer
+from utils.response_cache import CachedResponse, ResponseCache, SQLiteResponseStore, normalize_prompt
+
+ENTRY = CachedResponse("Noted.", [{"tool": "AddToListField", "args": {"field_name": "skills", "item": "Excel"}}], 1.5)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_requires_same_prompt_version_and_config():
+    cache = ResponseCache(ttl=60)
+    cache.put("u1", "I use  Excel daily", ['"1"'], "cfg", ENTRY)
+
+    assert cache.get("u1", " I use Excel daily ", '"1"', "cfg") == ENTRY
+    assert cache.get("u1", "I use Excel daily", '"2"', "cfg") is None
+    assert cache.get("u1", "I use Excel daily", '"1"', "other-cfg") is None
+    assert cache.get("u2", "I use Excel daily", '"1"', "cfg") is None
+    assert cache.get("u1", "I use excel daily", '"1"', "cfg") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["saved_seconds"] == 1.5
+
+
+def test_unversioned_profiles_are_not_cached():
+    cache = ResponseCache()
+    cache.put("u1", "hi", [None], "cfg", ENTRY)
+    assert cache.get("u1", "hi", None, "cfg") is None
+    assert len(cache) == 0
+
+
+def test_entries_expire_and_evict_lru():
+    clock = Clock()
+    cache = ResponseCache(ttl=10, maxsize=2, clock=clock)
+    cache.put("u1", "a", ["v"], "cfg", ENTRY)
+    cache.put("u1", "b", ["v"], "cfg", ENTRY)
+    cache.get("u1", "a", "v", "cfg")
+    cache.put("u1", "c", ["v"], "cfg", ENTRY)
+
+    assert cache.get("u1", "b", "v", "cfg") is None
+    assert cache.get("u1", "a", "v", "cfg") == ENTRY
+    clock.now = 11
+    assert cache.get("u1", "a", "v", "cfg") is None
+
+
+def test_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(store_path=path).put("u1", "hi", ["v"], "cfg", ENTRY)
+
+    other = ResponseCache(store_path=path)
+    assert other.get("u1", "hi", "v", "cfg") == ENTRY
+    assert other.stats()["store_hits"] == 1
+
+
+def test_store_purges_expired_rows_and_caps_its_size(tmp_path):
+    store = SQLiteResponseStore(str(tmp_path / "responses.sqlite"), max_rows=3, purge_every=5)
+    store.put("expired", ENTRY, 1.0)
+    for i in range(3):
+        store.put(f"k{i}", ENTRY, 2e10 + i)
+    assert store._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 4
+
+    store.put("k3", ENTRY, 2e10 + 3)  # fifth put purges
+
+    keys = [row[0] for row in store._connect().execute("SELECT key FROM responses ORDER BY key")]
+    assert keys == ["k1", "k2", "k3"]
+
+
+def test_normalize_prompt_collapses_whitespace_only():
+    assert normalize_prompt("  Add Excel\n\tplease ") == "Add Excel please"
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(agent, "get_response_cache", lambda: cache)
+    container = FakeContainer()
+    container.create_item({"id": "u1", "skills": []})
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    monkeypatch.setattr(agent, "_profile_context", lambda *args: "{}")
+    return cache
+
+
+def _action(tool, args):
+    return AgentActionMessageLog(tool=tool, tool_input=args, log="", message_log=[])
+
+
+@patch("agent.update_profile.add_to_list_field", return_value="Added 'Excel' to skills.")
+def test_repeat_turn_replays_plan_without_model(mock_add, runtime):
+    with patch.object(agent, "get_agent") as get_agent:
+        get_agent.return_value.invoke.side_effect = [
+            _action("AddToListField", {"field_name": "skills", "item": "Excel"}),
+            AgentFinish({"output": "Added Excel."}, ""),
+        ]
+        first = agent.run_agent("I picked up Excel at my last job", "u1")
+        second = agent.run_agent("I picked up Excel at my last job", "u1")
+
+    assert first == second == "Added Excel."
+    assert get_agent.return_value.invoke.call_count == 2
+    assert mock_add.call_count == 2
+    assert runtime.stats()["hits"] == 1
+
+
+def test_changed_profile_misses(runtime):
+    with patch.object(agent, "get_agent") as get_agent:
+        get_agent.return_value.invoke.return_value = AgentFinish({"output": "Hello!"}, "")
+        agent.run_agent("hello", "u1")
+        cosmos_profile.get_container().upsert_item({"id": "u1", "skills": ["Excel"]})  # written by another worker
+        agent.run_agent("hello", "u1")
+
+    assert get_agent.return_value.invoke.call_count == 2
@@ -0,0 +1,146 @@
+import time
+
+import pytest
+from langchain_core.agents import AgentActionMessageLog, AgentFinish
+
+import agent
+import cosmos_profile
+from fakes import FakeContainer
+from utils.resume_ingest import HEADER_SECTION, ResumeTooLong, merge_tool_calls, split_resume, split_sections
+
+RESUME = """Jordan Lee
+Senior Data Analyst · Toronto
+
+EXPERIENCE
+Data Analyst, Northwind (2019-2023)
+Built the finance reporting pipeline in SQL and Tableau.
+
+Analyst, Contoso (2016-2019)
+Automated monthly forecasts in Excel.
+
+Projects:
+- Churn model: gradient boosted model that cut churn by 4%.
+
+Skills
+SQL, Python, Tableau
+"""
+
+
+def _add(field, item):
+    return {"tool": "AddToListField", "args": {"field_name": field, "item": item}}
+
+
+def _set(field, value):
+    return {"tool": "SetStringField", "args": {"field_name": field, "value": value}}
+
+
+def test_sections_follow_headings():
+    sections = split_sections(RESUME)
+
+    assert [title for title, _ in sections] == [HEADER_SECTION, "Experience", "Projects", "Skills"]
+    assert sections[0][1].startswith("Jordan Lee")
+    assert sections[3][1] == "SQL, Python, Tableau"
+
+
+def test_all_caps_content_is_not_taken_for_a_heading():
+    sections = split_sections("JANE DOE\njane@x.com\nSKILLS\nPYTHON, SQL, AWS\nExcel\nEXPERIENCE\nIBM CORP\nAnalyst")
+
+    assert sections == [
+        (HEADER_SECTION, "JANE DOE\njane@x.com"),
+        ("Skills", "PYTHON, SQL, AWS\nExcel"),
+        ("Experience", "IBM CORP\nAnalyst"),
+    ]
+
+
+def test_long_sections_are_cut_between_entries():
+    chunks = split_resume(RESUME, budget=30)
+
+    experience = [chunk for chunk in chunks if chunk.section == "Experience"]
+    assert len(experience) == 2
+    assert experience[0].text.startswith("Data Analyst, Northwind")
+    assert experience[1].text.startswith("Analyst, Contoso")
+    assert (experience[1].part, experience[1].parts) == (2, 2)
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+
+
+def test_too_many_chunks_is_rejected():
+    with pytest.raises(ResumeTooLong):
+        split_resume(RESUME, budget=5, max_chunks=3)
+
+
+def test_merge_is_ordered_and_deduplicated():
+    planned = [
+        [_set("name", "Jordan Lee"), _add("skills", "SQL")],
+        [_add("skills", "sql "), _set("name", "J. Lee"), _add("skills", "Tableau")],
+        [{"tool": "RemoveFromListField", "args": {"field_name": "skills", "item": "Excel"}}, _add("tools", "Excel")],
+    ]
+
+    merged = merge_tool_calls(planned, {"tools": ["excel"]})
+
+    assert merged == [_set("name", "Jordan Lee"), _add("skills", "SQL"), _add("skills", "Tableau")]
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = FakeContainer()
+    container.create_item({"id": "u1", "skills": [], "experience_paragraphs": []})
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    monkeypatch.setattr(agent, "get_user_profile", lambda user_id: {})
+    return container
+
+
+class SectionPlanner:
+    """Agent stand-in that takes `latency` seconds per chunk and adds the chunk's first line as a paragraph."""
+
+    def __init__(self, latency=0.0, fail_on=None):
+        self.latency = latency
+        self.fail_on = fail_on
+
+    def invoke(self, inputs, config=None):
+        time.sleep(self.latency)
+        text = inputs["input"].rsplit("\n\n", 1)[-1]
+        if self.fail_on and self.fail_on in text:
+            raise RuntimeError("model unavailable")
+        first = text.split("\n")[0]
+        if "SQL" in first:
+            return [AgentActionMessageLog(tool="AddToListField", tool_input={"field_name": "skills", "item": "SQL"}, log="", message_log=[])]
+        if first.startswith("Jordan"):
+            return AgentFinish({"output": ""}, "")
+        return [
+            AgentActionMessageLog(
+                tool="AddToListField", tool_input={"field_name": "experience_paragraphs", "item": first}, log="", message_log=[]
+            )
+        ]
+
+
+def test_chunks_are_planned_concurrently_and_written_once(container, monkeypatch):
+    monkeypatch.setattr(agent, "get_agent", lambda: SectionPlanner(latency=0.1))
+    chunks = split_resume(RESUME, budget=30)
+
+    started = time.perf_counter()
+    events = list(agent.ingest_resume(chunks, "u1"))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.1 * len(chunks) / 2
+    assert events[0] == {"event": "chunks", "data": {"count": len(chunks), "sections": [HEADER_SECTION, "Experience", "Projects", "Skills"]}}
+    assert sorted(e["data"]["index"] for e in events if e["event"] == "chunk") == list(range(len(chunks)))
+    done = events[-1]["data"]
+    assert events[-1]["event"] == "done" and done["written"]
+    assert container.items["u1"]["experience_paragraphs"] == [
+        "Data Analyst, Northwind (2019-2023)",
+        "Analyst, Contoso (2016-2019)",
+        "- Churn model: gradient boosted model that cut churn by 4%.",
+    ]
+    assert container.items["u1"]["skills"] == ["SQL"]
+    assert container.counts()["patch_item"] == 1
+
+
+def test_a_failed_chunk_is_reported_and_the_rest_applied(container, monkeypatch):
+    monkeypatch.setattr(agent, "get_agent", lambda: SectionPlanner(fail_on="Contoso"))
+
+    events = list(agent.ingest_resume(split_resume(RESUME, budget=30), "u1"))
+
+    assert [e["data"]["section"] for e in events if e["event"] == "error"] == ["Experience"]
+    assert events[-1]["data"]["failed_chunks"] == 1
+    assert "Analyst, Contoso (2016-2019)" not in container.items["u1"]["experience_paragraphs"]
+    assert container.items["u1"]["skills"] == ["SQL"]
@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+from unittest.mock import patch
+
+import app as app_module
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, sys
+import asgi
+print(json.dumps({
+    "langchain": any(m.startswith("langchain") for m in sys.modules),
+    "client": __import__("utils.cosmos").cosmos._client,
+}))
+"""
+
+
+def test_import_does_no_io_and_defers_langchain():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # No Cosmos account configured and no network: importing must still work.
+    env.pop("AZURE_COSMOS_URL", None)
+    env.pop("AZURE_COSMOS_KEY", None)
+    env["TENANT_ID"] = "unreachable-tenant"
+    output = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, env=env, cwd=ROOT, check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    assert result == {"langchain": False, "client": None}
+
+
+def test_warm_up_logs_failures_and_carries_on(caplog):
+    with patch("app.get_agent", side_effect=RuntimeError("no model")), \
+            patch("app.cosmos.get_container") as get_container, \
+            patch("app.prefetch_jwks", side_effect=RuntimeError("entra down")):
+        app_module.warm_up()
+    get_container.assert_called_once_with()
+    assert "Warm-up of agent failed" in caplog.text
+    assert "Warm-up of JWKS failed" in caplog.text
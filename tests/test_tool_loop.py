@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+from langchain_core.agents import AgentActionMessageLog, AgentFinish
+
+from utils.tool_loop import ToolLoop
+
+
+class RecordingTool:
+    def __init__(self, name, log, delay=0.0, fail=False):
+        self.name = name
+        self.log = log
+        self.delay = delay
+        self.fail = fail
+
+    def invoke(self, args):
+        time.sleep(self.delay)
+        self.log.append((self.name, args, threading.current_thread().name))
+        if self.fail:
+            raise ValueError("bad field")
+        return f"{self.name} {args}"
+
+
+def _action(tool, **args):
+    return AgentActionMessageLog(tool=tool, tool_input=args, log="", message_log=[])
+
+
+def _call(tool, **args):
+    return {"tool": tool, "args": args}
+
+
+def test_independent_calls_run_in_parallel():
+    log = []
+    loop = ToolLoop({"Add": RecordingTool("Add", log, delay=0.1)})
+    calls = [_call("Add", field_name=field, item="x") for field in ("skills", "tools", "industries", "strengths")]
+
+    started = time.perf_counter()
+    outputs = loop.execute(calls)
+
+    assert time.perf_counter() - started < 0.3
+    assert outputs == [f"Add {call['args']}" for call in calls]
+
+
+def test_calls_on_the_same_field_keep_their_order():
+    log = []
+    loop = ToolLoop({"Add": RecordingTool("Add", log), "Remove": RecordingTool("Remove", log)})
+    loop.execute([
+        _call("Add", field_name="skills", item="Excel"),
+        _call("Add", field_name="tools", item="Jira"),
+        _call("Remove", field_name="skills", item="Excel"),
+    ])
+
+    skills = [(name, args["item"]) for name, args, _ in log if args["field_name"] == "skills"]
+    assert skills == [("Add", "Excel"), ("Remove", "Excel")]
+
+
+def test_identical_calls_are_executed_once():
+    log = []
+    loop = ToolLoop({"Add": RecordingTool("Add", log)})
+    outputs = loop.execute([_call("Add", field_name="skills", item="Excel")] * 3)
+
+    assert len(log) == 1
+    assert len(set(outputs)) == 1
+
+
+def test_tool_errors_are_returned_as_output():
+    loop = ToolLoop({"Add": RecordingTool("Add", [], fail=True)})
+    assert loop.execute([_call("Add", field_name="skills", item="x")]) == ["Add failed: bad field"]
+
+
+def test_results_are_fed_back_until_the_model_answers():
+    seen = []
+
+    def plan(steps):
+        seen.append([output for _, output in steps])
+        if not steps:
+            return [_action("Add", field_name="skills", item="Excel"), _action("Add", field_name="tools", item="Jira")]
+        return AgentFinish({"output": "Done."}, "")
+
+    result = ToolLoop({"Add": RecordingTool("Add", [])}).run(plan)
+
+    assert result.reply == "Done."
+    assert result.steps == 2
+    assert result.exhausted is None
+    assert [call["args"]["item"] for call in result.tool_calls] == ["Excel", "Jira"]
+    assert seen[1] == result.outputs
+
+
+def test_step_budget_ends_the_turn():
+    loop = ToolLoop({"Add": RecordingTool("Add", [])}, max_steps=3)
+    result = loop.run(lambda steps: _action("Add", field_name="skills", item=str(len(steps))))
+
+    assert result.exhausted == "steps"
+    assert result.reply == ""
+    assert len(result.tool_calls) == 3
+
+
+def test_time_budget_stops_further_model_calls():
+    now = [0.0]
+
+    def plan(steps):
+        now[0] += 20
+        return _action("Add", field_name="skills", item=str(len(steps)))
+
+    loop = ToolLoop({"Add": RecordingTool("Add", [])}, max_steps=5, time_budget=30, clock=lambda: now[0])
+    result = loop.run(plan)
+
+    assert result.exhausted == "time"
+    assert result.steps == 2
+
+
+def test_arun_matches_run():
+    async def plan(steps):
+        return AgentFinish({"output": "Hi"}, "") if steps else _action("Add", field_name="skills", item="x")
+
+    result = asyncio.run(ToolLoop({"Add": RecordingTool("Add", [])}).arun(plan))
+    assert (result.reply, result.steps, len(result.outputs)) == ("Hi", 2, 1)
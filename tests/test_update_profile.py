@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import cosmos_profile
+from fakes import FakeContainer
+from tools import update_profile
+
+
+@pytest.fixture
+def store(monkeypatch):
+    container = FakeContainer()
+    container.items["u1"] = {"id": "u1", "skills": ["SQL"], "location": "", "_etag": '"0"'}
+    monkeypatch.setattr(cosmos_profile, "get_container", lambda: container)
+    return container
+
+
+def test_turn_reads_once_and_writes_once(store):
+    with update_profile.profile_turn("u1"):
+        for skill in ["budgeting", "Tableau", "Excel", "Python", "R"]:
+            update_profile.add_to_list_field("u1", field_name="skills", item=skill)
+        update_profile.set_string_field("u1", field_name="location", value="Remote")
+        update_profile.remove_from_list_field("u1", field_name="skills", item="SQL")
+        assert (store.count("read_item"), store.count("patch_item")) == (1, 0)
+
+    assert (store.count("read_item"), store.count("patch_item")) == (1, 1)
+    assert store.items["u1"]["skills"] == ["budgeting", "Tableau", "Excel", "Python", "R"]
+    assert store.items["u1"]["location"] == "Remote"
+
+
+def test_turn_without_changes_skips_write(store):
+    with update_profile.profile_turn("u1"):
+        result = update_profile.add_to_list_field("u1", field_name="skills", item="SQL")
+        update_profile.remove_from_list_field("u1", field_name="tools", item="Excel")
+        update_profile.set_string_field("u1", field_name="location", value="")
+
+    assert "already" in result
+    assert (store.count("read_item"), store.count("patch_item")) == (1, 0)
+
+
+def test_untouched_turn_does_not_read(store):
+    with update_profile.profile_turn("u1"):
+        pass
+    assert store.calls == []
+
+
+def test_turn_flushes_when_block_raises(store):
+    with pytest.raises(RuntimeError):
+        with update_profile.profile_turn("u1"):
+            update_profile.add_to_list_field("u1", field_name="skills", item="Excel")
+            raise RuntimeError("model failed")
+    assert store.items["u1"]["skills"] == ["SQL", "Excel"]
+
+
+def test_calls_outside_turn_write_through(store):
+    update_profile.add_to_list_field("u1", field_name="skills", item="Excel")
+    update_profile.add_to_list_field("u1", field_name="skills", item="Excel")
+    assert (store.count("read_item"), store.count("patch_item")) == (2, 1)
+    assert store.items["u1"]["skills"] == ["SQL", "Excel"]
+
+
+def test_turn_is_scoped_to_its_context(store):
+    store.items["u2"] = {"id": "u2", "skills": []}
+    seen = {}
+
+    def other_thread():
+        # A different thread has no open turn and writes through.
+        update_profile.add_to_list_field("u2", field_name="skills", item="Go")
+        seen["u2"] = store.items["u2"]["skills"]
+
+    with update_profile.profile_turn("u1"):
+        update_profile.add_to_list_field("u1", field_name="skills", item="Excel")
+        t = threading.Thread(target=other_thread)
+        t.start()
+        t.join()
+        assert store.items["u1"]["skills"] == ["SQL"]
+
+    assert seen["u2"] == ["Go"]
+    assert store.items["u1"]["skills"] == ["SQL", "Excel"]
@@ -1,21 +1,245 @@
-from cosmos_profile import get_profile, save_profile
+import asyncio
+import copy
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from cosmos_profile import ProfileChange, apply_change, get_profile, patch_profile
+from utils import pending_questions
+from utils.canonical_terms import CANONICAL_FIELDS, ListIndex, canonicalize
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+
+ChangeListener = Callable[[str, List[ProfileChange]], None]
+_listeners: List[ChangeListener] = []
+
+
+def add_change_listener(listener: ChangeListener) -> None:
+    """
+    Call `listener(user_id, changes)` after each successful profile write.
+
+    Listeners keep derived in-process state (indexes, caches) in step with
+    the profile. They run on the writer's thread, so they should be quick;
+    their errors are logged and never fail the write.
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_change_listener(listener: ChangeListener) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def notify(user_id: str, changes: List[ProfileChange]) -> None:
+    """Run the change listeners for a write made outside a turn (e.g. a bulk import)."""
+    for listener in list(_listeners):
+        try:
+            listener(user_id, changes)
+        except Exception as e:
+            logger.error("Profile change listener failed for %s: %s", user_id, e)
+
+
+class ProfileTurn:
+    """
+    Unit of work for one agent turn.
+
+    The profile is read on first use, tool calls mutate an in-memory copy
+    and are recorded as `ProfileChange`s, and `flush` writes them back once
+    as an ETag-conditioned partial update, only if something changed.
+
+    Adds and removes on `CANONICAL_FIELDS` are matched by canonical key
+    against a `ListIndex` of the field, built on first use in the turn:
+    adding "MS Excel" to skills that hold "excel" is a no-op, and removing
+    it removes "excel".
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._base: Optional[dict] = None
+        self._profile: Optional[dict] = None
+        self._changes: List[ProfileChange] = []
+        self._indexes: Dict[str, ListIndex] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._changes)
+
+    @property
+    def version(self) -> Optional[str]:
+        """`_etag` of the stored profile as last read or written by this turn."""
+        return (self._base or {}).get("_etag")
+
+    def _load(self) -> dict:
+        if self._profile is None:
+            with span("tool_read"):
+                self._base = get_profile(self.user_id)
+            self._profile = copy.deepcopy(self._base)
+            self._indexes = {}
+        return self._profile
+
+    @property
+    def loaded(self) -> bool:
+        return self._profile is not None
+
+    def seed(self, profile: dict) -> None:
+        """Use `profile`, read by the caller, as the turn's profile unless one was read already."""
+        with self._lock:
+            if self._profile is None and profile.get("_etag"):
+                self._base = profile
+                self._profile = copy.deepcopy(profile)
+                self._indexes = {}
+
+    def snapshot(self) -> dict:
+        """Return a copy of the profile as it currently stands in this turn."""
+        with self._lock:
+            return copy.deepcopy(self._load())
+
+    def apply(self, change: ProfileChange) -> bool:
+        """Apply `change` to the in-memory profile. Returns True if it changed anything."""
+        with self._lock:
+            profile = self._load()
+            if change.field in CANONICAL_FIELDS and change.op in ("add", "remove") and isinstance(change.value, str):
+                change = self._canonical(profile, change)
+                if change is None:
+                    return False
+            if apply_change(profile, change) is None:
+                return False
+            self._changes.append(change)
+            index = self._indexes.get(change.field)
+            if index is not None and change.op == "add":
+                index.add(change.value)
+            elif index is not None:
+                # Only one stored spelling was removed; others may be left
+                # in a profile that predates compaction.
+                del self._indexes[change.field]
+            return True
+
+    def _canonical(self, profile: dict, change: ProfileChange) -> Optional[ProfileChange]:
+        """`change` in terms of the stored items, or None if it is a no-op."""
+        index = self._indexes.get(change.field)
+        if index is None:
+            values = profile.get(change.field)
+            index = self._indexes[change.field] = ListIndex(change.field, values if isinstance(values, list) else ())
+        stored = index.get(change.value)
+        if change.op == "add":
+            return None if stored is not None else change._replace(value=canonicalize(change.field, change.value))
+        return None if stored is None else change._replace(value=stored)
+
+    def flush(self) -> bool:
+        """Persist the recorded changes, if any. Returns True if a write happened."""
+        with self._lock:
+            if not self._changes:
+                return False
+            changes, self._changes = self._changes, []
+            with span("tool_write"):
+                self._base = patch_profile(self.user_id, changes, self._base)
+            self._profile = copy.deepcopy(self._base)
+            self._indexes = {}
+        notify(self.user_id, changes)
+        return True
+
+
+_current_turn: ContextVar[Optional[ProfileTurn]] = ContextVar("profile_turn", default=None)
+
+
+@contextmanager
+def profile_turn(user_id: str) -> Iterator[ProfileTurn]:
+    """
+    Open a unit of work for `user_id` for the duration of the block.
+
+    Tool calls made inside the block share one profile read and their
+    changes are flushed in a single write when the block exits, including
+    when it exits with an error (each change was already reported back to
+    the model as done).
+    """
+    turn = ProfileTurn(user_id)
+    token = _current_turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _current_turn.reset(token)
+        turn.flush()
+
+
+@asynccontextmanager
+async def aprofile_turn(user_id: str) -> AsyncIterator[ProfileTurn]:
+    """
+    Async variant of `profile_turn` for the ASGI path.
+
+    The tools themselves are synchronous and run in LangChain's executor;
+    the final flush is moved off the event loop so it does not stall
+    other in-flight chats.
+    """
+    turn = ProfileTurn(user_id)
+    token = _current_turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _current_turn.reset(token)
+        await asyncio.to_thread(turn.flush)
+
+
+def _apply(user_id: str, change: ProfileChange) -> bool:
+    turn = _current_turn.get()
+    if turn is not None and turn.user_id == user_id:
+        return turn.apply(change)
+    # No turn open (e.g. called outside run_agent): read, mutate, write now.
+    turn = ProfileTurn(user_id)
+    changed = turn.apply(change)
+    turn.flush()
+    return changed
+
+
+class Edit(str):
+    """A profile tool's message, carrying the value it wrote and whether that changed the profile."""
+
+    def __new__(cls, message: str, value: str, changed: bool) -> "Edit":
+        result = super().__new__(cls, message)
+        result.value = value
+        result.changed = changed
+        return result
+
+
+def _edit(user_id: str, op: str, field_name: str, value: str) -> Edit:
+    if op != "set" and field_name in CANONICAL_FIELDS:
+        value = canonicalize(field_name, value)
+    changed = _apply(user_id, ProfileChange(op, field_name, value))
+    if op == "add":
+        message = f"Added '{value}' to {field_name}." if changed else f"'{value}' is already in {field_name}."
+    elif op == "remove":
+        message = f"Removed '{value}' from {field_name}." if changed else f"'{value}' is not in {field_name}."
+    else:
+        message = f"Set {field_name} to '{value}'." if changed else f"{field_name} is already '{value}'."
+    return Edit(message, value, changed)
+
 
 def add_to_list_field(user_id: str, field_name: str, item: str) -> str:
-    profile = get_profile(user_id)
-    if item not in profile.get(field_name, []):
-        profile.setdefault(field_name, []).append(item)
-    save_profile(user_id, profile)
-    return f"Added '{item}' to {field_name}."
+    return _edit(user_id, "add", field_name, item)
+
 
 def remove_from_list_field(user_id: str, field_name: str, item: str) -> str:
-    profile = get_profile(user_id)
-    if item in profile.get(field_name, []):
-        profile[field_name].remove(item)
-    save_profile(user_id, profile)
-    return f"Removed '{item}' from {field_name}."
+    return _edit(user_id, "remove", field_name, item)
+
 
 def set_string_field(user_id: str, field_name: str, value: str) -> str:
-    profile = get_profile(user_id)
-    profile[field_name] = value
-    save_profile(user_id, profile)
-    return f"Set {field_name} to '{value}'."
+    return _edit(user_id, "set", field_name, value)
+
+
+def add_pending_question(user_id: str, question: str, priority: int = 0) -> str:
+    # Pending questions live in their own small record, outside the profile turn.
+    if not pending_questions.add(user_id, question, priority):
+        return f"'{question}' is already pending."
+    return f"Will ask later: '{question}'."
+
+
+def remove_pending_question(user_id: str, question: str) -> str:
+    removed = pending_questions.remove(user_id, question)
+    if removed is None:
+        return f"'{question}' was not pending."
+    return f"Removed pending question '{removed}'."
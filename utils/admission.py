@@ -0,0 +1,345 @@
+"""
+Admission control in front of the agent.
+
+Every chat turn holds a model call for seconds, and the deployment only
+serves so many at once.  Letting requests pile up behind it makes every
+queued request slow and ends in Azure throttling anyway, so a turn has
+to be admitted before it runs:
+
+1. Identical concurrent requests (same user, session and prompt, e.g. a
+   double submit) are collapsed: followers wait for the first one's reply
+   instead of running the turn again.
+2. Each user has a token bucket of `USER_RATE_BURST` turns refilled at
+   `USER_RATE_LIMIT` per minute; an empty bucket rejects immediately.
+3. At most `ADMISSION_MAX_CONCURRENT` turns run at once.  Further ones
+   wait in FIFO order.  A request is rejected up front when the queue is
+   full (`ADMISSION_MAX_QUEUE`), or when its expected wait exceeds
+   `ADMISSION_MAX_WAIT` seconds. The expected wait is estimated from the
+   average time a turn holds its slot. A request is also rejected if it
+   actually waits that long.
+
+Rejections raise `Rejected` with a `retry_after` hint in seconds, which the
+routes turn into a 429 with a Retry-After header.  Admitted requests
+therefore see bounded queueing however overloaded the worker is.
+
+Limits are per worker process: size `ADMISSION_MAX_CONCURRENT` to the
+model quota divided by the number of workers.  The controller is shared
+by the sync (Flask) and async (ASGI) routes of a worker.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Iterator, Optional
+
+from utils.metrics import ADMISSION_DECISIONS, ADMISSION_WAIT_SECONDS, REGISTRY
+from utils.response_cache import normalize_prompt
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+USER_RATE_LIMIT = float(os.getenv("USER_RATE_LIMIT", "20"))  # turns per minute; 0 disables
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", "5"))
+ADMISSION_MAX_USERS = int(os.getenv("ADMISSION_MAX_USERS", "10000"))
+
+# Smoothing of the average slot hold time used to predict queue waits.
+_SERVICE_TIME_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    """The request was not admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"request rejected ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def request_key(user_id: str, session_id: str, prompt: str) -> str:
+    """Requests with the same key are collapsed while one of them is in flight."""
+    return "\0".join((user_id, session_id, normalize_prompt(prompt)))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Per-user rate limits, a bounded concurrency limit with a deadline-aware
+    queue, and collapsing of identical in-flight requests.
+
+    Args:
+        max_concurrent: Turns run at once; 0 disables the limit.
+        max_queue: Requests allowed to wait for a slot.
+        max_wait: Seconds a request may wait for a slot.
+        user_rate: Turns per minute per user; 0 disables rate limiting.
+        user_burst: Turns a user may make back to back.
+        max_users: Users whose buckets are remembered (LRU).
+        clock: Monotonic time source, for tests.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        user_rate: float = USER_RATE_LIMIT,
+        user_burst: float = USER_RATE_BURST,
+        max_users: int = ADMISSION_MAX_USERS,
+        clock=time.monotonic,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.user_rate = user_rate / 60.0
+        self.user_burst = max(1.0, user_burst)
+        self.max_users = max_users
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._service_time = 0.0
+        self._flights: dict = {}
+
+    # -- per-user rate limit --------------------------------------------
+
+    def _take_token(self, user_id: str) -> None:
+        if self.user_rate <= 0:
+            return
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.user_burst, now)
+                while len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+                bucket.tokens = min(self.user_burst, bucket.tokens + (now - bucket.updated) * self.user_rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return
+            retry_after = (1 - bucket.tokens) / self.user_rate
+        ADMISSION_DECISIONS.inc(outcome="rate_limited")
+        raise Rejected("rate_limited", retry_after)
+
+    # -- global concurrency ------------------------------------------------
+
+    def _expected_wait(self, position: int) -> float:
+        # Slots free up at about max_concurrent per average service time.
+        return self._service_time * (position + 1) / self.max_concurrent
+
+    def _try_acquire(self, waiter_factory: Callable[[], _Waiter]) -> Optional[_Waiter]:
+        """Take a free slot (returns None) or join the queue (returns the waiter)."""
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                ADMISSION_DECISIONS.inc(outcome="admitted")
+                return None
+            position = len(self._waiters)
+            expected = self._expected_wait(position)
+            if position >= self.max_queue or expected > self.max_wait:
+                ADMISSION_DECISIONS.inc(outcome="overloaded")
+                raise Rejected("overloaded", max(expected, self._service_time))
+            waiter = waiter_factory()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Leave the queue after a timeout or cancellation; True if a slot was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _release(self, held: float) -> None:
+        with self._lock:
+            if self._service_time:
+                self._service_time += _SERVICE_TIME_ALPHA * (held - self._service_time)
+            else:
+                self._service_time = held
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter.
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self._in_flight -= 1
+
+    def _timed_out(self) -> Rejected:
+        ADMISSION_DECISIONS.inc(outcome="timed_out")
+        with self._lock:
+            return Rejected("overloaded", self._expected_wait(len(self._waiters)))
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one of the concurrent-turn slots for the block."""
+        if self.max_concurrent <= 0:
+            yield
+            return
+        queued_at = self._clock()
+        event = threading.Event()
+        waiter = self._try_acquire(lambda: _Waiter(event.set))
+        if waiter is not None and not event.wait(self.max_wait) and not self._give_up(waiter):
+            raise self._timed_out()
+        started = self._clock()
+        if waiter is not None:
+            ADMISSION_DECISIONS.inc(outcome="queued")
+            ADMISSION_WAIT_SECONDS.observe(started - queued_at)
+        try:
+            yield
+        finally:
+            self._release(self._clock() - started)
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        """Async counterpart of `slot`; waiting does not block the event loop."""
+        if self.max_concurrent <= 0:
+            yield
+            return
+        queued_at = self._clock()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake() -> None:
+            # Called from whichever thread releases the slot.
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._try_acquire(lambda: _Waiter(wake))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(granted, self.max_wait)
+            except asyncio.TimeoutError:
+                if not self._give_up(waiter):
+                    raise self._timed_out()
+            except asyncio.CancelledError:
+                # The client went away; return a slot we may have been handed.
+                if self._give_up(waiter):
+                    self._release(0.0)
+                raise
+        started = self._clock()
+        if waiter is not None:
+            ADMISSION_DECISIONS.inc(outcome="queued")
+            ADMISSION_WAIT_SECONDS.observe(started - queued_at)
+        try:
+            yield
+        finally:
+            self._release(self._clock() - started)
+
+    @contextmanager
+    def admit(self, user_id: str) -> Iterator[None]:
+        """Rate-limit `user_id`, then hold a slot for the block."""
+        self._take_token(user_id)
+        with self.slot():
+            yield
+
+    # -- collapsing ------------------------------------------------------
+
+    def _join(self, key: str):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Future()
+            return flight, True
+
+    def _land(self, key: str) -> None:
+        with self._lock:
+            self._flights.pop(key, None)
+
+    def run(self, user_id: str, key: str, func: Callable[[], Any]) -> Any:
+        """Run `func` as an admitted turn, or share the result of an identical one in flight."""
+        flight, leader = self._join(key)
+        if not leader:
+            ADMISSION_DECISIONS.inc(outcome="collapsed")
+            return flight.result()
+        try:
+            with self.admit(user_id):
+                result = func()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            self._land(key)
+        flight.set_result(result)
+        return result
+
+    async def arun(self, user_id: str, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Async counterpart of `run`."""
+        flight, leader = self._join(key)
+        if not leader:
+            ADMISSION_DECISIONS.inc(outcome="collapsed")
+            return await asyncio.wrap_future(flight)
+        try:
+            self._take_token(user_id)
+            async with self.aslot():
+                result = await func()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            self._land(key)
+        flight.set_result(result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "service_time": round(self._service_time, 3),
+            }
+
+
+_default_controller: Optional[AdmissionController] = None
+_default_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the worker-wide controller configured from the environment."""
+    global _default_controller
+    if _default_controller is None:
+        with _default_lock:
+            if _default_controller is None:
+                _default_controller = AdmissionController()
+    return _default_controller
+
+
+def _collect_stats():
+    if _default_controller is None:
+        return []
+    stats = _default_controller.stats()
+    return [
+        ("zil_admission_in_flight", "gauge", "Admitted turns running in this worker.", {}, stats["in_flight"]),
+        ("zil_admission_queued", "gauge", "Requests waiting for a turn slot in this worker.", {}, stats["queued"]),
+    ]
+
+
+REGISTRY.add_collector(_collect_stats)
@@ -0,0 +1,394 @@
+"""
+Background job queue for work that should not hold up the reply.
+
+Work that only keeps derived state fresh, such as embedding paragraphs a turn
+just added, is enqueued by the request and run later by a few worker
+threads.  A job is identified by its kind and user. While a job is waiting,
+enqueueing the same kind for the same user again is a no-op, because
+handlers read the user's current state when they run. A burst of edits
+therefore costs one job.
+
+A failing job is retried with exponential backoff (`BACKGROUND_RETRY_BASE`
+seconds, doubling) up to `BACKGROUND_MAX_ATTEMPTS` times and then dropped
+with an error log.  At most `BACKGROUND_WORKERS` jobs run at once per
+process.
+
+By default jobs are queued in memory and lost on restart.  Setting
+`BACKGROUND_JOBS_PATH` spools them to a SQLite file instead.  All workers
+on the machine share that spool: a job enqueued by one worker can run in
+another. Jobs survive restarts. A worker that dies mid-job loses its lease
+after `BACKGROUND_LEASE` seconds, and the job is run again.
+
+Handlers must therefore be idempotent and must not rely on in-process state
+of the worker that enqueued the job.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from utils.metrics import BACKGROUND_JOB_SECONDS, BACKGROUND_JOBS, REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_JOBS_PATH = os.getenv("BACKGROUND_JOBS_PATH", "")
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "2"))
+BACKGROUND_MAX_ATTEMPTS = int(os.getenv("BACKGROUND_MAX_ATTEMPTS", "5"))
+BACKGROUND_RETRY_BASE = float(os.getenv("BACKGROUND_RETRY_BASE", "1"))
+BACKGROUND_RETRY_MAX = 300.0
+BACKGROUND_LEASE = float(os.getenv("BACKGROUND_LEASE", "300"))
+# How often idle workers look for jobs enqueued by other processes or due for retry.
+BACKGROUND_POLL_INTERVAL = float(os.getenv("BACKGROUND_POLL_INTERVAL", "1"))
+
+# handler(user_id, payload)
+Handler = Callable[[str, Any], None]
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    user_id: str
+    payload: Any
+    attempts: int
+    enqueued_at: float
+
+
+def job_key(kind: str, user_id: str) -> str:
+    return f"{kind}\0{user_id}"
+
+
+class MemoryJobStore:
+    """Jobs of this process, ordered by when they are due."""
+
+    def __init__(self):
+        self._due: List[tuple] = []  # heap of (run_at, id)
+        self._jobs: Dict[int, Job] = {}
+        self._queued: Dict[str, int] = {}  # key -> id of the waiting job
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def push(self, kind: str, user_id: str, payload: Any, run_at: float, enqueued_at: float, attempts: int = 0) -> bool:
+        key = job_key(kind, user_id)
+        with self._lock:
+            if key in self._queued:
+                return False
+            job = Job(next(self._ids), kind, user_id, payload, attempts, enqueued_at)
+            self._jobs[job.id] = job
+            self._queued[key] = job.id
+            heapq.heappush(self._due, (run_at, job.id))
+            return True
+
+    def claim(self, now: float) -> Optional[Job]:
+        with self._lock:
+            if not self._due or self._due[0][0] > now:
+                return None
+            _, job_id = heapq.heappop(self._due)
+            job = self._jobs.pop(job_id)
+            del self._queued[job_key(job.kind, job.user_id)]
+            return job
+
+    def done(self, job: Job) -> None:
+        pass
+
+    def retry(self, job: Job, run_at: float) -> bool:
+        """Requeue `job`; False if a newer job for the same key is already waiting."""
+        return self.push(job.kind, job.user_id, job.payload, run_at, job.enqueued_at, job.attempts + 1)
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+
+class SQLiteJobStore:
+    """
+    Jobs in a SQLite file shared by the workers on one machine.
+
+    A partial unique index allows one waiting job per key. A claimed job
+    leaves that index, so the same key can be queued again while it runs.
+    """
+
+    def __init__(self, path: str, lease: float = BACKGROUND_LEASE):
+        self.path = path
+        self.lease = lease
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        db = self._connect()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, kind TEXT NOT NULL, user_id TEXT NOT NULL,"
+            " payload TEXT NOT NULL, attempts INTEGER NOT NULL, enqueued_at REAL NOT NULL, run_at REAL NOT NULL,"
+            " leased_until REAL NOT NULL DEFAULT 0)"
+        )
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_waiting ON jobs (key) WHERE leased_until = 0")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (run_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def push(self, kind: str, user_id: str, payload: Any, run_at: float, enqueued_at: float, attempts: int = 0) -> bool:
+        cursor = self._connect().execute(
+            "INSERT OR IGNORE INTO jobs (key, kind, user_id, payload, attempts, enqueued_at, run_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_key(kind, user_id), kind, user_id, json.dumps(payload), attempts, enqueued_at, run_at),
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, now: float) -> Optional[Job]:
+        db = self._connect()
+        # IMMEDIATE takes the write lock up front, so two workers never claim the same job.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id, kind, user_id, payload, attempts, enqueued_at FROM jobs"
+                " WHERE run_at <= ? AND leased_until < ? ORDER BY run_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET leased_until = ? WHERE id = ?", (now + self.lease, row[0]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), row[4], row[5])
+
+    def done(self, job: Job) -> None:
+        self._connect().execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def retry(self, job: Job, run_at: float) -> bool:
+        db = self._connect()
+        # Back into the waiting index; OR IGNORE leaves the row alone if the key is already waiting.
+        cursor = db.execute(
+            "UPDATE OR IGNORE jobs SET leased_until = 0, run_at = ?, attempts = attempts + 1 WHERE id = ?", (run_at, job.id)
+        )
+        if cursor.rowcount == 1:
+            return True
+        self.done(job)
+        return False
+
+    def depth(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+class JobQueue:
+    """
+    Runs registered job kinds on a small pool of daemon threads.
+
+    Args:
+        store: `MemoryJobStore` (default) or `SQLiteJobStore`.
+        workers: Jobs run concurrently by this process.
+        max_attempts: Runs of a failing job before it is dropped.
+        retry_base: Delay before the first retry, in seconds; doubles per attempt.
+        poll_interval: Seconds an idle worker waits before looking again.
+        clock: Wall-clock time source, for tests.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        workers: int = BACKGROUND_WORKERS,
+        max_attempts: int = BACKGROUND_MAX_ATTEMPTS,
+        retry_base: float = BACKGROUND_RETRY_BASE,
+        poll_interval: float = BACKGROUND_POLL_INTERVAL,
+        clock=time.time,
+    ):
+        self.store = store if store is not None else MemoryJobStore()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._handlers: Dict[str, Handler] = {}
+        self._wakeup = threading.Condition()
+        self._running = 0
+        # Workers inside `store.claim`, which runs outside `_wakeup`.
+        self._claiming = 0
+        # Bumped by every enqueue, so a worker whose claim came back empty
+        # can tell that a job arrived before it started waiting.
+        self._enqueued = 0
+        self._threads: List[threading.Thread] = []
+        # Threads do not survive a fork; each process starts its own.
+        self._pid: Optional[int] = None
+        self._stopped = False
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, user_id: str, payload: Any = None, delay: float = 0.0) -> bool:
+        """
+        Queue `kind` for `user_id`; returns False if it was already waiting.
+
+        `payload` must be JSON-serialisable. When the enqueue is coalesced
+        into a waiting job, the waiting job keeps its own payload.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = self._clock()
+        try:
+            queued = self.store.push(kind, user_id, payload, now + delay, now)
+        except sqlite3.Error as e:
+            logger.error("Failed to queue %s job for %s: %s", kind, user_id, e)
+            BACKGROUND_JOBS.inc(kind=kind, outcome="dropped")
+            return False
+        BACKGROUND_JOBS.inc(kind=kind, outcome="queued" if queued else "coalesced")
+        self.start()
+        with self._wakeup:
+            self._enqueued += 1
+            self._wakeup.notify()
+        return queued
+
+    def start(self) -> None:
+        """Start this process's worker threads, if not running yet."""
+        if self._pid == os.getpid():
+            return
+        with self._wakeup:
+            if self._pid == os.getpid():
+                return
+            self._stopped = False
+            self._running = 0
+            self._claiming = 0
+            self._threads = [
+                threading.Thread(target=self._work, name=f"background-job-{i}", daemon=True) for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Let running jobs finish and stop the workers; waiting jobs stay queued."""
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def _claim(self) -> Optional[Job]:
+        try:
+            return self.store.claim(self._clock())
+        except sqlite3.Error as e:
+            logger.error("Failed to claim a background job: %s", e)
+            return None
+
+    def _work(self) -> None:
+        while True:
+            # The claim may wait up to the SQLite busy timeout, so it runs
+            # without the condition's lock; enqueue never blocks on it.
+            with self._wakeup:
+                if self._stopped:
+                    return
+                self._claiming += 1
+                enqueued = self._enqueued
+            job = self._claim()
+            with self._wakeup:
+                self._claiming -= 1
+                if job is None:
+                    self._wakeup.notify_all()
+                    if not self._stopped and self._enqueued == enqueued:
+                        self._wakeup.wait(self.poll_interval)
+                    continue
+                self._running += 1
+            try:
+                self._run(job)
+            finally:
+                with self._wakeup:
+                    self._running -= 1
+                    self._wakeup.notify_all()
+
+    def _run(self, job: Job) -> None:
+        handler = self._handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"no handler for job kind {job.kind}")
+            with span(f"job:{job.kind}"):
+                handler(job.user_id, job.payload)
+        except Exception as e:
+            attempts = job.attempts + 1
+            if handler is None or attempts >= self.max_attempts:
+                logger.error("Background job %s for %s failed after %d attempts: %s", job.kind, job.user_id, attempts, e)
+                BACKGROUND_JOBS.inc(kind=job.kind, outcome="failed")
+                self._finish(job)
+                return
+            delay = min(BACKGROUND_RETRY_MAX, self.retry_base * (2 ** job.attempts))
+            logger.warning("Background job %s for %s failed, retrying in %.1fs: %s", job.kind, job.user_id, delay, e)
+            BACKGROUND_JOBS.inc(kind=job.kind, outcome="retried")
+            try:
+                self.store.retry(job, self._clock() + delay)
+            except sqlite3.Error as e:
+                logger.error("Failed to requeue %s job for %s: %s", job.kind, job.user_id, e)
+            return
+        BACKGROUND_JOBS.inc(kind=job.kind, outcome="ok")
+        BACKGROUND_JOB_SECONDS.observe(max(0.0, self._clock() - job.enqueued_at), kind=job.kind)
+        self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        try:
+            self.store.done(job)
+        except sqlite3.Error as e:
+            # The lease runs out and the job runs once more; handlers are idempotent.
+            logger.error("Failed to complete %s job for %s: %s", job.kind, job.user_id, e)
+
+    def drain(self, timeout: float = 10.0) -> bool:
+        """Wait until no job is waiting or running; returns False on timeout.  For tests and shutdown."""
+        deadline = time.monotonic() + timeout
+        with self._wakeup:
+            while self.store.depth() or self._running or self._claiming:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._wakeup.wait(min(remaining, self.poll_interval))
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {"depth": self.store.depth(), "running": self._running}
+
+
+_default_queue: Optional[JobQueue] = None
+_default_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide queue configured from the environment."""
+    global _default_queue
+    if _default_queue is None:
+        with _default_lock:
+            if _default_queue is None:
+                store = SQLiteJobStore(BACKGROUND_JOBS_PATH) if BACKGROUND_JOBS_PATH else MemoryJobStore()
+                _default_queue = JobQueue(store)
+    return _default_queue
+
+
+def _collect_stats():
+    if _default_queue is None:
+        return []
+    try:
+        depth = _default_queue.store.depth()
+    except sqlite3.Error:
+        return []
+    samples = [("zil_background_jobs_running", "gauge", "Background jobs running in this worker.", {}, _default_queue._running)]
+    if isinstance(_default_queue.store, SQLiteJobStore):
+        samples.append(
+            ("zil_background_spool_depth", "gauge", "Jobs waiting in the spool shared by all workers.", {}, depth)
+        )
+    else:
+        samples.append(("zil_background_jobs_queued", "gauge", "Background jobs waiting in this worker.", {}, depth))
+    return samples
+
+
+REGISTRY.add_collector(_collect_stats, shared=["zil_background_spool_depth"])
@@ -0,0 +1,523 @@
+"""
+Canonical names for the values of `skills`, `tools` and `industries`.
+
+The model writes whatever the user typed, so "Excel", "MS Excel" and
+"excel " would otherwise be stored as three skills. They take space in
+the document and in every prompt that carries the profile, and they
+split the terms the job match index scores on. This module maps each
+value to one canonical spelling:
+
+1. `fold` lower-cases the value, collapses its whitespace and strips
+   punctuation from the ends ("  MS  Excel. " -> "ms excel").
+2. The folded value is looked up in the alias table of its field
+   (`TECH_ALIASES` for skills and tools, `INDUSTRY_ALIASES` for
+   industries). Every canonical name is also an alias of itself.
+3. Values the table doesn't know keep their own casing; only their
+   whitespace and end punctuation are cleaned.
+
+The tables hold only spellings and abbreviations of one name. Mapping a
+value to a neighbouring concept ("Software" to "Technology") would lose
+what the user said, and a remove of either would delete the other.
+
+Typos are never corrected on write: "Baking" is a word of its own, not
+a misspelt "Banking". `suggest` searches a trie of the table's aliases
+for a spelling within a small edit distance ("Pyhton", "Kubernets"),
+counting a swap of two neighbouring letters as one edit. Values shorter
+than five characters get no suggestion ("R" and "Go" are too close to
+everything), the first letter must match, and a typo that is as close to
+two different names gets none. The compaction report lists these
+suggestions for review; they are not applied.
+
+`canonical_key` is the folded canonical name. Two values with the same
+key are the same item; `ListIndex` keeps the keys of one list field in a
+dict so membership is a hash lookup. `tools.update_profile` checks every
+add and remove against it. `canonicalize` is cached with
+`functools.lru_cache`, so an add to a 40-item list takes about 8 µs.
+
+Profiles written before this module existed are rewritten by the
+compaction job, from the repository root:
+
+    python -m utils.canonical_terms compact --dry-run
+    python -m utils.canonical_terms compact
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from cosmos_profile import PATCH_MAX_ATTEMPTS, ProfileConflictError
+from utils import cosmos
+from utils.metrics import cosmos_call
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_FIELDS = ("skills", "tools", "industries")
+
+COMPACT_CONCURRENCY = 8
+COMPACT_PAGE_SIZE = 100
+# Examples of rewritten values, and typo suggestions, kept in a report.
+MAX_REPORTED_CHANGES = 100
+
+# Canonical name -> other spellings. Skills and tools share one table:
+# users file the same thing under either field.
+TECH_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "Excel": ("ms excel", "microsoft excel"),
+    "Word": ("ms word", "microsoft word"),
+    "PowerPoint": ("ms powerpoint", "microsoft powerpoint", "power point", "ppt"),
+    "Microsoft Office": ("ms office", "office 365", "microsoft 365", "m365"),
+    "Outlook": ("ms outlook", "microsoft outlook"),
+    "Power BI": ("powerbi", "power-bi", "microsoft power bi", "ms power bi"),
+    "Tableau": (),
+    "Looker": (),
+    "Looker Studio": ("google data studio",),
+    "SQL": ("structured query language",),
+    "PostgreSQL": ("postgres", "postgre sql"),
+    "MySQL": ("my sql",),
+    "SQL Server": ("ms sql", "mssql", "microsoft sql server"),
+    "MongoDB": ("mongo", "mongo db"),
+    "Snowflake": (),
+    "Python": ("python 3", "python3"),
+    "R": ("r programming", "r language"),
+    "Java": (),
+    "JavaScript": ("js", "java script"),
+    "TypeScript": ("ts", "type script"),
+    "Node.js": ("node", "nodejs", "node js"),
+    "React": ("react.js", "reactjs", "react js"),
+    "Angular": (),
+    "Vue.js": ("vue", "vuejs"),
+    "C++": ("cpp", "c plus plus"),
+    "C#": ("c sharp", "csharp"),
+    ".NET": ("dotnet", "dot net"),
+    "Go": ("golang",),
+    "Rust": (),
+    "Scala": (),
+    "Ruby on Rails": ("rails", "ror"),
+    "PHP": (),
+    "HTML": ("html5",),
+    "CSS": ("css3",),
+    "AWS": ("amazon web services",),
+    "Azure": ("microsoft azure", "ms azure"),
+    "Google Cloud Platform": ("gcp", "google cloud"),
+    "Docker": (),
+    "Kubernetes": ("k8s",),
+    "Terraform": (),
+    "Git": (),
+    "Linux": (),
+    "CI/CD": ("ci cd", "cicd"),
+    "Jira": ("atlassian jira",),
+    "Confluence": ("atlassian confluence",),
+    "Salesforce": ("sfdc",),
+    "SAP": (),
+    "QuickBooks": ("quick books",),
+    "Spark": ("apache spark",),
+    "Airflow": ("apache airflow",),
+    "Kafka": ("apache kafka",),
+    "Pandas": (),
+    "NumPy": (),
+    "PyTorch": (),
+    "TensorFlow": ("tensor flow",),
+    "scikit-learn": ("sklearn", "scikit learn", "scikitlearn"),
+    "Machine Learning": ("ml",),
+    "Deep Learning": (),
+    "Artificial Intelligence": ("ai",),
+    "Natural Language Processing": ("nlp",),
+    "Statistics": (),
+    "Data Visualization": ("data visualisation", "data viz", "dataviz"),
+    "Financial Modeling": ("financial modelling",),
+    "Figma": (),
+    "Adobe Photoshop": ("photoshop",),
+    "Adobe Illustrator": ("illustrator",),
+    "Agile": (),
+    "Scrum": (),
+    "Project Management": ("project mgmt",),
+    "REST APIs": ("rest api", "restful apis", "restful api"),
+    "GraphQL": ("graph ql",),
+    "SAS": (),
+    "SPSS": ("ibm spss",),
+    "MATLAB": (),
+}
+
+# Only spellings and abbreviations of the same industry: a narrower or
+# neighbouring one ("Investment Banking", "Logistics") is kept as given.
+INDUSTRY_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "Finance": ("finance industry",),
+    "Financial Services": (),
+    "Banking": (),
+    "Insurance": (),
+    "Healthcare": ("health care",),
+    "Pharmaceuticals": ("pharma", "pharmaceutical"),
+    "Technology": ("tech",),
+    "Information Technology": ("it",),
+    "Retail": (),
+    "Consumer Goods": ("cpg", "fmcg", "consumer packaged goods"),
+    "Manufacturing": (),
+    "Energy": (),
+    "Oil and Gas": ("oil & gas",),
+    "Education": (),
+    "Government": (),
+    "Non-profit": ("nonprofit", "non profit", "not for profit", "not-for-profit"),
+    "Consulting": (),
+    "Media": (),
+    "Telecommunications": ("telecom", "telecoms", "telco"),
+    "Real Estate": (),
+    "Transportation": ("transport",),
+    "Hospitality": (),
+    "Automotive": (),
+    "Aerospace": (),
+    "Legal": ("legal services",),
+}
+
+_SPACE = re.compile(r"\s+")
+# Bullets and quotes before a value, sentence punctuation after it.
+# "+" and "#" stay: "C++", "C#".
+_LEADING = " \t-*•·\"'([{"
+_TRAILING = " \t.,;:!?\"')]}"
+
+# Shortest value given a typo suggestion, and the longest one allowed one edit only.
+MIN_SUGGESTED_CHARS = 5
+MAX_ONE_EDIT_CHARS = 9
+
+
+def clean(value: str) -> str:
+    """`value` with its whitespace collapsed and bullets and punctuation stripped from the ends."""
+    return _SPACE.sub(" ", value).lstrip(_LEADING).rstrip(_TRAILING)
+
+
+def fold(value: str) -> str:
+    """The form values are compared in: cleaned and case-folded ("  MS  Excel. " -> "ms excel")."""
+    return clean(value).casefold()
+
+
+class _Node:
+    __slots__ = ("children", "name")
+
+    def __init__(self):
+        self.children: Dict[str, _Node] = {}
+        self.name: Optional[str] = None
+
+
+class AliasTable:
+    """Folded alias -> canonical name, with a trie of the aliases for typo suggestions."""
+
+    def __init__(self, aliases: Dict[str, Iterable[str]]):
+        self.names: Dict[str, str] = {}
+        self._root = _Node()
+        for name, others in aliases.items():
+            for alias in (name, *others):
+                key = fold(alias)
+                if self.names.setdefault(key, name) != name:
+                    raise ValueError(f"Alias {alias!r} maps to both {self.names[key]!r} and {name!r}")
+                node = self._root
+                for ch in key:
+                    node = node.children.setdefault(ch, _Node())
+                node.name = name
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.names.get(key)
+
+    def nearest(self, key: str, max_edits: int) -> Optional[str]:
+        """
+        The name of the alias closest to `key` within `max_edits` edits
+        that starts with the same character, or None if there is none or
+        two different names are equally close.
+
+        Walks the trie computing one row of the edit-distance table per
+        node, and skips a subtree as soon as every cell in its row exceeds
+        `max_edits`, so only a sliver of the table is ever visited.
+        """
+        first = self._root.children.get(key[:1])
+        if first is None:
+            return None
+        size = len(key) + 1
+        best: Dict[str, int] = {}
+        root_row = list(range(size))
+        # (node, character, its row, parent's row, parent's character)
+        stack = [(first, key[0], self._row(key, key[0], root_row, None, ""), root_row, "")]
+        while stack:
+            node, ch, row, parent_row, parent_ch = stack.pop()
+            distance = row[-1]
+            if node.name is not None and distance <= max_edits:
+                if distance < best.get(node.name, max_edits + 1):
+                    best[node.name] = distance
+            # A swap reaches back two rows, so the parent's row must be out of range too.
+            if min(row) > max_edits and min(parent_row) >= max_edits:
+                continue
+            for next_ch, child in node.children.items():
+                stack.append((child, next_ch, self._row(key, next_ch, row, parent_row, ch), row, ch))
+        if not best:
+            return None
+        closest = min(best.values())
+        names = [name for name, distance in best.items() if distance == closest]
+        return names[0] if len(names) == 1 else None
+
+    @staticmethod
+    def _row(key: str, ch: str, above: List[int], above2: Optional[List[int]], prev_ch: str) -> List[int]:
+        # Optimal string alignment distance: Levenshtein plus adjacent swaps.
+        row = [above[0] + 1]
+        for i in range(1, len(key) + 1):
+            cost = 0 if key[i - 1] == ch else 1
+            cell = min(row[i - 1] + 1, above[i] + 1, above[i - 1] + cost)
+            if above2 is not None and i > 1 and key[i - 1] == prev_ch and key[i - 2] == ch:
+                cell = min(cell, above2[i - 2] + 1)
+            row.append(cell)
+        return row
+
+
+TECH_TERMS = AliasTable(TECH_ALIASES)
+INDUSTRY_TERMS = AliasTable(INDUSTRY_ALIASES)
+FIELD_TABLES: Dict[str, AliasTable] = {"skills": TECH_TERMS, "tools": TECH_TERMS, "industries": INDUSTRY_TERMS}
+
+
+def _max_edits(key: str) -> int:
+    if len(key) < MIN_SUGGESTED_CHARS:
+        return 0
+    return 1 if len(key) <= MAX_ONE_EDIT_CHARS else 2
+
+
+def known_name(field: str, value: str) -> Optional[str]:
+    """The canonical name `value` is an alias of in `field`'s table, or None."""
+    table = FIELD_TABLES.get(field)
+    return table.get(fold(value)) if table is not None else None
+
+
+@lru_cache(maxsize=16384)
+def canonicalize(field: str, value: str) -> str:
+    """
+    The canonical spelling of `value` in `field`.
+
+    Fields without an alias table, and values the table doesn't know,
+    come back cleaned but otherwise as given.
+    """
+    name = known_name(field, value)
+    return name if name is not None else clean(value)
+
+
+def suggest(field: str, value: str) -> Optional[str]:
+    """
+    A known name `value` may be a typo of, for a person to confirm.
+
+    None if `value` is already a known spelling, the field has no table,
+    or nothing is unambiguously close.
+    """
+    table = FIELD_TABLES.get(field)
+    key = fold(value)
+    if table is None or table.get(key) is not None or not _max_edits(key):
+        return None
+    return table.nearest(key, _max_edits(key))
+
+
+def canonical_key(field: str, value: str) -> str:
+    """The key two values of `field` share if they name the same item."""
+    return fold(canonicalize(field, value))
+
+
+class ListIndex:
+    """
+    Canonical key -> stored item for one list field of a profile.
+
+    Built once per field per profile turn; after that, membership of any
+    spelling is a single dict lookup. The first stored spelling of a key
+    wins, matching what compaction keeps.
+    """
+
+    def __init__(self, field: str, values: Iterable[Any] = ()):
+        self.field = field
+        self._items: Dict[str, str] = {}
+        for value in values:
+            if isinstance(value, str):
+                self._items.setdefault(canonical_key(field, value), value)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, value: str) -> bool:
+        return canonical_key(self.field, value) in self._items
+
+    def get(self, value: str) -> Optional[str]:
+        """The stored item `value` is a spelling of, or None."""
+        return self._items.get(canonical_key(self.field, value))
+
+    def add(self, value: str) -> None:
+        self._items.setdefault(canonical_key(self.field, value), value)
+
+    def discard(self, value: str) -> None:
+        self._items.pop(canonical_key(self.field, value), None)
+
+
+def canonical_list(field: str, values: Iterable[Any]) -> List[Any]:
+    """`values` canonicalized and deduplicated, in first-seen order. Non-strings are kept as they are."""
+    seen = set()
+    result = []
+    for value in values:
+        if not isinstance(value, str):
+            result.append(value)
+            continue
+        name = canonicalize(field, value)
+        key = fold(name)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        result.append(name)
+    return result
+
+
+def compaction_operations(profile: dict) -> List[dict]:
+    """`set` patch operations that rewrite `profile`'s canonical fields, only those that change."""
+    operations = []
+    for field in CANONICAL_FIELDS:
+        values = profile.get(field)
+        if not isinstance(values, list):
+            continue
+        compacted = canonical_list(field, values)
+        if compacted != values:
+            operations.append({"op": "set", "path": f"/{field}", "value": compacted})
+    return operations
+
+
+def compact_profile(container, profile: dict, dry_run: bool = False) -> List[dict]:
+    """
+    Rewrite `profile`'s canonical fields in place in Cosmos.
+
+    The patch is conditioned on the document's ETag. If a chat turn wrote
+    the profile in the meantime, it is re-read and the rewrite recomputed,
+    so values added concurrently are never dropped. Returns the operations
+    that were (or, with `dry_run`, would have been) written.
+
+    Raises:
+        ProfileConflictError: If every attempt lost an ETag race.
+    """
+    user_id = profile["id"]
+    for _ in range(PATCH_MAX_ATTEMPTS):
+        operations = compaction_operations(profile)
+        if dry_run or not operations:
+            return operations
+        try:
+            cosmos_call(
+                "patch_item",
+                container.patch_item,
+                item=user_id,
+                partition_key=user_id,
+                patch_operations=operations,
+                etag=profile.get("_etag"),
+                match_condition=MatchConditions.IfNotModified,
+            )
+            return operations
+        except exceptions.CosmosAccessConditionFailedError:
+            profile = cosmos_call("read_item", container.read_item, item=user_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return []
+    raise ProfileConflictError(f"Profile {user_id} was modified concurrently {PATCH_MAX_ATTEMPTS} times; giving up")
+
+
+class CompactionReport:
+    def __init__(self):
+        self.scanned = 0
+        self.compacted = 0
+        self.failed = 0
+        self.values_before = 0
+        self.values_after = 0
+        self.changes: List[Dict[str, Any]] = []
+        self.suggestions: List[Dict[str, Any]] = []
+        self.seconds = 0.0
+
+    def suggest(self, profile: dict) -> None:
+        for field in CANONICAL_FIELDS:
+            values = profile.get(field)
+            for value in values if isinstance(values, list) else ():
+                if len(self.suggestions) >= MAX_REPORTED_CHANGES:
+                    return
+                suggestion = suggest(field, value) if isinstance(value, str) else None
+                if suggestion is not None:
+                    self.suggestions.append({"id": profile["id"], "field": field, "value": value, "suggestion": suggestion})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "scanned": self.scanned,
+            "compacted": self.compacted,
+            "failed": self.failed,
+            "values_before": self.values_before,
+            "values_after": self.values_after,
+            "seconds": round(self.seconds, 3),
+            "changes": self.changes,
+            "suggestions": self.suggestions,
+        }
+
+
+def compact_profiles(
+    container=None,
+    dry_run: bool = False,
+    concurrency: int = COMPACT_CONCURRENCY,
+    page_size: int = COMPACT_PAGE_SIZE,
+) -> CompactionReport:
+    """
+    Rewrite every profile's canonical fields, one page of profiles at a time.
+
+    Safe to rerun: profiles already in canonical form cost a read and no write.
+    Values that look like typos of a known name are only listed in the
+    report's `suggestions`.
+    """
+    container = container if container is not None else cosmos.get_container()
+    report = CompactionReport()
+    started = time.perf_counter()
+
+    def compact(profile: dict) -> Tuple[dict, Optional[List[dict]]]:
+        try:
+            return profile, compact_profile(container, profile, dry_run)
+        except Exception as e:
+            logger.error("Compaction of profile %s failed: %s", profile.get("id"), e)
+            return profile, None
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="compact") as pool:
+        for page in container.read_all_items(max_item_count=page_size).by_page():
+            for profile, operations in pool.map(compact, list(page)):
+                report.scanned += 1
+                report.suggest(profile)
+                if operations is None:
+                    report.failed += 1
+                    continue
+                if not operations:
+                    continue
+                report.compacted += 1
+                for operation in operations:
+                    field = operation["path"][1:]
+                    report.values_before += len(profile[field])
+                    report.values_after += len(operation["value"])
+                if len(report.changes) < MAX_REPORTED_CHANGES:
+                    report.changes.append({
+                        "id": profile["id"],
+                        **{op["path"][1:]: {"before": profile[op["path"][1:]], "after": op["value"]} for op in operations},
+                    })
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Canonicalize skills, tools and industries in stored profiles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser("compact", help="Rewrite every profile's list fields to their canonical form.")
+    compact.add_argument("--dry-run", action="store_true", help="Report what would change without writing.")
+    compact.add_argument("--concurrency", type=int, default=COMPACT_CONCURRENCY)
+    compact.add_argument("--page-size", type=int, default=COMPACT_PAGE_SIZE)
+    args = parser.parse_args(argv)
+
+    report = compact_profiles(dry_run=args.dry_run, concurrency=args.concurrency, page_size=args.page_size)
+    print(json.dumps(report.as_dict(), indent=2, ensure_ascii=False), file=sys.stderr)
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
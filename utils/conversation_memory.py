@@ -0,0 +1,431 @@
+"""
+Bounded per-session conversation memory with a rolling summary.
+
+Each (user, session) keeps its last `MEMORY_RECENT_TURNS` turns verbatim
+(every message clipped to `MEMORY_MESSAGE_TOKENS`) plus a summary of
+everything older, itself held under `MEMORY_SUMMARY_TOKENS`.  When a turn
+falls out of the recent window it is queued for summarisation, and a
+background thread folds the queue into the summary with one model call,
+so the request path never waits on it.  The rendered context therefore
+has a fixed upper size however long the conversation runs.
+
+Sessions live in an in-process LRU in front of a Cosmos document per
+session (container `AZURE_COSMOS_CONVERSATIONS`, see `utils.cosmos`).
+Cached sessions are re-read after `MEMORY_CACHE_TTL` seconds so a
+conversation that moves between workers picks up their turns.  Writes
+replace the document conditioned on its `_etag`; when another worker got
+there first the document is re-read, the change re-applied and the write
+retried, so no turn is lost.  Documents carry a `ttl` of
+`MEMORY_DOCUMENT_TTL` seconds (the container needs TTL enabled).
+
+A session's version is its document `_etag`, which callers use, like a
+profile `_etag`, to key cached responses.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from cosmos_profile import PATCH_MAX_ATTEMPTS, backoff
+from utils import cosmos
+from utils.metrics import COSMOS_RETRIES, REGISTRY, STAGE_ERRORS, cosmos_call, span
+from utils.prompt_context import clip_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "6"))
+MEMORY_MESSAGE_TOKENS = int(os.getenv("MEMORY_MESSAGE_TOKENS", "120"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", "5000"))
+MEMORY_CACHE_TTL = float(os.getenv("MEMORY_CACHE_TTL", "60"))
+# Turns waiting for the summariser beyond this are dropped, oldest first.
+MEMORY_MAX_UNSUMMARIZED = int(os.getenv("MEMORY_MAX_UNSUMMARIZED", str(4 * MEMORY_RECENT_TURNS)))
+MEMORY_PERSIST = os.getenv("MEMORY_PERSIST", "1") != "0"
+# Seconds an untouched conversation document lives in Cosmos; 0 keeps it forever.
+MEMORY_DOCUMENT_TTL = int(os.getenv("MEMORY_DOCUMENT_TTL", str(30 * 24 * 3600)))
+
+DEFAULT_SESSION = "default"
+
+# Summarizer: prompt text in, summary text out.
+Summarizer = Callable[[str], str]
+Turn = List[str]  # [user message, assistant reply]
+T = TypeVar("T")
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant "
+    "that builds the user's professional profile. Update the summary with the new turns. "
+    "Keep facts the user shared, decisions made and open questions; drop pleasantries. "
+    "Answer with the updated summary only, in at most {words} words."
+)
+
+_UNSAFE_ID_CHARS = re.compile(r"[/\\?#]")
+
+
+def document_id(user_id: str, session_id: str) -> str:
+    return _UNSAFE_ID_CHARS.sub("_", f"{user_id}:{session_id}")
+
+
+def _container():
+    return cosmos.get_container(cosmos.CONVERSATIONS_CONTAINER_NAME)
+
+
+class Session:
+    """Memory of one conversation: rolling summary, recent turns and turns awaiting summarisation."""
+
+    def __init__(
+        self,
+        user_id: str,
+        session_id: str,
+        summary: str = "",
+        turns: Optional[List[Turn]] = None,
+        unsummarized: Optional[List[Turn]] = None,
+        etag: Optional[str] = None,
+    ):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.summary = summary
+        self.turns = turns or []
+        self.unsummarized = unsummarized or []
+        # `_etag` of the stored document this state matches; None if never stored.
+        self.etag = etag
+        # Local change count, the version of sessions that are not persisted.
+        self.revision = 0
+        # Held across a read-modify-write so one worker's writes to a session never race each other.
+        self.write_lock = threading.Lock()
+
+    @classmethod
+    def from_document(cls, doc: dict) -> "Session":
+        session = cls(doc["user_id"], doc["session_id"])
+        session.load(doc)
+        return session
+
+    def load(self, doc: Optional[dict]) -> None:
+        """Replace the state with the stored document (`None`: the document does not exist)."""
+        doc = doc or {}
+        self.summary = doc.get("summary", "")
+        self.turns = [list(t) for t in doc.get("turns", [])]
+        self.unsummarized = [list(t) for t in doc.get("unsummarized", [])]
+        self.etag = doc.get("_etag")
+
+    def to_document(self, ttl: int = 0) -> dict:
+        doc = {
+            "id": document_id(self.user_id, self.session_id),
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "summary": self.summary,
+            "turns": [list(t) for t in self.turns],
+            "unsummarized": [list(t) for t in self.unsummarized],
+        }
+        if ttl > 0:
+            doc["ttl"] = ttl
+        return doc
+
+    @property
+    def empty(self) -> bool:
+        return not (self.summary or self.turns or self.unsummarized)
+
+    def render(self) -> str:
+        """The conversation context for the prompt."""
+        if not self.summary and not self.turns:
+            return "(new conversation)"
+        lines = []
+        if self.summary:
+            lines.append(f"Summary of earlier turns: {self.summary}")
+        for user, assistant in self.turns:
+            lines.append(f"User: {user}")
+            lines.append(f"Assistant: {assistant}")
+        return "\n".join(lines)
+
+
+def summary_prompt(summary: str, turns: List[Turn], summary_tokens: int = MEMORY_SUMMARY_TOKENS) -> str:
+    lines = [SUMMARY_INSTRUCTIONS.format(words=max(20, summary_tokens * 3 // 4)), ""]
+    lines.append(f"Current summary: {summary or '(none)'}")
+    lines.append("New turns:")
+    for user, assistant in turns:
+        lines.append(f"User: {user}")
+        lines.append(f"Assistant: {assistant}")
+    return "\n".join(lines)
+
+
+def fallback_summary(summary: str, turns: List[Turn], summary_tokens: int = MEMORY_SUMMARY_TOKENS) -> str:
+    """Extractive summary used when no summariser is set or it fails: the newest user messages that fit."""
+    parts = ([summary] if summary else []) + [f"User said: {user}" for user, _ in turns]
+    while len(parts) > 1 and count_tokens(" ".join(parts)) > summary_tokens:
+        parts.pop(0)
+    return clip_tokens(" ".join(parts), summary_tokens)
+
+
+class ConversationMemory:
+    """
+    LRU of sessions backed by Cosmos, with background summarisation.
+
+    Args:
+        recent_turns: Turns kept verbatim.
+        summary_tokens: Token budget of the rolling summary.
+        message_tokens: Each stored message is clipped to this many tokens.
+        maxsize: Sessions kept in memory.
+        ttl: Seconds before a cached session is re-read from Cosmos.
+        persist: Store sessions in Cosmos; in-memory only when False.
+        document_ttl: `ttl` of the stored documents, in seconds; 0 for none.
+        summarizer: Model call used to fold old turns into the summary.
+        clock: Time source, for tests.
+    """
+
+    def __init__(
+        self,
+        recent_turns: int = MEMORY_RECENT_TURNS,
+        summary_tokens: int = MEMORY_SUMMARY_TOKENS,
+        message_tokens: int = MEMORY_MESSAGE_TOKENS,
+        maxsize: int = MEMORY_CACHE_SIZE,
+        ttl: float = MEMORY_CACHE_TTL,
+        persist: bool = MEMORY_PERSIST,
+        document_ttl: int = MEMORY_DOCUMENT_TTL,
+        summarizer: Optional[Summarizer] = None,
+        clock=time.monotonic,
+    ):
+        self.recent_turns = recent_turns
+        self.summary_tokens = summary_tokens
+        self.message_tokens = message_tokens
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist = persist
+        self.document_ttl = document_ttl
+        self.summarizer = summarizer
+        self._clock = clock
+        self._sessions: "OrderedDict[str, Tuple[Session, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._folding: Dict[str, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.folds = 0
+
+    def set_summarizer(self, summarizer: Optional[Summarizer]) -> None:
+        self.summarizer = summarizer
+
+    def _read(self, doc_id: str) -> Optional[dict]:
+        """The stored document, or None if there is none."""
+        with span("memory_read"):
+            try:
+                return cosmos_call("read_item", _container().read_item, item=doc_id, partition_key=doc_id)
+            except exceptions.CosmosResourceNotFoundError:
+                return None
+
+    def _store(self, doc: dict, etag: Optional[str]) -> dict:
+        container = _container()
+        if etag is None:
+            return cosmos_call("create_item", container.create_item, doc)
+        return cosmos_call(
+            "replace_item",
+            container.replace_item,
+            item=doc["id"],
+            body=doc,
+            etag=etag,
+            match_condition=MatchConditions.IfNotModified,
+        )
+
+    def _write(self, session: Session, change: Callable[[Session], T]) -> Tuple[T, Optional[str]]:
+        """
+        Apply `change` to `session` and store it, conditioned on the session's `_etag`.
+
+        If another worker wrote the document since it was read (HTTP 412, or
+        409 for a new one) the session is reloaded, `change` re-applied to
+        it and the write retried with backoff.  Returns what `change`
+        returned and the session's new version.
+        """
+        with session.write_lock:
+            for attempt in range(PATCH_MAX_ATTEMPTS):
+                with self._lock:
+                    result = change(session)
+                    session.revision += 1
+                    doc, etag = session.to_document(self.document_ttl), session.etag
+                if not self.persist:
+                    return result, self._version(session)
+                try:
+                    stored = self._store(doc, etag)
+                except (
+                    exceptions.CosmosAccessConditionFailedError,
+                    exceptions.CosmosResourceExistsError,
+                    exceptions.CosmosResourceNotFoundError,
+                ):
+                    COSMOS_RETRIES.inc(operation="replace_item", reason="precondition_failed")
+                    backoff(attempt)
+                    try:
+                        fresh = self._read(doc["id"])
+                    except Exception as e:
+                        logger.error("Failed to reload conversation %s: %s", doc["id"], e)
+                        break
+                    with self._lock:
+                        session.load(fresh)
+                    continue
+                except Exception as e:
+                    logger.error("Failed to save conversation %s: %s", doc["id"], e)
+                    break
+                with self._lock:
+                    session.etag = stored["_etag"]
+                    return result, self._version(session)
+            else:
+                logger.error("Conversation %s was modified concurrently %d times; giving up", doc["id"], PATCH_MAX_ATTEMPTS)
+            with self._lock:
+                # The state no longer matches any stored document: it has no version
+                # until the next write, which creates or conflicts and reloads.
+                session.etag = None
+                return result, None
+
+    def _version(self, session: Session) -> Optional[str]:
+        """The session's `_etag`; a process-local change count when nothing is persisted."""
+        if not self.persist:
+            return f"{os.getpid()}:{session.revision}"
+        if session.etag:
+            return session.etag
+        return "new" if session.empty else None
+
+    def _session(self, user_id: str, session_id: str) -> Session:
+        """The live session object; callers hold no lock and must take `_lock` to mutate it."""
+        key = document_id(user_id, session_id)
+        now = self._clock()
+        with self._lock:
+            found = self._sessions.get(key)
+            if found is not None and (found[1] > now or key in self._folding):
+                self._sessions.move_to_end(key)
+                return found[0]
+        # A stale cached session is refreshed in place, so running writes keep their object.
+        session = found[0] if found is not None else Session(user_id, session_id)
+        if self.persist:
+            with session.write_lock:
+                try:
+                    doc = self._read(key)
+                except Exception as e:
+                    logger.error("Failed to load conversation %s/%s: %s", user_id, session_id, e)
+                else:
+                    with self._lock:
+                        session.load(doc)
+        with self._lock:
+            found = self._sessions.get(key)
+            if found is not None and found[0] is not session:
+                session = found[0]  # another thread cached it first
+            self._sessions[key] = (session, now + self.ttl)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return session
+
+    def context(self, user_id: str, session_id: str = DEFAULT_SESSION) -> Tuple[str, Optional[str]]:
+        """The rendered conversation context and the session version it reflects (None: do not cache)."""
+        session = self._session(user_id, session_id)
+        with self._lock:
+            return session.render(), self._version(session)
+
+    def record(self, user_id: str, session_id: str, user_message: str, reply: str) -> Optional[str]:
+        """Append a turn; returns the new session version."""
+        turn = [clip_tokens(user_message, self.message_tokens), clip_tokens(reply, self.message_tokens)]
+
+        def append(session: Session) -> int:
+            session.turns.append(list(turn))
+            overflow = len(session.turns) - self.recent_turns
+            if overflow > 0:
+                session.unsummarized.extend(session.turns[:overflow])
+                del session.turns[:overflow]
+                dropped = len(session.unsummarized) - MEMORY_MAX_UNSUMMARIZED
+                if dropped > 0:
+                    logger.warning("Summariser behind for %s/%s; dropping %d turns", user_id, session_id, dropped)
+                    del session.unsummarized[:dropped]
+            return overflow
+
+        overflow, version = self._write(self._session(user_id, session_id), append)
+        if overflow > 0:
+            self._schedule(user_id, session_id)
+        return version
+
+    def _schedule(self, user_id: str, session_id: str) -> None:
+        key = document_id(user_id, session_id)
+        with self._lock:
+            if key in self._folding:
+                return  # the running fold picks up the new turns
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+            self._folding[key] = self._executor.submit(self._fold, key, user_id, session_id)
+
+    def _summarize(self, summary: str, turns: List[Turn]) -> str:
+        if self.summarizer is not None:
+            try:
+                with span("memory_summarize"):
+                    text = self.summarizer(summary_prompt(summary, turns, self.summary_tokens)).strip()
+                if text:
+                    return clip_tokens(text, self.summary_tokens)
+            except Exception as e:
+                STAGE_ERRORS.inc(stage="memory_summarize")
+                logger.error("Conversation summary failed, keeping an extractive one: %s", e)
+        return fallback_summary(summary, turns, self.summary_tokens)
+
+    def _fold(self, key: str, user_id: str, session_id: str) -> None:
+        try:
+            while True:
+                with self._lock:
+                    session = self._sessions.get(key, (None,))[0]
+                    if session is None or not session.unsummarized:
+                        # Cleared under the same lock `_schedule` checks, so no turn is missed.
+                        self._folding.pop(key, None)
+                        return
+                    summary, batch = session.summary, [list(t) for t in session.unsummarized]
+                new_summary = self._summarize(summary, batch)
+
+                def fold(session: Session) -> None:
+                    # Turns may have been dropped meanwhile; only remove what was folded.
+                    if session.unsummarized[:len(batch)] == batch:
+                        del session.unsummarized[:len(batch)]
+                    session.summary = new_summary
+
+                self._write(session, fold)
+                with self._lock:
+                    self.folds += 1
+        except Exception:
+            with self._lock:
+                self._folding.pop(key, None)
+            raise
+
+    def drain(self, timeout: Optional[float] = None) -> None:
+        """Wait for scheduled summaries to finish (for tests and shutdown)."""
+        while True:
+            with self._lock:
+                pending = list(self._folding.values())
+            if not pending:
+                return
+            for future in pending:
+                future.result(timeout=timeout)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+
+
+_default_memory: Optional[ConversationMemory] = None
+_default_lock = threading.Lock()
+
+
+def get_conversation_memory() -> ConversationMemory:
+    """Return the process-wide memory configured from the environment."""
+    global _default_memory
+    if _default_memory is None:
+        with _default_lock:
+            if _default_memory is None:
+                _default_memory = ConversationMemory()
+    return _default_memory
+
+
+def _collect_stats():
+    if _default_memory is None:
+        return []
+    return [
+        ("zil_memory_sessions", "gauge", "Conversation sessions held in memory.", {}, len(_default_memory._sessions)),
+        ("zil_memory_summaries_total", "counter", "Rolling summary updates.", {}, _default_memory.folds),
+    ]
+
+
+REGISTRY.add_collector(_collect_stats)
@@ -0,0 +1,122 @@
+"""
+Shared Cosmos DB access: one pooled client per process and cached container handles.
+
+Every module that talks to Cosmos (`cosmos_profile`, `utils.dbutils`) goes
+through here, so reads and writes hit the same database and container and
+share one connection pool instead of each building its own client.
+
+Configuration (environment):
+
+- `AZURE_COSMOS_URL`, `AZURE_COSMOS_KEY`: the account (required on first use);
+- `AZURE_COSMOS_DATABASE`, `AZURE_COSMOS_PROFILES`: database and profiles
+  container names (default `zil_ai` / `profiles`);
+- `AZURE_COSMOS_PENDING_QUESTIONS`: container of the per-user pending
+  question queues (default `pending_questions`, partitioned on `/id`);
+- `AZURE_COSMOS_CONVERSATIONS`: container of the conversation memories
+  (default `conversations`, partitioned on `/id`, with TTL enabled so the
+  documents' `ttl` expires idle conversations);
+- `COSMOS_CONNECTION_TIMEOUT`, `COSMOS_READ_TIMEOUT`: per-request timeouts
+  in seconds;
+- `COSMOS_ASYNC_POOL_SIZE`: connection limit of the async client.  The sync
+  client uses the shared HTTP session (see `utils.http_session`).
+
+Clients are created on first use, never at import: constructing one
+contacts the account, which should neither slow down imports nor crash a
+worker at startup.
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+from azure.cosmos import CosmosClient
+from dotenv import load_dotenv
+
+from utils.http_session import get_session
+
+load_dotenv()  # Load environment variables from .env file
+COSMOS_URL = os.getenv("AZURE_COSMOS_URL")
+COSMOS_KEY = os.getenv("AZURE_COSMOS_KEY")
+
+DATABASE_NAME = os.getenv("AZURE_COSMOS_DATABASE", "zil_ai")
+CONTAINER_NAME = os.getenv("AZURE_COSMOS_PROFILES", "profiles")
+PENDING_QUESTIONS_CONTAINER_NAME = os.getenv("AZURE_COSMOS_PENDING_QUESTIONS", "pending_questions")
+CONVERSATIONS_CONTAINER_NAME = os.getenv("AZURE_COSMOS_CONVERSATIONS", "conversations")
+
+COSMOS_CONNECTION_TIMEOUT = int(os.getenv("COSMOS_CONNECTION_TIMEOUT", "5"))
+COSMOS_READ_TIMEOUT = int(os.getenv("COSMOS_READ_TIMEOUT", "30"))
+COSMOS_ASYNC_POOL_SIZE = int(os.getenv("COSMOS_ASYNC_POOL_SIZE", "100"))
+
+_client: Optional[CosmosClient] = None
+_containers: Dict[str, object] = {}
+_lock = threading.Lock()
+# The async client is bound to the event loop it is first used on, so it is
+# created lazily from inside the ASGI worker's loop.
+_async_client = None
+_async_containers: Dict[str, object] = {}
+
+
+def _credentials():
+    if not COSMOS_URL:
+        raise ValueError("Missing environment variable: AZURE_COSMOS_URL")
+    if not COSMOS_KEY:
+        raise ValueError("Missing environment variable: AZURE_COSMOS_KEY")
+    return COSMOS_URL, COSMOS_KEY
+
+
+def get_client() -> CosmosClient:
+    """Return the process-wide Cosmos client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from azure.core.pipeline.transport import RequestsTransport
+
+                url, key = _credentials()
+                _client = CosmosClient(
+                    url,
+                    credential=key,
+                    transport=RequestsTransport(session=get_session(), session_owner=False),
+                    connection_timeout=COSMOS_CONNECTION_TIMEOUT,
+                    read_timeout=COSMOS_READ_TIMEOUT,
+                )
+    return _client
+
+
+def get_container(name: str = CONTAINER_NAME):
+    """Return a cached handle to container `name` (the profiles container by default)."""
+    container = _containers.get(name)
+    if container is None:
+        container = get_client().get_database_client(DATABASE_NAME).get_container_client(name)
+        with _lock:
+            container = _containers.setdefault(name, container)
+    return container
+
+
+def get_async_client():
+    """Return the async Cosmos client; must be called from the event loop it will serve."""
+    global _async_client
+    if _async_client is None:
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+        from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+
+        url, key = _credentials()
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=COSMOS_ASYNC_POOL_SIZE))
+        _async_client = AsyncCosmosClient(
+            url,
+            credential=key,
+            transport=AioHttpTransport(session=session, session_owner=False),
+            connection_timeout=COSMOS_CONNECTION_TIMEOUT,
+            read_timeout=COSMOS_READ_TIMEOUT,
+        )
+    return _async_client
+
+
+def get_async_container(name: str = CONTAINER_NAME):
+    """Async counterpart of `get_container`."""
+    container = _async_containers.get(name)
+    if container is None:
+        container = get_async_client().get_database_client(DATABASE_NAME).get_container_client(name)
+        _async_containers[name] = container
+    return container
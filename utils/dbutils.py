@@ -1,31 +1,78 @@
-from azure.cosmos import CosmosClient, exceptions
-import os
+import asyncio
+import logging
 
-url = os.getenv("AZURE_COSMOS_URL") != None and os.getenv("AZURE_COSMOS_URL") or "localhost:8081"
-key = os.getenv("AZURE_COSMOS_KEY") != None and os.getenv("AZURE_COSMOS_KEY") or "your_default_key"
+from azure.cosmos import exceptions
 
-client = CosmosClient(url, credential=key)
+from cosmos_profile import ProfileChange, patch_profile
+from utils import cosmos
+from utils.metrics import acosmos_call, cosmos_call, span
 
+logger = logging.getLogger(__name__)
+
+
+def _profiles_container():
+    return cosmos.get_container()
+
+
+def _async_profiles_container():
+    return cosmos.get_async_container()
 
 
 def get_user_profile(user_id: str) -> dict:
     try:
         # Existing logic
-        container = client.get_database_client("AZURE_COSMOS_DATABASE").get_container_client("AZURE_COSMOS_PROFILES")
-        response = container.read_item(user_id, partition_key=user_id)
+        container = _profiles_container()
+        with span("profile_read"):
+            response = cosmos_call("read_item", container.read_item, user_id, partition_key=user_id)
         return response
     except Exception as e:
-        print(f"[ERROR] Failed to load user profile for {user_id}: {e}")
+        logger.error("Failed to load user profile for %s: %s", user_id, e)
         return {}
 
 def upsert_user_profile(user_id: str, profile_data: dict) -> None:
-    container = client.get_database_client("AZURE_COSMOS_DATABASE").get_container_client("AZURE_COSMOS_PROFILES")
-    existing_profile = get_user_profile(user_id)
-    if not existing_profile:
-        print(f"[INFO] No existing profile found for {user_id}, creating a new one.")
+    """
+    Merge `profile_data` into the stored profile, creating it if missing.
+
+    A missing profile is created from `profile_data` alone with one
+    `create_item`.  An existing one gets the top-level keys as `set`
+    changes through `cosmos_profile.patch_profile`, against the document
+    just read: only changed fields are sent and every patch request is
+    conditioned on the profile's ETag, so a concurrent writer is never
+    overwritten.  More than `cosmos_profile.MAX_PATCH_OPERATIONS` changed
+    fields take several requests, and a reader can see the merge half done
+    in between.
+    """
     profile_data["user_id"] = user_id
-    if existing_profile:
-        existing_profile.update(profile_data)
-    else:
-        existing_profile = profile_data
-    container.upsert_item(existing_profile)
\ No newline at end of file
+    container = _profiles_container()
+    try:
+        with span("profile_read"):
+            profile = cosmos_call("read_item", container.read_item, user_id, partition_key=user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        try:
+            cosmos_call("create_item", container.create_item, dict(profile_data, id=user_id))
+            return
+        except exceptions.CosmosResourceExistsError:
+            # Created concurrently; merge into it.
+            profile = None
+    changes = [
+        ProfileChange("set", field, value)
+        for field, value in profile_data.items()
+        if field != "id" and not field.startswith("_")
+    ]
+    patch_profile(user_id, changes, profile)
+
+
+async def aget_user_profile(user_id: str) -> dict:
+    """Async counterpart of `get_user_profile` for the ASGI app."""
+    try:
+        container = _async_profiles_container()
+        with span("profile_read"):
+            return await acosmos_call("read_item", container.read_item, user_id, partition_key=user_id)
+    except Exception as e:
+        logger.error("Failed to load user profile for %s: %s", user_id, e)
+        return {}
+
+
+async def aupsert_user_profile(user_id: str, profile_data: dict) -> None:
+    """Async counterpart of `upsert_user_profile` for the ASGI app; the conditioned write runs off the loop."""
+    await asyncio.to_thread(upsert_user_profile, user_id, profile_data)
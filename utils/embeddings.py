@@ -0,0 +1,372 @@
+"""
+Embedding service with caching and request micro-batching.
+
+`EmbeddingService` sits in front of a LangChain embedder.  A lookup goes
+through three layers:
+
+1. a bounded in-memory LRU of vectors, keyed by a hash of the text;
+2. `DiskVectorStore`, a persistent store of float32 vectors that every
+   worker on the machine memory-maps and appends to;
+3. `MicroBatcher`, which holds concurrent misses for a few milliseconds
+   and sends them to the embedder as one `embed_documents` call.
+
+Keys include a namespace (the embedding deployment) so vectors from
+different models never mix.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.metrics import REGISTRY
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(tempfile.gettempdir(), "zil-embeddings"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+_DIGEST_SIZE = 32  # sha256
+
+
+def embedding_key(text: str, namespace: str = "") -> bytes:
+    """Content hash identifying `text` embedded by the model named `namespace`."""
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).digest()
+
+
+class LRUVectorCache:
+    """Thread-safe bounded LRU mapping keys to vectors."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            return vector
+
+    def put(self, key: bytes, vector: np.ndarray) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class DiskVectorStore:
+    """
+    Append-only, memory-mapped store of float32 vectors shared by workers.
+
+    `vectors.f32` holds one row of `dim` float32 values per entry and
+    `keys.bin` the matching 32-byte keys, in the same order.  Appends take
+    an exclusive `flock` and write the vector before its key, so a reader
+    that sees a key can always read its row.  Readers pick up rows added
+    by other processes by re-mapping when the files grow.
+    """
+
+    def __init__(self, path: str, dim: Optional[int] = None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._keys_path = os.path.join(path, "keys.bin")
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._meta_path = os.path.join(path, "meta.json")
+        self._lock_path = os.path.join(path, ".lock")
+        self._index: Dict[bytes, int] = {}
+        self._indexed_bytes = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.dim = dim
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                stored = json.load(f)["dim"]
+            if dim is not None and stored != dim:
+                raise ValueError(f"{path} holds {stored}-d vectors, not {dim}-d")
+            self.dim = stored
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._index)
+
+    def _refresh(self) -> None:
+        try:
+            size = os.path.getsize(self._keys_path)
+        except FileNotFoundError:
+            return
+        size -= size % _DIGEST_SIZE
+        if size == self._indexed_bytes:
+            return
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._indexed_bytes)
+            data = f.read(size - self._indexed_bytes)
+        row = self._indexed_bytes // _DIGEST_SIZE
+        for offset in range(0, len(data), _DIGEST_SIZE):
+            self._index.setdefault(data[offset:offset + _DIGEST_SIZE], row)
+            row += 1
+        self._indexed_bytes = size
+        self._matrix = None
+
+    def _rows(self) -> np.ndarray:
+        if self._matrix is None or self._matrix.shape[0] < self._indexed_bytes // _DIGEST_SIZE:
+            rows = os.path.getsize(self._vectors_path) // (4 * self.dim)
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            self._refresh()
+            if not self._index:
+                return [None] * len(keys)
+            found = [self._index.get(key) for key in keys]
+            if all(row is None for row in found):
+                return [None] * len(keys)
+            matrix = self._rows()
+            return [None if row is None else np.array(matrix[row]) for row in found]
+
+    def put_many(self, keys: Sequence[bytes], vectors: Sequence[np.ndarray]) -> None:
+        if not keys:
+            return
+        block = np.asarray(vectors, dtype=np.float32)
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.dim is None:
+                    self.dim = block.shape[1]
+                    with open(self._meta_path, "w") as f:
+                        json.dump({"dim": self.dim}, f)
+                if block.shape[1] != self.dim:
+                    raise ValueError(f"Expected {self.dim}-d vectors, got {block.shape[1]}-d")
+                self._refresh()
+                # A key repeated in `keys` is written once, at its first position.
+                first: Dict[bytes, int] = {}
+                for i, key in enumerate(keys):
+                    if key not in self._index:
+                        first.setdefault(key, i)
+                fresh = list(first.values())
+                if not fresh:
+                    return
+                # Rows on disk, counted from the key file: older stores may hold
+                # duplicate keys, so this can exceed the number of indexed keys.
+                # Another process may have left a torn write behind; align to whole rows/keys.
+                rows = self._indexed_bytes // _DIGEST_SIZE
+                with open(self._vectors_path, "ab") as f:
+                    f.truncate(rows * 4 * self.dim)
+                    f.write(block[fresh].tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self._keys_path, "ab") as f:
+                    f.truncate(rows * _DIGEST_SIZE)
+                    f.write(b"".join(keys[i] for i in fresh))
+                self._refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-text requests into batched calls.
+
+    The first request opens a batch; the worker thread waits up to
+    `max_wait_ms` (or until `max_batch` texts are queued) and then calls
+    `embed_documents` once for the whole batch, resolving each caller's
+    future with its own vector.
+    """
+
+    def __init__(self, embed_documents: Callable[[List[str]], List[List[float]]], max_batch: int, max_wait_ms: float):
+        self.embed_documents = embed_documents
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.batched_texts = 0
+        self._pending: List[tuple] = []
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+
+    def submit(self, text: str) -> "Future[np.ndarray]":
+        future: "Future[np.ndarray]" = Future()
+        with self._cond:
+            self._pending.append((text, future))
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return future
+
+    def _take_batch(self) -> List[tuple]:
+        with self._cond:
+            while not self._pending:
+                if not self._cond.wait(timeout=30) and not self._pending:
+                    # Idle: let the thread exit; submit() restarts it.
+                    self._worker = None
+                    return []
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=remaining)
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = self.embed_documents(texts)
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.batched_texts += len(texts)
+            by_text = {text: np.asarray(vector, dtype=np.float32) for text, vector in zip(texts, vectors)}
+            for text, future in batch:
+                future.set_result(by_text[text])
+
+
+class EmbeddingService:
+    """
+    Cached, batched access to an embedder.
+
+    Args:
+        embedder: Any LangChain `Embeddings` (needs `embed_documents`).
+        namespace: Identifies the model; part of every cache key.
+        cache_size: Maximum vectors held in the in-memory LRU.
+        store_path: Directory of the shared on-disk store, or None to disable it.
+        max_batch: Maximum texts per `embed_documents` call.
+        max_wait_ms: How long the batcher waits for more texts.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        namespace: str = "",
+        cache_size: int = EMBEDDING_CACHE_SIZE,
+        store_path: Optional[str] = EMBEDDING_CACHE_DIR,
+        max_batch: int = EMBEDDING_BATCH_SIZE,
+        max_wait_ms: float = EMBEDDING_BATCH_WAIT_MS,
+    ):
+        self.namespace = namespace
+        self.memory = LRUVectorCache(cache_size)
+        self.store = DiskVectorStore(os.path.join(store_path, _safe_dirname(namespace))) if store_path else None
+        self.batcher = MicroBatcher(embedder.embed_documents, max_batch, max_wait_ms)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def embed(self, text: str) -> np.ndarray:
+        """Return the embedding of `text` as a float32 vector."""
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """Return embeddings for `texts`, embedding only those not cached anywhere."""
+        keys = [embedding_key(text, self.namespace) for text in texts]
+        results: List[Optional[np.ndarray]] = [self.memory.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        memory_hits = len(texts) - len(missing)
+
+        disk_hits = 0
+        if missing and self.store is not None:
+            for i, vector in zip(missing, self.store.get_many([keys[i] for i in missing])):
+                if vector is not None:
+                    results[i] = vector
+                    self.memory.put(keys[i], vector)
+                    disk_hits += 1
+            missing = [i for i in missing if results[i] is None]
+
+        if missing:
+            # A text repeated in the call is embedded and stored once.
+            first: Dict[bytes, int] = {}
+            for i in missing:
+                first.setdefault(keys[i], i)
+            futures = {i: self.batcher.submit(texts[i]) for i in first.values()}
+            for i, future in futures.items():
+                results[i] = future.result()
+                self.memory.put(keys[i], results[i])
+            for i in missing:
+                results[i] = results[first[keys[i]]]
+            if self.store is not None:
+                self.store.put_many([keys[i] for i in futures], [results[i] for i in futures])
+
+        with self._stats_lock:
+            self.hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += len(missing)
+        return results  # type: ignore[return-value]
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss and batching counters since the service was created."""
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "batches": self.batcher.batches,
+            "batched_texts": self.batcher.batched_texts,
+            "memory_entries": len(self.memory),
+        }
+
+
+def _safe_dirname(namespace: str) -> str:
+    return hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:16] if namespace else "default"
+
+
+_default_service: Optional[EmbeddingService] = None
+_default_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Return the process-wide service backed by the Azure OpenAI embedding deployment."""
+    global _default_service
+    if _default_service is None:
+        with _default_lock:
+            if _default_service is None:
+                from langchain_community.embeddings import AzureOpenAIEmbeddings
+
+                deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+                embedder = AzureOpenAIEmbeddings(
+                    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                    api_version=os.getenv("AZURE_OPENAI_VERSION"),
+                    azure_deployment=deployment,
+                )
+                _default_service = EmbeddingService(embedder, namespace=deployment or "")
+    return _default_service
+
+
+def _collect_stats():
+    if _default_service is None:
+        return []
+    stats = _default_service.stats()
+    help = "Embedding lookups by where they were answered."
+    return [
+        ("zil_embedding_lookups_total", "counter", help, {"source": "memory"}, stats["hits"]),
+        ("zil_embedding_lookups_total", "counter", help, {"source": "disk"}, stats["disk_hits"]),
+        ("zil_embedding_lookups_total", "counter", help, {"source": "model"}, stats["misses"]),
+        ("zil_embedding_batches_total", "counter", "Embedding requests sent to the model.", {}, stats["batches"]),
+    ]
+
+
+REGISTRY.add_collector(_collect_stats)
@@ -0,0 +1,56 @@
+"""
+Process-wide keep-alive HTTP session.
+
+Outbound HTTPS calls (Entra OpenID discovery and JWKS downloads, and the
+Cosmos DB client's transport) share one `requests.Session`, so repeated
+calls to a host reuse pooled connections instead of paying a TCP and TLS
+handshake each time.
+
+Pool size and timeouts can be tuned with environment variables:
+
+- `HTTP_POOL_CONNECTIONS`: number of hosts to keep pools for;
+- `HTTP_POOL_MAXSIZE`: connections kept per host (roughly the number of
+  threads that call the same host concurrently);
+- `HTTP_CONNECT_TIMEOUT` / `HTTP_READ_TIMEOUT`: default timeouts in seconds.
+"""
+
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+
+# (connect, read) timeout for callers that do not pass their own.
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get(url: str, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """`requests.get` over the shared session."""
+    return get_session().get(url, timeout=timeout, **kwargs)
@@ -0,0 +1,249 @@
+"""
+Deterministic fast path for simple, structured profile edits.
+
+A large share of chat traffic is commands like "Add budgeting, Tableau,
+and Excel to my skills." that need no language model at all.  `route`
+splits a prompt into sentences and parses the ones that are unambiguous
+add / remove / set commands against known profile fields; `apply` runs
+them through `tools.update_profile`.  Everything else is returned as the
+remainder for the model.  A sentence is only routed if the whole sentence
+matches one of the patterns; anything hedged, negated, or phrased as a
+question is left to the model.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+LIST_FIELD_ALIASES = {
+    "skills": "skills",
+    "skill": "skills",
+    "skill set": "skills",
+    "skillset": "skills",
+    "tools": "tools",
+    "tool": "tools",
+    "tooling": "tools",
+    "tech stack": "tools",
+    "strengths": "strengths",
+    "strength": "strengths",
+    "industries": "industries",
+    "industry": "industries",
+}
+STRING_FIELD_ALIASES = {
+    "location": "location",
+    "city": "location",
+    "title": "current_title",
+    "job title": "current_title",
+    "current title": "current_title",
+    "current job title": "current_title",
+    "role": "current_title",
+    "current role": "current_title",
+    "position": "current_title",
+    "company": "current_company",
+    "current company": "current_company",
+    "employer": "current_company",
+    "current employer": "current_company",
+    "headline": "headline",
+    "name": "name",
+    "full name": "name",
+}
+FIELD_LABELS = {
+    "current_title": "title",
+    "current_company": "company",
+}
+
+_POLITE = r"(?:(?:please|pls|can you|could you|kindly)\s+)*"
+_END = r"\s*[.!]*\s*$"
+_ADD = re.compile(
+    rf"^{_POLITE}(?:add|include|put|append)\s+(?P<items>.+?)\s+(?:to|in|into|under|on)\s+(?:my\s+|the\s+)?(?P<field>[a-z ]+?)(?:\s+(?:list|section|field))?{_END}",
+    re.IGNORECASE,
+)
+_REMOVE = re.compile(
+    rf"^{_POLITE}(?:remove|delete|drop|take)\s+(?P<items>.+?)\s+(?:out\s+of|off|from)\s+(?:my\s+|the\s+)?(?P<field>[a-z ]+?)(?:\s+(?:list|section|field))?{_END}",
+    re.IGNORECASE,
+)
+_SET = re.compile(
+    rf"^{_POLITE}(?:set|change|update)\s+(?:my\s+|the\s+)?(?P<field>[a-z ]+?)\s+to\s+(?P<value>.+?){_END}",
+    re.IGNORECASE,
+)
+_LIVE_IN = re.compile(rf"^i(?:\s+now)?\s+(?:live|am based|'m based|am located|'m located)\s+in\s+(?P<value>.+?){_END}", re.IGNORECASE)
+
+# A sentence ends at . ! or ? followed by a capitalised word, or at a line break.
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+(?=[\"'“‘(]?[A-Z])|\s*\n+\s*")
+# A period after one of these doesn't end the sentence ("St. Louis", "Sr. Data Analyst", "J. Smith").
+_ABBREVIATIONS = frozenset({
+    "st", "sr", "jr", "dr", "mr", "mrs", "ms", "mt", "ft", "inc", "ltd", "co", "corp", "dept", "no", "vs", "etc",
+})
+_LAST_WORD = re.compile(r"([A-Za-z]+)\.$")
+_HEDGES = re.compile(
+    r"\b(?:not|no|never|dont|maybe|might|perhaps|probably|if|unless|except|but|or)\b|n't\b",
+    re.IGNORECASE,
+)
+_PRONOUNS = frozenset({"it", "that", "this", "them", "those", "these", "everything", "all", "something", "anything"})
+_ARTICLE = re.compile(r"^(?:a|an|the)\s+", re.IGNORECASE)
+
+MAX_ITEM_WORDS = 6
+MAX_ITEM_CHARS = 60
+MAX_VALUE_CHARS = 100
+
+
+class RoutedCommand(NamedTuple):
+    """A profile edit parsed from the prompt: `tool` is an `update_profile` function name."""
+    tool: str
+    field: str
+    value: str
+
+
+class RouteResult(NamedTuple):
+    commands: List[RoutedCommand]
+    remainder: str
+
+    @property
+    def fully_handled(self) -> bool:
+        return bool(self.commands) and not self.remainder
+
+
+def _clean(value: str) -> str:
+    return value.strip().strip("\"'“”‘’").strip()
+
+
+def _valid_item(item: str, max_chars: int = MAX_ITEM_CHARS) -> bool:
+    return (
+        bool(item)
+        and len(item) <= max_chars
+        and len(item.split()) <= MAX_ITEM_WORDS
+        and item.lower() not in _PRONOUNS
+        and not any(ch in item for ch in "?:;()[]{}")
+    )
+
+
+def _split_items(text: str, field: str) -> Optional[List[str]]:
+    parts = [p for p in re.split(r"\s*,\s*", text) if p]
+    if field != "industries":
+        # "Tableau and Excel"; industry names ("Research and Development") keep their "and".
+        parts = [p for part in parts for p in re.split(r"\s+(?:and|&)\s+", part, flags=re.IGNORECASE)]
+    items = []
+    for part in parts:
+        item = _clean(re.sub(r"^(?:and|&)\s+", "", part, flags=re.IGNORECASE))
+        if not _valid_item(item):
+            return None
+        items.append(item)
+    return items
+
+
+def parse_sentence(sentence: str) -> Optional[List[RoutedCommand]]:
+    """Commands for one sentence, or None if it is not an unambiguous edit."""
+    sentence = sentence.strip()
+    if not sentence or sentence.endswith("?") or _HEDGES.search(sentence):
+        return None
+    for pattern, tool in ((_ADD, "add_to_list_field"), (_REMOVE, "remove_from_list_field")):
+        match = pattern.match(sentence)
+        if match:
+            field = LIST_FIELD_ALIASES.get(match.group("field").lower().strip())
+            if field is None:
+                return None
+            items = _split_items(match.group("items"), field)
+            if not items:
+                return None
+            return [RoutedCommand(tool, field, item) for item in items]
+    match = _SET.match(sentence)
+    if match:
+        field = STRING_FIELD_ALIASES.get(match.group("field").lower().strip())
+        value = _clean(match.group("value"))
+        if field == "current_title":
+            value = _ARTICLE.sub("", value)
+        if field is None or not _valid_item(value, MAX_VALUE_CHARS):
+            return None
+        return [RoutedCommand("set_string_field", field, value)]
+    match = _LIVE_IN.match(sentence)
+    if match:
+        value = _clean(match.group("value"))
+        if not _valid_item(value, MAX_VALUE_CHARS):
+            return None
+        return [RoutedCommand("set_string_field", "location", value)]
+    return None
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of `text`; an abbreviation or initial followed by a period does not end one."""
+    sentences: List[str] = []
+    for part in _SENTENCE_BREAK.split(text.strip()):
+        if sentences:
+            last = _LAST_WORD.search(sentences[-1])
+            if last and (last.group(1).lower() in _ABBREVIATIONS or (len(last.group(1)) == 1 and last.group(1).isupper())):
+                sentences[-1] = f"{sentences[-1]} {part}"
+                continue
+        sentences.append(part)
+    return sentences
+
+
+def route(prompt: str) -> RouteResult:
+    """Split `prompt` into locally applicable commands and the text left for the model."""
+    commands: List[RoutedCommand] = []
+    remainder: List[str] = []
+    for sentence in split_sentences(prompt):
+        parsed = parse_sentence(sentence)
+        if parsed is None:
+            if sentence.strip():
+                remainder.append(sentence.strip())
+        else:
+            commands.extend(parsed)
+    return RouteResult(commands, " ".join(remainder))
+
+
+def apply(user_id: str, commands: List[RoutedCommand]) -> List[str]:
+    """Run `commands` through the profile tools; returns each tool's result (an `update_profile.Edit`)."""
+    # Imported here so routing itself stays free of the Cosmos client.
+    from tools import update_profile
+
+    results = []
+    for command in commands:
+        func = getattr(update_profile, command.tool)
+        if command.tool == "set_string_field":
+            results.append(func(user_id, field_name=command.field, value=command.value))
+        else:
+            results.append(func(user_id, field_name=command.field, item=command.value))
+    return results
+
+
+def _join(values: List[str]) -> str:
+    if len(values) <= 2:
+        return " and ".join(values)
+    return ", ".join(values[:-1]) + " and " + values[-1]
+
+
+def summarize(commands: List[RoutedCommand], results: Optional[List[str]] = None) -> str:
+    """
+    A short confirmation of `commands` for the user.
+
+    Given `results` (what `apply` returned) it reports what the tools did:
+    the values as written, and the edits that left the profile as it was.
+    Without them, or for a result that is only a message, it describes the
+    command as parsed.
+    """
+    grouped: Dict[tuple, List[str]] = {}
+    for i, command in enumerate(commands):
+        result = results[i] if results is not None else None
+        value = getattr(result, "value", command.value)
+        changed = getattr(result, "changed", True)
+        grouped.setdefault((command.tool, command.field, changed), []).append(value)
+    sentences = []
+    for (tool, field, changed), values in grouped.items():
+        label = FIELD_LABELS.get(field, field.replace("_", " "))
+        one = len(values) == 1
+        if tool == "add_to_list_field":
+            if changed:
+                sentences.append(f"Added {_join(values)} to your {label}.")
+            else:
+                sentences.append(f"{_join(values)} {'is' if one else 'are'} already in your {label}.")
+        elif tool == "remove_from_list_field":
+            if changed:
+                sentences.append(f"Removed {_join(values)} from your {label}.")
+            else:
+                sentences.append(f"{_join(values)} {'was' if one else 'were'} not in your {label}.")
+        elif changed:
+            sentences.append(f"Updated your {label} to {values[-1]}.")
+        else:
+            sentences.append(f"Your {label} is already {values[-1]}.")
+    return " ".join(sentences)
@@ -0,0 +1,548 @@
+"""
+Matching jobs to profiles.
+
+Profiles carry job preferences (`job_titles`, `required_skills`,
+`must_have_keywords`, `excluded_keywords`, `locations`, `industries`)
+next to what the agent extracted (`skills`, `tools`, `current_title`,
+`location`).  `MatchIndex` keeps an in-memory inverted index from
+normalised terms to the users whose profile contains them, per facet:
+
+- title: the words of `job_titles` and `current_title`
+- skill: `skills`, `tools`, `required_skills` and `certifications`
+- location: `locations` and `location`, whole and split at commas
+- industry: `industries`
+- must_have / excluded: `must_have_keywords` / `excluded_keywords`
+
+Skill and industry terms are the canonical names of
+`utils.canonical_terms` ("ms excel" is indexed and matched as "excel"),
+in profiles and in job text alike.  Only exact aliases are mapped.
+
+A job (title, skills, location, industry, description) is scored against
+every user at once.  For each facet, each job term adds its IDF to the
+users listed under it; that is one NumPy scatter-add per term.  The sum
+is divided by the job's total IDF for the facet, so it is the share of
+what the job asks for that the user has, and weighted by
+`FACET_WEIGHTS`.  Users are then filtered out if the job text contains
+one of their excluded keywords or lacks one of their must-have keywords.
+Job text is looked up as phrases of up to `MAX_TERM_WORDS` words; longer
+keywords are searched for in the whole normalised text instead.
+The top k of the rest are returned.  The cost grows with the job's terms
+and the users listed under them, not with the number of profiles.
+
+The index is built from the profiles container on first use.  Writes
+made through `tools.update_profile` in this worker are applied at once
+by `on_profile_change`, for users already in the index; profiles created
+through `/create-user` are added whole by `add`.  Writes from other
+workers, other new profiles and bulk imports show up when the index is
+rebuilt in the background; that happens once it is older than
+`MATCH_INDEX_TTL` seconds.
+
+With 50,000 synthetic profiles (`python -m bench.match`) the index builds
+in about 3.3 s.  A top-10 match takes 2.3 ms at the median and 3.5 ms at
+p99, and an incremental update takes about 0.06 ms.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from cosmos_profile import ProfileChange
+from utils.canonical_terms import INDUSTRY_TERMS, TECH_TERMS, AliasTable
+from utils.metrics import REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+MATCH_TOP_K = int(os.getenv("MATCH_TOP_K", "10"))
+MATCH_INDEX_TTL = float(os.getenv("MATCH_INDEX_TTL", "300"))
+MATCH_LOAD_PAGE_SIZE = int(os.getenv("MATCH_LOAD_PAGE_SIZE", "1000"))
+
+# Profile field -> facet it is indexed under.
+MATCH_FIELDS = {
+    "job_titles": "title",
+    "current_title": "title",
+    "skills": "skill",
+    "tools": "skill",
+    "required_skills": "skill",
+    "certifications": "skill",
+    "locations": "location",
+    "location": "location",
+    "industries": "industry",
+    "must_have_keywords": "must_have",
+    "excluded_keywords": "excluded",
+}
+FACETS = ("title", "skill", "location", "industry", "must_have", "excluded")
+FACET_WEIGHTS = {"skill": 0.5, "title": 0.3, "location": 0.1, "industry": 0.1}
+
+# Longest keyword or skill phrase found in free text ("google cloud platform").
+MAX_TERM_WORDS = 3
+TITLE_STOPWORDS = frozenset({"a", "an", "and", "at", "for", "in", "of", "on", "the", "to", "with"})
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9+#]+)*")
+
+Terms = Dict[str, FrozenSet[str]]
+
+
+def tokens(text: Any) -> List[str]:
+    return _TOKEN.findall(str(text).casefold())
+
+
+def normalize_term(text: Any) -> str:
+    """Lower-cased words of `text` joined by single spaces ("Node.js, C++" -> "node.js c++")."""
+    return " ".join(tokens(text))
+
+
+def _values(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [item for item in value if isinstance(item, str)]
+    return []
+
+
+def _term_aliases(table: AliasTable) -> Dict[str, str]:
+    aliases: Dict[str, str] = {}
+    for alias, name in table.names.items():
+        aliases.setdefault(normalize_term(alias), normalize_term(name))
+    return aliases
+
+
+# Normalised alias -> normalised canonical name, for the facets that have one.
+FACET_ALIASES = {"skill": _term_aliases(TECH_TERMS), "industry": _term_aliases(INDUSTRY_TERMS)}
+
+
+def _phrases(value: Any, aliases: Optional[Dict[str, str]] = None) -> set:
+    terms = map(normalize_term, _values(value))
+    if aliases:
+        return {aliases.get(term, term) for term in terms if term}
+    return {term for term in terms if term}
+
+
+def _places(value: Any) -> set:
+    # "Toronto, ON" is indexed as "toronto on", "toronto" and "on".
+    places = set()
+    for text in _values(value):
+        places |= _phrases([text, *text.split(",")])
+    return places
+
+
+def _title_words(value: Any) -> set:
+    return {word for text in _values(value) for word in tokens(text) if word not in TITLE_STOPWORDS}
+
+
+def _ngrams(text: Any, n: int = MAX_TERM_WORDS) -> set:
+    words = tokens(text)
+    return {" ".join(words[i:i + size]) for size in range(1, n + 1) for i in range(len(words) - size + 1)}
+
+
+def profile_terms(fields: Dict[str, Any]) -> Terms:
+    """The terms a profile's match fields are indexed under, per facet."""
+    terms: Dict[str, set] = {facet: set() for facet in FACETS}
+    for field, facet in MATCH_FIELDS.items():
+        value = fields.get(field)
+        if not value:
+            continue
+        if facet == "title":
+            terms[facet] |= _title_words(value)
+        elif facet == "location":
+            terms[facet] |= _places(value)
+        else:
+            terms[facet] |= _phrases(value, FACET_ALIASES.get(facet))
+    return {facet: frozenset(values) for facet, values in terms.items()}
+
+
+def match_fields(profile: dict) -> Dict[str, Any]:
+    return {field: profile[field] for field in MATCH_FIELDS if profile.get(field)}
+
+
+class _State:
+    """
+    One generation of the index.
+
+    Users are rows; a posting list is the NumPy array of rows under a term.
+    `fields` keeps each row's match fields, so a change to a single field
+    can be turned into posting updates without reading the profile.
+    """
+
+    def __init__(self):
+        self.row_of: Dict[str, int] = {}
+        self.user_ids: List[Optional[str]] = []
+        self.fields: List[Optional[Dict[str, Any]]] = []
+        self.terms: List[Optional[Terms]] = []
+        self.free: List[int] = []
+        self.postings: Dict[str, Dict[str, np.ndarray]] = {facet: {} for facet in FACETS}
+        self.active = np.zeros(0, dtype=bool)
+        self.must_count = np.zeros(0, dtype=np.int32)
+        # Keywords longer than MAX_TERM_WORDS, which no job n-gram can equal.
+        self.long_terms: Dict[str, set] = {facet: set() for facet in ("must_have", "excluded")}
+
+    def __len__(self) -> int:
+        return len(self.row_of)
+
+    @classmethod
+    def build(cls, profiles: Iterable[dict]) -> "_State":
+        state = cls()
+        lists: Dict[str, Dict[str, List[int]]] = {facet: defaultdict(list) for facet in FACETS}
+        for profile in profiles:
+            user_id = profile.get("id") or profile.get("user_id")
+            if not user_id or user_id in state.row_of:
+                continue
+            fields = match_fields(profile)
+            terms = profile_terms(fields)
+            row = len(state.user_ids)
+            state.row_of[user_id] = row
+            state.user_ids.append(user_id)
+            state.fields.append(fields)
+            state.terms.append(terms)
+            for facet, values in terms.items():
+                for term in values:
+                    lists[facet][term].append(row)
+        state.postings = {
+            facet: {term: np.asarray(rows, dtype=np.int32) for term, rows in by_term.items()}
+            for facet, by_term in lists.items()
+        }
+        for facet, long_terms in state.long_terms.items():
+            long_terms.update(term for term in state.postings[facet] if term.count(" ") >= MAX_TERM_WORDS)
+        state.active = np.ones(len(state.user_ids), dtype=bool)
+        state.must_count = np.fromiter(
+            (len(terms["must_have"]) for terms in state.terms), dtype=np.int32, count=len(state.terms)
+        )
+        return state
+
+    def _allocate(self, user_id: str) -> int:
+        if self.free:
+            row = self.free.pop()
+            self.user_ids[row] = user_id
+        else:
+            row = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.fields.append(None)
+            self.terms.append(None)
+            if row >= len(self.active):
+                size = max(16, 2 * len(self.active))
+                self.active = np.resize(self.active, size)
+                self.active[row:] = False
+                self.must_count = np.resize(self.must_count, size)
+                self.must_count[row:] = 0
+        self.row_of[user_id] = row
+        return row
+
+    def _post(self, facet: str, term: str, row: int) -> None:
+        rows = self.postings[facet].get(term)
+        self.postings[facet][term] = np.array([row], dtype=np.int32) if rows is None else np.append(rows, np.int32(row))
+        if facet in self.long_terms and term.count(" ") >= MAX_TERM_WORDS:
+            self.long_terms[facet].add(term)
+
+    def _unpost(self, facet: str, term: str, row: int) -> None:
+        rows = self.postings[facet].get(term)
+        if rows is None:
+            return
+        rows = rows[rows != row]
+        if len(rows):
+            self.postings[facet][term] = rows
+        else:
+            del self.postings[facet][term]
+            if facet in self.long_terms:
+                self.long_terms[facet].discard(term)
+
+    def set_user(self, user_id: str, fields: Dict[str, Any]) -> None:
+        row = self.row_of.get(user_id)
+        if row is None:
+            row = self._allocate(user_id)
+        before = self.terms[row] or {}
+        after = profile_terms(fields)
+        for facet in FACETS:
+            old, new = before.get(facet, frozenset()), after[facet]
+            for term in old - new:
+                self._unpost(facet, term, row)
+            for term in new - old:
+                self._post(facet, term, row)
+        self.fields[row] = fields
+        self.terms[row] = after
+        self.active[row] = True
+        self.must_count[row] = len(after["must_have"])
+
+    def remove_user(self, user_id: str) -> None:
+        row = self.row_of.pop(user_id, None)
+        if row is None:
+            return
+        for facet, values in (self.terms[row] or {}).items():
+            for term in values:
+                self._unpost(facet, term, row)
+        self.user_ids[row] = self.fields[row] = self.terms[row] = None
+        self.active[row] = False
+        self.must_count[row] = 0
+        self.free.append(row)
+
+    def apply(self, user_id: str, changes: Sequence[ProfileChange]) -> None:
+        row = self.row_of.get(user_id)
+        if row is None:
+            # Only the changed fields are known; indexing them alone would drop the
+            # user's exclusions.  The user is picked up by `MatchIndex.add` or the next build.
+            return
+        fields = dict(self.fields[row] or {})
+        for change in changes:
+            if change.field not in MATCH_FIELDS:
+                continue
+            if change.op == "set":
+                fields[change.field] = change.value
+                continue
+            values = list(_values(fields.get(change.field)))
+            if change.op == "add" and change.value not in values:
+                values.append(change.value)
+            elif change.op == "remove" and change.value in values:
+                values.remove(change.value)
+            fields[change.field] = values
+        self.set_user(user_id, {field: value for field, value in fields.items() if value})
+
+    def job_terms(self, job: dict) -> Dict[str, set]:
+        title, description = job.get("title") or "", job.get("description") or ""
+        skills = _phrases(job.get("skills"))
+        text = set(skills)
+        values = (title, description, *_values(job.get("location")), *_values(job.get("industry")))
+        for value in values:
+            text |= _ngrams(value)
+        if self.long_terms["must_have"] or self.long_terms["excluded"]:
+            # Fields are kept apart so a keyword never spans two of them.
+            full = f" {' | '.join(map(normalize_term, (*values, *skills)))} "
+            for long_terms in self.long_terms.values():
+                text |= {term for term in long_terms if f" {term} " in full}
+        named = {}
+        for facet, aliases in FACET_ALIASES.items():
+            # Skills and industries named anywhere in the text count, not just the listed ones.
+            postings = self.postings[facet]
+            named[facet] = {term for term in (aliases.get(term, term) for term in text) if term in postings}
+        return {
+            "title": _title_words(title),
+            "skill": _phrases(job.get("skills"), FACET_ALIASES["skill"]) | named["skill"],
+            "location": _places(job.get("location")),
+            "industry": _phrases(job.get("industry"), FACET_ALIASES["industry"]) | named["industry"],
+            "text": text,
+        }
+
+    def score(self, job: dict, k: int) -> List[Dict[str, Any]]:
+        n = len(self.user_ids)
+        if not self.row_of or k <= 0:
+            return []
+        terms = self.job_terms(job)
+        users = len(self.row_of)
+        total = np.zeros(n, dtype=np.float32)
+        for facet, weight in FACET_WEIGHTS.items():
+            facet_score = np.zeros(n, dtype=np.float32)
+            norm = 0.0
+            for term in terms[facet]:
+                rows = self.postings[facet].get(term)
+                idf = math.log((users + 1) / ((0 if rows is None else len(rows)) + 1)) + 1.0
+                norm += idf
+                if rows is not None:
+                    facet_score[rows] += idf
+            if norm:
+                total += np.float32(weight / norm) * facet_score
+        keep = self.active[:n] & (total > 0)
+        must = self.must_count[:n]
+        hits = np.zeros(n, dtype=np.int32) if must.any() else None
+        for term in terms["text"]:
+            rows = self.postings["excluded"].get(term)
+            if rows is not None:
+                keep[rows] = False
+            if hits is not None:
+                rows = self.postings["must_have"].get(term)
+                if rows is not None:
+                    hits[rows] += 1
+        if hits is not None:
+            keep &= hits >= must
+        candidates = np.flatnonzero(keep)
+        if not len(candidates):
+            return []
+        scores = total[candidates]
+        if k < len(candidates):
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.lexsort((candidates[top], -scores[top]))]
+        else:
+            top = np.lexsort((candidates, -scores))
+        return [self._explain(int(candidates[i]), float(scores[i]), terms) for i in top]
+
+    def _explain(self, row: int, score: float, job_terms: Dict[str, set]) -> Dict[str, Any]:
+        user_terms = self.terms[row]
+        matched = {facet: sorted(user_terms[facet] & job_terms[facet]) for facet in FACET_WEIGHTS}
+        return {
+            "user_id": self.user_ids[row],
+            "score": round(score, 4),
+            "matched": {facet: found for facet, found in matched.items() if found},
+        }
+
+
+def load_profiles(container=None, page_size: int = MATCH_LOAD_PAGE_SIZE) -> Iterator[dict]:
+    """Every profile in the container, read one cross-partition page at a time."""
+    if container is None:
+        from utils import cosmos
+
+        container = cosmos.get_container()
+    for page in container.read_all_items(max_item_count=page_size).by_page():
+        yield from page
+
+
+class MatchIndex:
+    """
+    Inverted index over the match fields of every profile.
+
+    Args:
+        load: Returns the profiles to build from; all of the profiles
+            container by default.
+        ttl: Seconds after which a match triggers a background rebuild.
+        clock: Monotonic time source, for tests.
+    """
+
+    def __init__(self, load: Callable[[], Iterable[dict]] = load_profiles, ttl: float = MATCH_INDEX_TTL, clock=time.monotonic):
+        self._load = load
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._state: Optional[_State] = None
+        self._built_at = 0.0
+        self._building: Optional[threading.Thread] = None
+        # Updates seen while a rebuild is reading profiles, replayed onto its result.
+        self._replay: Optional[List[Callable[[_State], None]]] = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._state) if self._state is not None else 0
+
+    def build(self, profiles: Optional[Iterable[dict]] = None) -> int:
+        """(Re)build the index from `profiles` (by default, loaded); returns the number of users."""
+        with self._lock:
+            self._replay = []
+        try:
+            with span("match_index_build"):
+                state = _State.build(self._load() if profiles is None else profiles)
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            for replay in self._replay:
+                replay(state)
+            self._replay = None
+            self._state = state
+            self._built_at = self._clock()
+        logger.info("Match index built with %d profiles", len(state))
+        return len(state)
+
+    def _rebuild(self) -> None:
+        try:
+            self.build()
+        except Exception as e:
+            logger.error("Match index rebuild failed: %s", e)
+        finally:
+            with self._lock:
+                self._building = None
+
+    def refresh_async(self) -> None:
+        """Rebuild in a background thread unless a rebuild is already running."""
+        with self._lock:
+            if self._building is not None:
+                return
+            self._building = threading.Thread(target=self._rebuild, name="match-index", daemon=True)
+            self._building.start()
+
+    def _current(self) -> _State:
+        with self._lock:
+            state, building = self._state, self._building
+        if state is None:
+            # The first build runs outside the lock, so profile writes in this
+            # worker are not held up while it loads; concurrent callers share it.
+            if building is None:
+                self.refresh_async()
+                with self._lock:
+                    building = self._building
+            if building is not None:
+                building.join()
+            with self._lock:
+                state = self._state
+            if state is None:
+                raise RuntimeError("Match index could not be built")
+            return state
+        if self.ttl and self._clock() - self._built_at > self.ttl:
+            self.refresh_async()
+        return state
+
+    def on_profile_change(self, user_id: str, changes: List[ProfileChange]) -> None:
+        """`update_profile` listener: apply changes to match fields to the built index."""
+        if not any(change.field in MATCH_FIELDS for change in changes):
+            return
+        self._update(lambda state: state.apply(user_id, changes))
+
+    def merge(self, user_id: str, profile_data: dict) -> None:
+        """Apply a write that merged `profile_data` into the profile (`dbutils.upsert_user_profile`)."""
+        self.on_profile_change(user_id, [ProfileChange("set", field, value) for field, value in profile_data.items()])
+
+    def add(self, user_id: str, profile: dict) -> None:
+        """Index the whole `profile`, e.g. one just created, replacing what the index held for the user."""
+        fields = match_fields(profile)
+        self._update(lambda state: state.set_user(user_id, fields))
+
+    def remove(self, user_id: str) -> None:
+        self._update(lambda state: state.remove_user(user_id))
+
+    def _update(self, update: Callable[[_State], None]) -> None:
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append(update)
+            if self._state is not None:
+                update(self._state)
+
+    def match(self, job: dict, k: int = MATCH_TOP_K) -> List[Dict[str, Any]]:
+        """
+        The `k` best-matching users for `job`, best first.
+
+        `job` may have a `title`, `skills` (list), `location`, `industry`
+        and `description`.  Each match has the `user_id`, its `score`
+        (0-1) and the terms it `matched`, per facet.
+        """
+        state = self._current()
+        with self._lock, span("match"):
+            return state.score(job, k)
+
+    def stats(self) -> dict:
+        with self._lock:
+            state = self._state
+            return {
+                "users": len(state) if state is not None else 0,
+                "terms": sum(len(by_term) for by_term in state.postings.values()) if state is not None else 0,
+                "age": round(self._clock() - self._built_at, 1) if state is not None else None,
+            }
+
+
+_default_index: Optional[MatchIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_match_index() -> MatchIndex:
+    """Return the worker-wide match index, created (not yet built) on first use."""
+    global _default_index
+    if _default_index is None:
+        with _default_lock:
+            if _default_index is None:
+                _default_index = MatchIndex()
+    return _default_index
+
+
+def _collect_stats():
+    if _default_index is None:
+        return []
+    stats = _default_index.stats()
+    return [
+        ("zil_match_index_users", "gauge", "Profiles in the match index (each worker holds a full copy).", {}, stats["users"]),
+        ("zil_match_index_terms", "gauge", "Distinct terms in the match index (each worker holds a full copy).", {}, stats["terms"]),
+    ]
+
+
+REGISTRY.add_collector(_collect_stats, shared=["zil_match_index_users", "zil_match_index_terms"])
@@ -0,0 +1,61 @@
+"""
+LangChain callback handlers used by the agent.
+
+Kept apart from `agent.py` so that importing the agent (and with it the
+web app) does not import LangChain; this module is loaded together with
+the rest of LangChain when the first turn runs.
+"""
+
+import queue
+import time
+from typing import Any, Dict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.metrics import LLM_TOKENS, STAGE_ERRORS, STAGE_SECONDS
+
+
+class UsageHandler(BaseCallbackHandler):
+    """Records model call latency and prompt/completion token counts."""
+
+    def __init__(self):
+        self._started: Dict[Any, float] = {}
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, *, run_id: Any, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized: Any, prompts: Any, *, run_id: Any, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: Any, *, run_id: Any, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm")
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            # Streaming responses report usage on the message instead.
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    usage = {"prompt_tokens": metadata.get("input_tokens", 0), "completion_tokens": metadata.get("output_tokens", 0)}
+        if usage.get("prompt_tokens"):
+            LLM_TOKENS.inc(usage["prompt_tokens"], kind="prompt")
+        if usage.get("completion_tokens"):
+            LLM_TOKENS.inc(usage["completion_tokens"], kind="completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm")
+        STAGE_ERRORS.inc(stage="llm")
+
+
+class StreamEventHandler(BaseCallbackHandler):
+    """Forwards model tokens to a queue as stream events; `stream_agent` puts the tool events itself."""
+
+    def __init__(self, events: "queue.Queue[Dict[str, Any] | None]"):
+        self.events = events
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            self.events.put({"event": "token", "data": {"text": token}})
@@ -0,0 +1,412 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain dicts behind a lock, so recording a
+sample costs a couple of microseconds and can stay on in production.  The
+hot paths use:
+
+- `span(stage)`: times a block into `zil_stage_duration_seconds` and
+  counts exceptions in `zil_stage_errors_total`;
+- `cosmos_call(operation, fn, ...)`: times a Cosmos SDK call and records
+  its request charge (RU), throttling retries and failure status;
+- `LLM_TOKENS`: prompt/completion token counts reported by the model.
+
+`REGISTRY.render()` produces the body served on `/metrics`.  Each gunicorn
+worker has its own registry; set `METRICS_MULTIPROC_DIR` to a directory
+shared by the workers and every worker periodically writes a snapshot
+there, which `render` merges so any worker can answer a scrape for all:
+
+- counters and histograms are summed over every snapshot;
+- gauges are summed over the snapshots of live workers only, or, for
+  values every worker reads from the same shared source (registered with
+  `add_collector(..., shared=...)`), the largest of them is taken.
+
+Snapshots of workers that have exited are deleted: by gunicorn's
+`child_exit` hook (`remove_snapshot`), or by the next `render` that finds
+their process gone.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+REQUEST_UNIT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+LabelValues = Tuple[str, ...]
+# A collector returns (name, type, help, labels, value) samples read from
+# some other component's own counters when the registry is rendered.
+Collector = Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram of observations, optionally split by labels."""
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum, count].
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels: Any) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def sum(self, **labels: Any) -> float:
+        state = self._values.get(self._key(labels))
+        return state[1] if state else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {json.dumps(key): [list(s[0]), s[1], s[2]] for key, s in self._values.items()}
+
+
+class Registry:
+    """The set of metrics rendered on `/metrics`."""
+
+    def __init__(self, multiproc_dir: str = ""):
+        self.multiproc_dir = multiproc_dir
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._shared: set = set()
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def add_collector(self, collector: Collector, shared: Iterable[str] = ()) -> None:
+        """
+        Read samples from `collector` on every render.
+
+        `shared` names the gauges whose value is the same in every worker
+        (a shared spool, a copy of the same index); across workers the
+        largest is reported instead of the sum.
+        """
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+            self._shared.update(shared)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """This process's samples as a JSON-serialisable dict."""
+        metrics = {}
+        for metric in list(self._metrics.values()):
+            entry = {"type": metric.type, "help": metric.help, "labels": list(metric.labelnames), "values": metric.snapshot()}
+            if isinstance(metric, Histogram):
+                entry["buckets"] = list(metric.buckets)
+            metrics[metric.name] = entry
+        for collector in list(self._collectors):
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logging.getLogger(__name__).warning("Metrics collector failed: %s", e)
+                continue
+            for name, type_, help, labels, value in samples:
+                entry = metrics.setdefault(name, {"type": type_, "help": help, "labels": sorted(labels), "values": {}})
+                if type_ == "gauge":
+                    entry["merge"] = "max" if name in self._shared else "sum"
+                key = json.dumps([str(labels[n]) for n in entry["labels"]])
+                entry["values"][key] = entry["values"].get(key, 0.0) + value
+        return metrics
+
+    # -- multi-process -------------------------------------------------
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiproc_dir, f"metrics-{pid}.json")
+
+    def write_snapshot(self) -> None:
+        """Publish this process's snapshot for the other workers' `render`."""
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.multiproc_dir, prefix=".metrics-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, self._snapshot_path(os.getpid()))
+
+    def remove_snapshot(self, pid: int) -> None:
+        """Forget the snapshot of worker `pid` once it has exited."""
+        if not self.multiproc_dir:
+            return
+        try:
+            os.remove(self._snapshot_path(pid))
+        except FileNotFoundError:
+            pass
+
+    def start_flusher(self) -> None:
+        """Write snapshots every `METRICS_FLUSH_INTERVAL` seconds from a daemon thread."""
+        if not self.multiproc_dir or (self._flusher is not None and self._flusher.is_alive()):
+            return
+
+        def run() -> None:
+            while True:
+                time.sleep(METRICS_FLUSH_INTERVAL)
+                try:
+                    self.write_snapshot()
+                except OSError as e:
+                    logging.getLogger(__name__).warning("Writing metrics snapshot failed: %s", e)
+
+        self._flusher = threading.Thread(target=run, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def _merged_snapshot(self) -> Dict[str, Any]:
+        if not self.multiproc_dir:
+            return self.snapshot()
+        self.write_snapshot()
+        merged: Dict[str, Any] = {}
+        for filename in sorted(os.listdir(self.multiproc_dir)):
+            if not (filename.startswith("metrics-") and filename.endswith(".json")):
+                continue
+            try:
+                pid = int(filename[len("metrics-"):-len(".json")])
+            except ValueError:
+                continue
+            if not _alive(pid):
+                # The worker exited without child_exit running (crash, kill -9).
+                self.remove_snapshot(pid)
+                continue
+            try:
+                with open(os.path.join(self.multiproc_dir, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, entry in snapshot.items():
+                target = merged.setdefault(name, dict(entry, values={}))
+                for key, value in entry["values"].items():
+                    if key not in target["values"]:
+                        target["values"][key] = value
+                    elif entry["type"] == "histogram":
+                        buckets, total, count = target["values"][key]
+                        target["values"][key] = [[a + b for a, b in zip(buckets, value[0])], total + value[1], count + value[2]]
+                    elif entry.get("merge") == "max":
+                        target["values"][key] = max(target["values"][key], value)
+                    else:
+                        target["values"][key] += value
+        return merged
+
+    # -- exposition ----------------------------------------------------
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for name, entry in sorted(self._merged_snapshot().items()):
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            labelnames = entry["labels"]
+            for key, value in sorted(entry["values"].items()):
+                labels = json.loads(key)
+                if entry["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(entry["buckets"]) + [float("inf")], buckets):
+                    cumulative += bucket_count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labelnames, labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(METRICS_MULTIPROC_DIR)
+
+STAGE_SECONDS = Histogram("zil_stage_duration_seconds", "Time spent per request stage.", ["stage"])
+STAGE_ERRORS = Counter("zil_stage_errors_total", "Exceptions raised per request stage.", ["stage"])
+HTTP_SECONDS = Histogram("zil_http_request_duration_seconds", "HTTP request latency.", ["method", "route", "status"])
+COSMOS_SECONDS = Histogram("zil_cosmos_request_duration_seconds", "Cosmos DB request latency.", ["operation"])
+COSMOS_REQUEST_UNITS = Histogram(
+    "zil_cosmos_request_units", "Request charge (RU) per Cosmos DB request.", ["operation"], buckets=REQUEST_UNIT_BUCKETS
+)
+COSMOS_ERRORS = Counter("zil_cosmos_errors_total", "Failed Cosmos DB requests by status code.", ["operation", "status"])
+COSMOS_RETRIES = Counter("zil_cosmos_retries_total", "Cosmos DB request retries.", ["operation", "reason"])
+LLM_TOKENS = Counter("zil_llm_tokens_total", "Model tokens used.", ["kind"])
+AGENT_STEPS = Histogram("zil_agent_steps", "Model calls per agent turn.", buckets=(1, 2, 3, 4, 6, 8))
+AGENT_BUDGET_EXHAUSTED = Counter("zil_agent_budget_exhausted_total", "Agent turns stopped by a budget.", ["budget"])
+TOOL_CALLS = Counter("zil_tool_calls_total", "Tool calls executed, and identical calls coalesced.", ["tool", "outcome"])
+BACKGROUND_JOBS = Counter(
+    "zil_background_jobs_total", "Background jobs by outcome (queued, coalesced, ok, retried, failed, dropped).", ["kind", "outcome"]
+)
+BACKGROUND_JOB_SECONDS = Histogram(
+    "zil_background_job_seconds", "Time from enqueueing a background job to its completion.", ["kind"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+ADMISSION_DECISIONS = Counter(
+    "zil_admission_total",
+    "Chat admission decisions (admitted, queued, collapsed, rate_limited, overloaded, timed_out).",
+    ["outcome"],
+)
+ADMISSION_WAIT_SECONDS = Histogram("zil_admission_wait_seconds", "Time admitted requests waited for a turn slot.")
+LOG_MESSAGES = Counter("zil_log_messages_total", "Log records emitted, by level.", ["level"])
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the block as `stage`; exceptions are counted and re-raised."""
+    REGISTRY.start_flusher()
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator form of `span`."""
+
+    def decorate(func: Callable) -> Callable:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(stage):
+                return func(*args, **kwargs)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func  # type: ignore[attr-defined]
+        return wrapper
+
+    return decorate
+
+
+def _record_cosmos_headers(operation: str, headers: Any) -> None:
+    if not headers:
+        return
+    charge = headers.get("x-ms-request-charge")
+    if charge is not None:
+        COSMOS_REQUEST_UNITS.observe(float(charge), operation=operation)
+    throttle_retries = headers.get("x-ms-throttle-retry-count")
+    if throttle_retries:
+        COSMOS_RETRIES.inc(float(throttle_retries), operation=operation, reason="throttled")
+
+
+def _record_cosmos_error(operation: str, exc: Exception) -> None:
+    COSMOS_ERRORS.inc(operation=operation, status=getattr(exc, "status_code", None) or "error")
+    _record_cosmos_headers(operation, getattr(exc, "headers", None))
+
+
+def cosmos_call(operation: str, func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Call the Cosmos SDK method `func`, recording latency, request charge and failures."""
+    REGISTRY.start_flusher()
+    start = time.perf_counter()
+    try:
+        return func(*args, response_hook=lambda headers, _: _record_cosmos_headers(operation, headers), **kwargs)
+    except Exception as e:
+        _record_cosmos_error(operation, e)
+        raise
+    finally:
+        COSMOS_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+async def acosmos_call(operation: str, func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Async counterpart of `cosmos_call` for the `azure.cosmos.aio` client."""
+    start = time.perf_counter()
+    try:
+        return await func(*args, response_hook=lambda headers, _: _record_cosmos_headers(operation, headers), **kwargs)
+    except Exception as e:
+        _record_cosmos_error(operation, e)
+        raise
+    finally:
+        COSMOS_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+class MetricsLogHandler(logging.Handler):
+    """Counts log records by level, so error rates show up next to latency."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        LOG_MESSAGES.inc(level=record.levelname.lower())
@@ -0,0 +1,293 @@
+"""
+Per-user queue of questions the agent still has to ask.
+
+The queue lives in its own small Cosmos document per user (container
+`AZURE_COSMOS_PENDING_QUESTIONS`, see `utils.cosmos`) rather than in the
+profile, so building the preamble is a point read of a few hundred bytes
+instead of the whole profile, and adding or answering a question does not
+rewrite the profile.
+
+The document keeps its questions ordered by priority (highest first) and
+then age, so the head of the queue is simply the first entries.  Questions
+are deduplicated on a normalised key (case, punctuation and whitespace
+ignored), expire after `PENDING_QUESTION_TTL` seconds unless given their
+own TTL, and the queue is capped at `MAX_PENDING_QUESTIONS`, dropping the
+lowest-priority, newest entries.  Every write is a read-modify-replace
+conditioned on the document's ETag and retried on conflict, so two turns
+answering or adding questions concurrently never lose each other's edits.
+
+Profiles written before the queue existed carry their questions in a
+`pending_questions` list field. `migrate_profiles` moves them into the
+queue and drops the field, once, from the repository root:
+
+    python -m utils.pending_questions migrate
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+import unicodedata
+from typing import Callable, Dict, List, Optional
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from cosmos_profile import PATCH_MAX_ATTEMPTS, backoff
+from utils import cosmos
+from utils.metrics import COSMOS_RETRIES, acosmos_call, cosmos_call, span
+
+logger = logging.getLogger(__name__)
+
+PENDING_QUESTION_TTL = float(os.getenv("PENDING_QUESTION_TTL", str(30 * 24 * 3600)))
+MAX_PENDING_QUESTIONS = int(os.getenv("MAX_PENDING_QUESTIONS", "20"))
+# Questions shown to the model ahead of the user's message.
+PREAMBLE_SIZE = 3
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class PendingQuestionConflictError(RuntimeError):
+    """Raised when a queue update keeps losing ETag races after all retries."""
+
+
+def normalize(question: str) -> str:
+    """Dedup key of a question: case, punctuation and extra whitespace are ignored."""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    return _WHITESPACE.sub(" ", _NON_WORD.sub(" ", text)).strip()
+
+
+def _container():
+    return cosmos.get_container(cosmos.PENDING_QUESTIONS_CONTAINER_NAME)
+
+
+def _async_container():
+    return cosmos.get_async_container(cosmos.PENDING_QUESTIONS_CONTAINER_NAME)
+
+
+def _live(questions: List[dict], now: float) -> List[dict]:
+    return [q for q in questions if q.get("expires_at", now + 1) > now]
+
+
+def _head(doc: dict, n: int) -> List[str]:
+    now = time.time()
+    head = []
+    # Entries are kept in queue order; only expired ones need skipping.
+    for question in doc.get("questions", []):
+        if question.get("expires_at", now + 1) > now:
+            head.append(question["text"])
+            if len(head) == n:
+                break
+    return head
+
+
+def head(user_id: str, n: int = PREAMBLE_SIZE) -> List[str]:
+    """The next `n` questions to ask `user_id`, highest priority first."""
+    try:
+        with span("pending_read"):
+            doc = cosmos_call("read_item", _container().read_item, item=user_id, partition_key=user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return []
+    except Exception as e:
+        # The preamble is a nicety; a failed read must not fail the turn.
+        logger.error("Failed to load pending questions for %s: %s", user_id, e)
+        return []
+    return _head(doc, n)
+
+
+async def ahead(user_id: str, n: int = PREAMBLE_SIZE) -> List[str]:
+    """Async counterpart of `head` for the ASGI path."""
+    try:
+        with span("pending_read"):
+            doc = await acosmos_call("read_item", _async_container().read_item, item=user_id, partition_key=user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return []
+    except Exception as e:
+        # The preamble is a nicety; a failed read must not fail the turn.
+        logger.error("Failed to load pending questions for %s: %s", user_id, e)
+        return []
+    return _head(doc, n)
+
+
+def _update(user_id: str, mutate: Callable[[List[dict], float], bool]) -> bool:
+    """
+    Apply `mutate(questions, now)` to the queue and write it back.
+
+    `mutate` edits the list of live questions in place and returns whether
+    it changed anything; nothing is written otherwise.  Conflicting writers
+    are resolved by re-reading and re-applying `mutate`.
+    """
+    container = _container()
+    for attempt in range(PATCH_MAX_ATTEMPTS):
+        try:
+            doc = cosmos_call("read_item", container.read_item, item=user_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            doc = None
+        now = time.time()
+        stored = (doc or {}).get("questions", [])
+        questions = _live(stored, now)
+        expired = len(questions) != len(stored)
+        if not mutate(questions, now) and not expired:
+            return False
+        questions.sort(key=lambda q: (-q["priority"], q["created_at"]))
+        body = {"id": user_id, "user_id": user_id, "questions": questions[:MAX_PENDING_QUESTIONS]}
+        try:
+            if doc is None:
+                cosmos_call("create_item", container.create_item, body)
+            else:
+                cosmos_call(
+                    "replace_item",
+                    container.replace_item,
+                    item=user_id,
+                    body=body,
+                    etag=doc["_etag"],
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            return True
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceExistsError):
+            COSMOS_RETRIES.inc(operation="replace_item", reason="precondition_failed")
+            backoff(attempt)
+    raise PendingQuestionConflictError(
+        f"Pending questions of {user_id} were modified concurrently {PATCH_MAX_ATTEMPTS} times; giving up"
+    )
+
+
+def add(user_id: str, question: str, priority: int = 0, ttl: Optional[float] = None) -> bool:
+    """
+    Queue `question` for `user_id`.
+
+    Returns False if an equivalent question is already pending, raising
+    its priority to `priority` if that is higher.
+    """
+    key = normalize(question)
+    if not key:
+        return False
+    added = []
+
+    def mutate(questions: List[dict], now: float) -> bool:
+        added.clear()
+        expires_at = now + (PENDING_QUESTION_TTL if ttl is None else ttl)
+        for existing in questions:
+            if existing["key"] == key:
+                if existing["priority"] >= priority:
+                    return False
+                existing["priority"] = priority
+                return True
+        questions.append({"text": question.strip(), "key": key, "priority": priority, "created_at": now, "expires_at": expires_at})
+        added.append(True)
+        return True
+
+    _update(user_id, mutate)
+    return bool(added)
+
+
+def remove(user_id: str, question: str) -> Optional[str]:
+    """
+    Take an answered question off the queue.
+
+    Matching uses the same normalised key as `add`, so the model does not
+    have to repeat the question verbatim.  Returns the stored text of the
+    removed question, or None if no equivalent question was pending.
+    """
+    key = normalize(question)
+    removed = []
+
+    def mutate(questions: List[dict], now: float) -> bool:
+        removed.clear()
+        for i, existing in enumerate(questions):
+            if existing["key"] == key:
+                removed.append(questions.pop(i)["text"])
+                return True
+        return False
+
+    _update(user_id, mutate)
+    return removed[0] if removed else None
+
+
+def clear(user_id: str) -> bool:
+    """Drop every pending question of `user_id` (profile reset). Returns True if any were pending."""
+
+    def mutate(questions: List[dict], now: float) -> bool:
+        if not questions:
+            return False
+        questions.clear()
+        return True
+
+    return _update(user_id, mutate)
+
+
+# Profile field the questions were stored in before the queue existed.
+LEGACY_PROFILE_FIELD = "pending_questions"
+MIGRATE_PAGE_SIZE = 100
+
+
+def _drop_legacy_field(profiles, profile: dict) -> None:
+    user_id = profile["id"]
+    for attempt in range(PATCH_MAX_ATTEMPTS):
+        if LEGACY_PROFILE_FIELD not in profile:
+            return
+        try:
+            cosmos_call(
+                "patch_item",
+                profiles.patch_item,
+                item=user_id,
+                partition_key=user_id,
+                patch_operations=[{"op": "remove", "path": f"/{LEGACY_PROFILE_FIELD}"}],
+                etag=profile.get("_etag"),
+                match_condition=MatchConditions.IfNotModified,
+            )
+            return
+        except exceptions.CosmosAccessConditionFailedError:
+            COSMOS_RETRIES.inc(operation="patch_item", reason="precondition_failed")
+            backoff(attempt)
+            profile = cosmos_call("read_item", profiles.read_item, item=user_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return
+    raise PendingQuestionConflictError(f"Profile {user_id} was modified concurrently {PATCH_MAX_ATTEMPTS} times; giving up")
+
+
+def migrate_profiles(profiles=None, page_size: int = MIGRATE_PAGE_SIZE) -> Dict[str, int]:
+    """
+    Move questions left in profiles' `pending_questions` field into the queue.
+
+    Each question is queued before the field is removed from the profile,
+    so an interrupted run loses nothing and a rerun only skips what is
+    already queued (`add` deduplicates).
+    """
+    profiles = profiles if profiles is not None else cosmos.get_container()
+    report = {"scanned": 0, "migrated": 0, "questions": 0, "failed": 0}
+    for page in profiles.read_all_items(max_item_count=page_size).by_page():
+        for profile in page:
+            report["scanned"] += 1
+            if LEGACY_PROFILE_FIELD not in profile:
+                continue
+            try:
+                for question in profile.get(LEGACY_PROFILE_FIELD) or []:
+                    if isinstance(question, str) and add(profile["id"], question):
+                        report["questions"] += 1
+                _drop_legacy_field(profiles, profile)
+                report["migrated"] += 1
+            except Exception as e:
+                logger.error("Migrating pending questions of %s failed: %s", profile.get("id"), e)
+                report["failed"] += 1
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the pending question queues.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="Move questions stored in profiles into the queue.")
+    migrate.add_argument("--page-size", type=int, default=MIGRATE_PAGE_SIZE)
+    args = parser.parse_args(argv)
+
+    report = migrate_profiles(page_size=args.page_size)
+    print(json.dumps(report, indent=2), file=sys.stderr)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Per-user similarity index over profile paragraphs.
+
+Mature profiles accumulate dozens of `experience_paragraphs` and
+`project_paragraphs`; sending all of them with every prompt makes input
+size (and so latency and cost) grow with the profile.  This module keeps,
+per user, a NumPy matrix of unit-normalised paragraph embeddings so the
+agent can include only the paragraphs most similar to the current prompt.
+
+Indexes are updated incrementally: `sync` reconciles an index with a
+freshly read profile, embedding only paragraphs it has not seen (this
+picks up writes made by any worker), and `refresh` does the same from the
+background job queued after a turn changed the user's paragraphs (see
+`agent`), so the next turn finds the index and the embedding cache warm.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+PARAGRAPH_FIELDS = ("experience_paragraphs", "project_paragraphs")
+PROFILE_CONTEXT_TOP_K = int(os.getenv("PROFILE_CONTEXT_TOP_K", "4"))
+PROFILE_INDEX_MAX_USERS = int(os.getenv("PROFILE_INDEX_MAX_USERS", "2000"))
+
+EmbedMany = Callable[[Sequence[str]], List[np.ndarray]]
+
+
+def _normalise(vectors: Sequence[np.ndarray]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class UserParagraphIndex:
+    """Paragraph embeddings for one user, as rows of a normalised matrix."""
+
+    def __init__(self):
+        self.entries: List[Tuple[str, str]] = []  # (field, text), parallel to matrix rows
+        self.matrix: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def keys(self) -> set:
+        return set(self.entries)
+
+    def add(self, entries: Sequence[Tuple[str, str]], vectors: Sequence[np.ndarray]) -> None:
+        if not entries:
+            return
+        rows = _normalise(vectors)
+        self.matrix = rows if self.matrix is None else np.vstack([self.matrix, rows])
+        self.entries.extend(entries)
+
+    def remove(self, entries: Sequence[Tuple[str, str]]) -> None:
+        doomed = set(entries)
+        keep = [i for i, entry in enumerate(self.entries) if entry not in doomed]
+        if len(keep) == len(self.entries):
+            return
+        self.entries = [self.entries[i] for i in keep]
+        self.matrix = self.matrix[keep] if keep else None
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[str, str, float]]:
+        """Return up to `k` (field, text, cosine score) tuples, best first."""
+        if self.matrix is None or k <= 0:
+            return []
+        query = _normalise([query])[0]
+        scores = self.matrix @ query
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [(*self.entries[i], float(scores[i])) for i in top]
+
+
+def _paragraphs(profile: dict) -> List[Tuple[str, str]]:
+    entries = []
+    for field in PARAGRAPH_FIELDS:
+        for text in profile.get(field) or []:
+            if isinstance(text, str) and text.strip():
+                entries.append((field, text))
+    return list(dict.fromkeys(entries))
+
+
+class ProfileParagraphIndex:
+    """
+    LRU of `UserParagraphIndex` objects, one per recently active user.
+
+    Args:
+        embed_many: Maps texts to vectors. Defaults to the shared
+            `EmbeddingService`, resolved on first use.
+        max_users: Number of user indexes kept in memory.
+    """
+
+    def __init__(self, embed_many: Optional[EmbedMany] = None, max_users: int = PROFILE_INDEX_MAX_USERS):
+        self._embed_many = embed_many
+        self.max_users = max_users
+        self._users: "OrderedDict[str, UserParagraphIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def embed_many(self, texts: Sequence[str]) -> List[np.ndarray]:
+        if self._embed_many is None:
+            from utils.embeddings import get_embedding_service
+
+            self._embed_many = get_embedding_service().embed_many
+        return self._embed_many(texts)
+
+    def get(self, user_id: str) -> Optional[UserParagraphIndex]:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+            return index
+
+    def sync(self, user_id: str, profile: dict) -> UserParagraphIndex:
+        """Make the user's index match the paragraphs in `profile`, embedding only new ones."""
+        wanted = _paragraphs(profile)
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                index = self._users[user_id] = UserParagraphIndex()
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(user_id)
+            current = index.keys()
+        wanted_set = set(wanted)
+        missing = [entry for entry in wanted if entry not in current]
+        vectors = self.embed_many([text for _, text in missing]) if missing else []
+        with self._lock:
+            index.remove([entry for entry in current if entry not in wanted_set])
+            fresh = [(entry, v) for entry, v in zip(missing, vectors) if entry not in index.keys()]
+            index.add([e for e, _ in fresh], [v for _, v in fresh])
+        return index
+
+    def refresh(self, user_id: str, profile: dict) -> None:
+        """
+        Bring the user's index up to date with `profile`, for the background job.
+
+        Without an index in this process the paragraphs are only embedded:
+        that fills the shared embedding cache, so the next turn's `sync` (in
+        whichever worker serves it) needs no embedding call.
+        """
+        if self.get(user_id) is not None:
+            self.sync(user_id, profile)
+            return
+        paragraphs = _paragraphs(profile)
+        if len(paragraphs) > PROFILE_CONTEXT_TOP_K:
+            self.embed_many([text for _, text in paragraphs])
+
+    def relevant_paragraphs(self, user_id: str, profile: dict, query: str, k: int = PROFILE_CONTEXT_TOP_K) -> Dict[str, List[str]]:
+        """
+        Return the `k` paragraphs most similar to `query`, grouped by field.
+
+        Profiles with at most `k` paragraphs are returned whole without
+        embedding anything.
+        """
+        paragraphs = _paragraphs(profile)
+        if len(paragraphs) <= k:
+            chosen = paragraphs
+        else:
+            index = self.sync(user_id, profile)
+            query_vector = self.embed_many([query])[0]
+            chosen = [(field, text) for field, text, _ in index.search(query_vector, k)]
+        grouped: Dict[str, List[str]] = {}
+        for field, text in chosen:
+            grouped.setdefault(field, []).append(text)
+        return grouped
+
+
+_default_index = ProfileParagraphIndex()
+
+
+def get_profile_index() -> ProfileParagraphIndex:
+    return _default_index
@@ -0,0 +1,133 @@
+"""
+Field layout of stored profiles.
+
+`new_profile` is the document `/create-user` writes (the fields the agent
+fills in); `preference_profile` is the job-preference document
+`/reset-profile` writes.  Other modules use the field lists here instead
+of re-declaring the schema.  `validate_profile` checks externally supplied
+documents (bulk import) against the same fields.
+"""
+
+from utils.canonical_terms import CANONICAL_FIELDS, canonical_list
+
+STRING_FIELDS = ("name", "headline", "summary", "current_title", "current_company", "location")
+LIST_FIELDS = (
+    "skills",
+    "tools",
+    "strengths",
+    "industries",
+    "experience_paragraphs",
+    "project_paragraphs",
+    "custom_profile_notes",
+)
+
+# Fields older profiles may still carry; nothing reads them any more.
+# Pending questions live in their own queue (utils.pending_questions).
+LEGACY_FIELDS = ("pending_questions",)
+
+
+def new_profile(user_id: str, name: str = "") -> dict:
+    """Default profile for a newly created user."""
+    profile = {"user_id": user_id}
+    profile.update({field: "" for field in STRING_FIELDS})
+    profile["name"] = name
+    profile.update({field: [] for field in LIST_FIELDS})
+    return profile
+
+
+def preference_profile(user_id: str) -> dict:
+    """Default job-preference fields written by a profile reset."""
+    return {
+        "job_titles": [],
+        "locations": [],
+        "required_skills": [],
+        "industries": [],
+        "employment_type": "",
+        "experience_level": "",
+        "certifications": [],
+        "must_have_keywords": [],
+        "excluded_keywords": [],
+        "education": [],
+        "preferred_company_types": [],
+        "language_preferences": [],
+        "remote_flexibility": "flexible",
+        "minimum_salary_expectation": "",
+        "resume_version_notes": "",
+        "summary_profile": "",
+        "experience_paragraphs": [],
+        "project_paragraphs": [],
+        "strengths_paragraphs": [],
+        "custom_profile_notes": "",
+        "user_id": user_id,
+    }
+
+
+def is_default_value(field: str, value) -> bool:
+    """True if `value` carries no information: empty, or the schema's own default for `field`."""
+    if value is None or value == "" or value == [] or value == {}:
+        return True
+    return field in _NON_EMPTY_DEFAULTS and _NON_EMPTY_DEFAULTS[field] == value
+
+
+_NON_EMPTY_DEFAULTS = {
+    field: value
+    for field, value in {**new_profile(""), **preference_profile("")}.items()
+    if value not in ("", [], {}, None) and field != "user_id"
+}
+
+
+class ProfileValidationError(ValueError):
+    """An externally supplied profile does not match the schema."""
+
+
+def _field_types() -> dict:
+    types: dict = {}
+    for defaults in (new_profile(""), preference_profile("")):
+        for field, value in defaults.items():
+            types[field] = types.get(field, ()) + (type(value),)
+    # Written by cosmos_profile.create_empty_profile for profiles created by the tools.
+    types["employment_type"] += (list,)
+    types["soft_preferences"] = (dict,)
+    types["id"] = (str,)
+    return types
+
+
+_FIELD_TYPES = _field_types()
+# Fields outside the schema, as `SetStringField` and `AddToListField` write them.
+_CUSTOM_FIELD_TYPES = (str, list)
+
+
+def validate_profile(record) -> dict:
+    """
+    Check an imported record and return the document to store.
+
+    The record needs a non-empty `user_id` (or `id`).  Fields the profile
+    schema knows must have a value of the schema's type (lists of strings
+    for list fields); other fields, which the agent's tools may have added,
+    must be a string or a list of strings.  Cosmos system properties
+    (`_etag`, `_ts`, ...) and fields of older layouts (`LEGACY_FIELDS`) are
+    dropped, so exported documents import unchanged.  Skills, tools and
+    industries are canonicalized as the tools store them.  Fields the
+    record leaves out get their `new_profile` defaults.
+    """
+    if not isinstance(record, dict):
+        raise ProfileValidationError("record is not a JSON object")
+    user_id = record.get("user_id") or record.get("id")
+    if not isinstance(user_id, str) or not user_id.strip():
+        raise ProfileValidationError("missing user_id")
+    if record.get("id", user_id) != user_id:
+        raise ProfileValidationError("id and user_id differ")
+    doc = new_profile(user_id)
+    for field, value in record.items():
+        if field.startswith("_") or field in LEGACY_FIELDS:
+            continue
+        allowed = _FIELD_TYPES.get(field, _CUSTOM_FIELD_TYPES)
+        if not isinstance(value, allowed):
+            expected = " or ".join(t.__name__ for t in dict.fromkeys(allowed))
+            raise ProfileValidationError(f"{field} must be {expected}, not {type(value).__name__}")
+        if isinstance(value, list) and not all(isinstance(item, str) for item in value):
+            raise ProfileValidationError(f"{field} must be a list of strings")
+        doc[field] = canonical_list(field, value) if field in CANONICAL_FIELDS else value
+    doc["id"] = user_id
+    doc["user_id"] = user_id
+    return doc
@@ -0,0 +1,235 @@
+"""
+Compact, token-budgeted rendering of a profile for the model prompt.
+
+Every input token adds latency and cost to each model call, so the
+profile is rendered as minified JSON with empty and default-valued fields
+dropped, in a fixed field order (stable output also keeps the provider's
+prompt cache warm).  If the result would exceed the token budget, the
+lowest-priority fields are trimmed first: list fields lose items from the
+end and long strings are cut, before any field is dropped outright.
+
+Renders are memoised per profile version (`_etag`), so an unchanged
+profile is not re-serialised and re-counted on every turn.
+
+Tokens are counted with tiktoken's local BPE tables (ship them with the
+app via `TIKTOKEN_CACHE_DIR` to avoid a download on first use); if the
+tokenizer cannot be loaded, counts fall back to a chars/4 estimate.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.profile_schema import is_default_value
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROFILE_CONTEXT_TOKEN_BUDGET", "800"))
+PROFILE_CONTEXT_CACHE_SIZE = int(os.getenv("PROFILE_CONTEXT_CACHE_SIZE", "4096"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+# Highest priority first; fields not listed come after these, alphabetically.
+FIELD_PRIORITY = (
+    "name",
+    "current_title",
+    "current_company",
+    "headline",
+    "location",
+    "skills",
+    "tools",
+    "industries",
+    "strengths",
+    "job_titles",
+    "locations",
+    "required_skills",
+    "experience_level",
+    "employment_type",
+    "remote_flexibility",
+    "summary",
+    "experience_paragraphs",
+    "project_paragraphs",
+    "certifications",
+    "education",
+    "must_have_keywords",
+    "excluded_keywords",
+)
+# Fields with no value to the model: identifiers and the pending questions,
+# which the prompt preamble already carries.
+EXCLUDED_FIELDS = frozenset({"id", "user_id", "pending_questions"})
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    logger.warning("Tokenizer unavailable, estimating tokens from length: %s", e)
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of model tokens in `text` (approximated as chars/4 without a tokenizer)."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def clip_tokens(text: str, limit: int) -> str:
+    """`text` cut to at most `limit` tokens, with an ellipsis if anything was cut."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text if len(text) <= limit * 4 else text[:max(0, limit * 4 - 1)] + "…"
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= limit:
+        return text
+    return encoding.decode(tokens[:max(0, limit - 1)]) + "…"
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _prune(value: Any) -> Any:
+    """Drop empty members of nested dicts and lists."""
+    if isinstance(value, dict):
+        pruned = {k: _prune(v) for k, v in value.items()}
+        return {k: v for k, v in pruned.items() if not is_default_value(k, v)}
+    if isinstance(value, list):
+        return [v for v in (_prune(v) for v in value) if v not in ("", None, [], {})]
+    return value
+
+
+def compact_fields(profile: dict) -> List[Tuple[str, Any]]:
+    """Non-default fields of `profile` as (name, value) pairs in priority order."""
+    rank = {field: i for i, field in enumerate(FIELD_PRIORITY)}
+    fields = []
+    for key, value in profile.items():
+        if key in EXCLUDED_FIELDS or key.startswith("_"):
+            continue
+        value = _prune(value)
+        if is_default_value(key, value):
+            continue
+        fields.append((key, value))
+    fields.sort(key=lambda item: (rank.get(item[0], len(rank)), item[0]))
+    return fields
+
+
+def _fit(key: str, value: Any, budget: int) -> Optional[Any]:
+    """Largest prefix of `value` whose `"key":value,` member fits in `budget` tokens."""
+    cost = count_tokens(f"{_encode(key)}:{_encode(value)},")
+    if cost <= budget:
+        return value
+    if isinstance(value, list):
+        # Binary search on the number of leading items kept.
+        lo, hi = 0, len(value) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if count_tokens(f"{_encode(key)}:{_encode(value[:mid])},") <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        return value[:lo] if lo else None
+    if isinstance(value, str):
+        overhead = count_tokens(f"{_encode(key)}:\"…\",")
+        if budget <= overhead:
+            return None
+        encoding = _get_encoding()
+        if encoding is not None:
+            cut = encoding.decode(encoding.encode(value, disallowed_special=())[: budget - overhead])
+        else:
+            cut = value[: (budget - overhead) * 4]
+        # Escaping can make the JSON longer than the raw text; shrink until it fits.
+        while cut and count_tokens(f"{_encode(key)}:{_encode(cut + '…')},") > budget:
+            cut = cut[: int(len(cut) * 0.9)]
+        return cut + "…" if cut else None
+    return None
+
+
+def render_fields(fields: Sequence[Tuple[str, Any]], budget: int) -> str:
+    """Minified JSON object of `fields`, trimmed to at most `budget` tokens."""
+    remaining = budget - 2  # braces
+    kept: Dict[str, Any] = {}
+    for key, value in fields:
+        if remaining <= 0:
+            break
+        fitted = _fit(key, value, remaining)
+        if fitted is None:
+            continue
+        kept[key] = fitted
+        remaining -= count_tokens(f"{_encode(key)}:{_encode(fitted)},")
+    text = _encode(kept)
+    # Per-member counts are an estimate of the joined count; enforce the budget.
+    while kept and count_tokens(text) > budget:
+        kept.popitem()
+        text = _encode(kept)
+    return text
+
+
+class ProfileContextRenderer:
+    """
+    Memoising wrapper around `render_fields`.
+
+    Args:
+        budget: Token budget for the rendered profile.
+        cache_size: Number of renders remembered.
+    """
+
+    def __init__(self, budget: int = PROFILE_CONTEXT_TOKEN_BUDGET, cache_size: int = PROFILE_CONTEXT_CACHE_SIZE):
+        self.budget = budget
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, profile: dict, overrides: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Render `profile` with `overrides` (e.g. the prompt-relevant subset of
+        paragraphs) replacing the corresponding fields.
+
+        Profiles without an `_etag` are rendered every time.
+        """
+        overrides = overrides or {}
+        version = profile.get("_etag")
+        key = None
+        if version is not None:
+            key = (profile.get("id") or profile.get("user_id"), version, self.budget, _encode(overrides))
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return cached
+        text = render_fields(compact_fields({**profile, **overrides}), self.budget)
+        with self._lock:
+            self.misses += 1
+            if key is not None:
+                self._cache[key] = text
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return text
+
+
+_default_renderer = ProfileContextRenderer()
+
+
+def render_profile_context(profile: dict, overrides: Optional[Dict[str, Any]] = None) -> str:
+    """Render `profile` for the prompt with the process-wide renderer."""
+    return _default_renderer.render(profile, overrides)
@@ -0,0 +1,259 @@
+"""
+Cache of agent turns keyed by prompt, profile version and model config.
+
+Retries, double submits and the frontend's canned onboarding prompts send
+the same text against the same profile again and again.  The model's
+answer to those is fixed by three things: the prompt, the profile the
+model sees (identified by its Cosmos `_etag`) and the model configuration
+(deployment, temperature, system prompt, tools).  `ResponseCache` stores
+the reply and the tool calls the model planned under a hash of all three,
+so a repeat can replay the plan through the profile tools without calling
+the model.
+
+Entries live in a bounded in-memory LRU with a TTL.  Setting
+`RESPONSE_CACHE_PATH` adds a SQLite file behind it, which every worker on
+the machine reads and writes, so a retry that lands on a different worker
+still hits.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+RESPONSE_CACHE_STORE_ROWS = int(os.getenv("RESPONSE_CACHE_STORE_ROWS", "100000"))
+RESPONSE_CACHE_PURGE_EVERY = int(os.getenv("RESPONSE_CACHE_PURGE_EVERY", "500"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class CachedResponse(NamedTuple):
+    """A cached turn: the reply, the planned tool calls and how long the model took."""
+    reply: str
+    tool_calls: List[Dict[str, Any]]
+    latency: float
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Unicode-normalise and collapse whitespace; case is kept since values are stored verbatim."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", prompt)).strip()
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """Stable hash of the model configuration, so a config change starts a fresh key space."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def cache_key(user_id: str, prompt: str, version: str, fingerprint: str) -> str:
+    text = "\0".join((fingerprint, user_id, version, normalize_prompt(prompt)))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SQLiteResponseStore:
+    """
+    Response entries in a SQLite file shared by the workers on one machine.
+
+    Every `purge_every` puts the store deletes expired rows and, past
+    `max_rows`, the rows closest to expiry, so the file stays bounded.
+    """
+
+    def __init__(self, path: str, max_rows: int = RESPONSE_CACHE_STORE_ROWS, purge_every: int = RESPONSE_CACHE_PURGE_EVERY):
+        self.path = path
+        self.max_rows = max_rows
+        self.purge_every = max(1, purge_every)
+        self._puts = 0
+        self._puts_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key: str, now: float) -> Optional[tuple]:
+        row = self._connect().execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return CachedResponse(**json.loads(row[0])), row[1]
+
+    def put(self, key: str, entry: CachedResponse, expires: float) -> None:
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(entry._asdict()), expires),
+        )
+        with self._puts_lock:
+            self._puts += 1
+            due = self._puts % self.purge_every == 0
+        if due:
+            self.purge(time.time())
+
+    def purge(self, now: float) -> int:
+        """Delete expired rows, then the soonest-expiring rows beyond `max_rows`; returns the rows deleted."""
+        db = self._connect()
+        deleted = db.execute("DELETE FROM responses WHERE expires <= ?", (now,)).rowcount
+        if self.max_rows > 0:
+            deleted += db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            ).rowcount
+        return deleted
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of agent turns.
+
+    Args:
+        ttl: Seconds an entry stays valid.
+        maxsize: Entries kept in memory.
+        store_path: Optional SQLite file shared across workers.
+        clock: Time source, for tests.
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        store_path: str = "",
+        clock=time.monotonic,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.store = SQLiteResponseStore(store_path) if store_path else None
+        # Shared entries outlive the process, so they expire on wall-clock time.
+        self._clock = clock if self.store is None else time.time
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: str, prompt: str, version: Optional[str], fingerprint: str) -> Optional[CachedResponse]:
+        """The cached turn for this prompt against profile `version`, or None."""
+        if not version or self.maxsize <= 0:
+            return None
+        key = cache_key(user_id, prompt, version, fingerprint)
+        now = self._clock()
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None and found[1] <= now:
+                del self._entries[key]
+                found = None
+            if found is not None:
+                self._entries.move_to_end(key)
+        if found is None and self.store is not None:
+            try:
+                found = self.store.get(key, now)
+            except sqlite3.Error as e:
+                logger.error("Response cache store read failed: %s", e)
+                found = None
+            if found is not None:
+                self._remember(key, found)
+                with self._lock:
+                    self.store_hits += 1
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += found[0].latency
+        return found[0]
+
+    def put(self, user_id: str, prompt: str, versions, fingerprint: str, entry: CachedResponse) -> None:
+        """Store `entry` under each profile version in `versions` (None entries are skipped)."""
+        if self.maxsize <= 0:
+            return
+        expires = self._clock() + self.ttl
+        for version in dict.fromkeys(v for v in versions if v):
+            key = cache_key(user_id, prompt, version, fingerprint)
+            self._remember(key, (entry, expires))
+            if self.store is not None:
+                try:
+                    self.store.put(key, entry, expires)
+                except sqlite3.Error as e:
+                    logger.error("Response cache store write failed: %s", e)
+
+    def _remember(self, key: str, found: tuple) -> None:
+        with self._lock:
+            self._entries[key] = found
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and model time saved by hits since the cache was created."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "memory_entries": len(self._entries),
+        }
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide cache configured from the environment."""
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = ResponseCache(store_path=RESPONSE_CACHE_PATH)
+    return _default_cache
+
+
+def _collect_stats():
+    if _default_cache is None:
+        return []
+    stats = _default_cache.stats()
+    return [
+        ("zil_response_cache_hits_total", "counter", "Agent turns answered from the response cache.", {}, stats["hits"]),
+        ("zil_response_cache_misses_total", "counter", "Response cache lookups that went to the model.", {}, stats["misses"]),
+        ("zil_response_cache_saved_seconds_total", "counter", "Model time saved by response cache hits.", {}, stats["saved_seconds"]),
+    ]
+
+
+REGISTRY.add_collector(_collect_stats)
@@ -0,0 +1,177 @@
+"""
+Splitting a pasted resume into chunks and merging what the model
+extracts from each of them.
+
+Sent through `/chat` in one piece, a multi-page resume makes one long
+function-calling pass that is slow and gets truncated. Ingestion uses
+this module in three steps:
+
+1. `split_resume` cuts the document at lines that name one of the
+   `SECTION_HEADINGS` ("Experience", "PROJECTS", "Skills:" ...). A
+   section longer than `RESUME_CHUNK_TOKENS` is cut further between
+   entries (blank lines), then between lines.
+2. The caller plans each chunk with the agent concurrently (see
+   `agent.ingest_resume`). The turn's wall time is therefore about that
+   of the longest chunk.
+3. `merge_tool_calls` combines the planned calls in chunk order, so the
+   result does not depend on which chunk finished first. It drops
+   duplicates and conflicting string values: the first chunk to set a
+   field wins, and the header usually comes first.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from utils.prompt_context import clip_tokens, count_tokens
+
+RESUME_CHUNK_TOKENS = int(os.getenv("RESUME_CHUNK_TOKENS", "700"))
+RESUME_MAX_CHUNKS = int(os.getenv("RESUME_MAX_CHUNKS", "24"))
+
+# Title given to text before the first heading (name, contact line, headline).
+HEADER_SECTION = "Header"
+
+SECTION_HEADINGS = frozenset({
+    "about", "about me", "summary", "professional summary", "profile", "objective", "career objective",
+    "experience", "work experience", "professional experience", "employment", "employment history",
+    "work history", "career history", "relevant experience",
+    "projects", "selected projects", "personal projects", "key projects",
+    "education", "certifications", "certificates", "licenses and certifications", "training",
+    "skills", "technical skills", "core skills", "key skills", "core competencies", "competencies",
+    "tools", "technologies", "tools and technologies", "languages",
+    "awards", "achievements", "honors", "publications", "volunteering", "volunteer experience",
+    "interests", "references", "strengths",
+})
+
+# Tools a resume has no business calling: it only ever adds to a profile.
+_DROPPED_TOOLS = frozenset({"RemoveFromListField", "RemovePendingQuestion"})
+
+_BULLET = re.compile(r"^[\s\-*•·▪‣◦]+")
+
+
+class ResumeTooLong(ValueError):
+    """The document splits into more than `RESUME_MAX_CHUNKS` chunks."""
+
+
+class Chunk(NamedTuple):
+    index: int
+    section: str
+    text: str
+    part: int  # 1-based part of the section
+    parts: int
+
+
+def _heading(line: str) -> Optional[str]:
+    """The section title if `line` is a heading, else None."""
+    text = _BULLET.sub("", line).strip().rstrip(":").strip()
+    if not text or len(text) > 40 or text.endswith("."):
+        return None
+    # Only known titles: an all-caps line is as likely a name ("JANE DOE"),
+    # an employer or a skills list as a heading.
+    if text.lower() in SECTION_HEADINGS:
+        return text.title() if text.isupper() else text
+    return None
+
+
+def split_sections(text: str) -> List[tuple]:
+    """(title, body) for every non-empty section of `text`, in document order."""
+    sections = []
+    title, lines = HEADER_SECTION, []
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        heading = _heading(line)
+        if heading is None:
+            lines.append(line.rstrip())
+            continue
+        sections.append((title, "\n".join(lines).strip()))
+        title, lines = heading, []
+    sections.append((title, "\n".join(lines).strip()))
+    return [(title, body) for title, body in sections if body]
+
+
+def _pack(pieces: Iterable[str], separator: str, budget: int) -> List[str]:
+    """Greedily join `pieces` into runs of at most `budget` tokens; oversized pieces are returned alone."""
+    runs: List[str] = []
+    current: List[str] = []
+    size = 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and size + tokens > budget:
+            runs.append(separator.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+    if current:
+        runs.append(separator.join(current))
+    return runs
+
+
+def _split_body(body: str, budget: int) -> List[str]:
+    if count_tokens(body) <= budget:
+        return [body]
+    pieces = []
+    for entry in _pack(re.split(r"\n\s*\n", body), "\n\n", budget):
+        if count_tokens(entry) <= budget:
+            pieces.append(entry)
+            continue
+        for run in _pack(entry.split("\n"), "\n", budget):
+            # A single line longer than the budget is all that is left to cut.
+            pieces.append(clip_tokens(run, budget))
+    return pieces
+
+
+def split_resume(text: str, budget: int = RESUME_CHUNK_TOKENS, max_chunks: int = RESUME_MAX_CHUNKS) -> List[Chunk]:
+    """Cut `text` into chunks of at most `budget` tokens along its sections."""
+    chunks: List[Chunk] = []
+    for title, body in split_sections(text):
+        parts = _split_body(body, budget)
+        for part, piece in enumerate(parts, 1):
+            chunks.append(Chunk(len(chunks), title, piece, part, len(parts)))
+    if len(chunks) > max_chunks:
+        raise ResumeTooLong(f"resume splits into {len(chunks)} chunks, at most {max_chunks} are allowed")
+    return chunks
+
+
+def _normalize(value: Any) -> str:
+    return " ".join(str(value).split()).strip(" .;,").casefold()
+
+
+def merge_tool_calls(planned: Sequence[Sequence[Dict[str, Any]]], profile: Optional[dict] = None) -> List[Dict[str, Any]]:
+    """
+    Combine the calls planned for each chunk (`planned[i]` for chunk i)
+    into one deduplicated list.
+
+    - List items are compared case- and whitespace-insensitively. Items
+      already in `profile` are dropped.
+    - The first chunk to set a string field wins.
+    - Removals are dropped.
+    - Everything else is kept once, in chunk order.
+    """
+    profile = profile or {}
+    seen = {
+        (field, _normalize(item))
+        for field, values in profile.items()
+        if isinstance(values, list)
+        for item in values
+        if isinstance(item, str)
+    }
+    merged = []
+    for calls in planned:
+        for call in calls:
+            tool, args = call["tool"], call.get("args")
+            if tool in _DROPPED_TOOLS or not isinstance(args, dict):
+                continue
+            if tool == "AddToListField":
+                key = (args.get("field_name"), _normalize(args.get("item", "")))
+            elif tool == "SetStringField":
+                key = ("set", args.get("field_name"))
+            elif tool == "AddPendingQuestion":
+                key = ("question", _normalize(args.get("question", "")))
+            else:
+                key = (tool, repr(sorted(args.items())))
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(call)
+    return merged
@@ -0,0 +1,231 @@
+"""
+Plan/act loop that runs the agent's tool calls.
+
+The agent runnable only plans: given the turn so far it returns either
+tool calls or a final answer.  `ToolLoop` drives it: it executes the
+planned calls, feeds their results back as intermediate steps and asks
+again, until the model answers or a budget runs out.
+
+- Step budget: at most `AGENT_MAX_STEPS` model calls per turn.
+- Time budget: no further model call is started once `AGENT_TIME_BUDGET`
+  seconds have passed.
+
+When a budget is exhausted the turn ends early and the caller replies
+with the tool results so far.  Callers that plan many turns together
+(the chat batch) drive each one with `start` and `advance` instead of
+`run`.
+
+Calls the model plans in one step are made without seeing each other's
+results, so they are independent and run concurrently on a small thread
+pool; only calls with the same conflict key (by default the profile
+field they edit) keep their planned order.  Identical calls within a step
+are executed once.  Tools run in a copy of the caller's context, so
+context-bound state such as the current user and profile turn carries
+over.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from utils.metrics import AGENT_BUDGET_EXHAUSTED, AGENT_STEPS, TOOL_CALLS, span
+
+logger = logging.getLogger(__name__)
+
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "4"))
+AGENT_TIME_BUDGET = float(os.getenv("AGENT_TIME_BUDGET", "30"))
+TOOL_MAX_PARALLEL = int(os.getenv("TOOL_MAX_PARALLEL", "8"))
+
+ToolCall = Dict[str, Any]  # {"tool": name, "args": {...}}
+# plan(intermediate_steps) -> AgentFinish, an AgentAction or a list of AgentActions.
+Plan = Callable[[List[tuple]], Any]
+StepListener = Callable[[List[ToolCall], List[str]], None]
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=TOOL_MAX_PARALLEL, thread_name_prefix="tool")
+    return _pool
+
+
+class LoopResult(NamedTuple):
+    """Outcome of a turn: the model's final answer ("" if it never gave one) and every tool call made."""
+    reply: str
+    tool_calls: List[ToolCall]
+    outputs: List[str]
+    steps: int
+    exhausted: Optional[str]  # "steps" or "time" if a budget ended the turn
+
+
+def response_text(response: Any) -> str:
+    if hasattr(response, "return_values"):
+        return str(response.return_values.get("output", ""))
+    return response.content if hasattr(response, "content") else str(response)
+
+
+def planned_actions(response: Any) -> list:
+    """The tool calls (AgentActions) in a plan; empty for a final answer."""
+    from langchain_core.agents import AgentAction
+
+    items = response if isinstance(response, list) else [response]
+    return [item for item in items if isinstance(item, AgentAction)]
+
+
+def tool_call(action: Any) -> ToolCall:
+    return {"tool": action.tool, "args": action.tool_input}
+
+
+def default_conflict_key(call: ToolCall) -> str:
+    args = call["args"]
+    if isinstance(args, dict) and "field_name" in args:
+        return str(args["field_name"])
+    return call["tool"]
+
+
+class ToolLoop:
+    """
+    Executes tool calls and drives the plan/act loop for one set of tools.
+
+    Args:
+        tools: Tools by name; each needs an `invoke(args)` method.
+        max_steps: Model calls allowed per turn.
+        time_budget: Seconds after which no new model call is started.
+        conflict_key: Calls with the same key run sequentially, in order.
+        clock: Time source, for tests.
+    """
+
+    def __init__(
+        self,
+        tools: Dict[str, Any],
+        max_steps: int = AGENT_MAX_STEPS,
+        time_budget: float = AGENT_TIME_BUDGET,
+        conflict_key: Callable[[ToolCall], str] = default_conflict_key,
+        clock=time.monotonic,
+    ):
+        self.tools = tools
+        self.max_steps = max_steps
+        self.time_budget = time_budget
+        self.conflict_key = conflict_key
+        self._clock = clock
+
+    def _invoke(self, call: ToolCall) -> str:
+        name = call["tool"]
+        try:
+            with span(f"tool:{name}"):
+                output = str(self.tools[name].invoke(call["args"]))
+            TOOL_CALLS.inc(tool=name, outcome="ok")
+            return output
+        except Exception as e:
+            # Reported back to the model, which can retry or explain.
+            logger.error("Tool %s failed: %s", name, e)
+            TOOL_CALLS.inc(tool=name, outcome="error")
+            return f"{name} failed: {e}"
+
+    def execute(self, calls: List[ToolCall]) -> List[str]:
+        """Run `calls`, concurrently where independent; returns the outputs in call order."""
+        outputs: List[Optional[str]] = [None] * len(calls)
+        first_of: Dict[str, int] = {}
+        duplicates: Dict[int, int] = {}
+        groups: Dict[str, List[int]] = {}
+        for i, call in enumerate(calls):
+            identity = json.dumps([call["tool"], call["args"]], sort_keys=True, default=str)
+            if identity in first_of:
+                duplicates[i] = first_of[identity]
+                TOOL_CALLS.inc(tool=call["tool"], outcome="coalesced")
+                continue
+            first_of[identity] = i
+            groups.setdefault(self.conflict_key(call), []).append(i)
+
+        def run_group(indices: List[int]) -> None:
+            for i in indices:
+                outputs[i] = self._invoke(calls[i])
+
+        if len(groups) <= 1:
+            for indices in groups.values():
+                run_group(indices)
+        else:
+            pool = _get_pool()
+            futures = [pool.submit(contextvars.copy_context().run, run_group, indices) for indices in groups.values()]
+            for future in futures:
+                future.result()
+        for i, first in duplicates.items():
+            outputs[i] = outputs[first]
+        return [output or "" for output in outputs]
+
+    def _finish(self, step: int, calls: List[ToolCall], outputs: List[str], reply: str, exhausted: Optional[str]) -> LoopResult:
+        AGENT_STEPS.observe(step)
+        if exhausted:
+            AGENT_BUDGET_EXHAUSTED.inc(budget=exhausted)
+        return LoopResult(reply, calls, outputs, step, exhausted)
+
+    def _out_of_time(self, started: float) -> bool:
+        return self._clock() - started >= self.time_budget
+
+    def start(self) -> "LoopState":
+        """Begin a turn to be driven step by step with `advance`."""
+        return LoopState(self._clock())
+
+    def advance(self, state: "LoopState", response: Any, on_step: Optional[StepListener] = None) -> Optional[LoopResult]:
+        """
+        Take the model's next plan for the turn in `state`.
+
+        Returns the result if the turn is over (a final answer or an
+        exhausted budget); otherwise runs the planned tool calls and returns
+        None, and the model should plan again with `state.steps`.
+        """
+        state.step += 1
+        actions = planned_actions(response)
+        if not actions:
+            return self._finish(state.step, state.calls, state.outputs, response_text(response), None)
+        step_calls = [tool_call(action) for action in actions]
+        step_outputs = self.execute(step_calls)
+        if on_step is not None:
+            on_step(step_calls, step_outputs)
+        state.calls += step_calls
+        state.outputs += step_outputs
+        state.steps += zip(actions, step_outputs)
+        if state.step >= self.max_steps:
+            return self._finish(state.step, state.calls, state.outputs, "", "steps")
+        if self._out_of_time(state.started):
+            return self._finish(state.step, state.calls, state.outputs, "", "time")
+        return None
+
+    def run(self, plan: Plan, on_step: Optional[StepListener] = None) -> LoopResult:
+        """Plan and act until the model answers or a budget is exhausted."""
+        state = self.start()
+        while True:
+            result = self.advance(state, plan(list(state.steps)), on_step)
+            if result is not None:
+                return result
+
+    async def arun(self, plan: Callable[[List[tuple]], Awaitable[Any]]) -> LoopResult:
+        """Async variant of `run`; tools run off the event loop."""
+        state = self.start()
+        while True:
+            response = await plan(list(state.steps))
+            result = await asyncio.to_thread(self.advance, state, response)
+            if result is not None:
+                return result
+
+
+class LoopState:
+    """A turn in progress: the model calls made so far and the tool calls they planned."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.step = 0
+        self.steps: List[tuple] = []
+        self.calls: List[ToolCall] = []
+        self.outputs: List[str] = []